@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк кодеков хранения векторов: память, задержка поиска и потеря recall.
+
+Для выбранного типа индекса строит варианты с кодеками none (float32), fp16, int8 и pq
+(vector_index.py) по векторам собранного индекса и сравнивает их с точным поиском
+по float32. Для каждого варианта выводит байты на вектор, размер индекса, время построения,
+recall@k, потерю recall относительно точного поиска и задержку одного запроса.
+
+Использование:
+    python benchmarks/codecs.py [--index-dir DIR] [--index-type flat|ivf|hnsw] [--pq-m M ...] [--output FILE]
+"""
+
+import sys
+import json
+import argparse
+from datetime import datetime
+
+# index_types добавляет корень проекта в sys.path, поэтому импортируется первым
+from index_types import build, index_size, load_vectors, make_queries, measure
+import vector_index  # noqa: E402
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Сравнение кодеков хранения векторов FAISS.')
+    parser.add_argument('--index-dir', default="./index", help='Директория с индексом (по умолчанию: ./index)')
+    parser.add_argument('--index-type', choices=vector_index.INDEX_TYPES, default='flat',
+                        help='Тип индекса, для которого сравниваются кодеки (по умолчанию: flat)')
+    parser.add_argument('--pq-m', type=int, nargs='+', default=[48, vector_index.DEFAULT_PQ_M, 192],
+                        help='Значения pq_m для PQ (по умолчанию: 48 96 192)')
+    parser.add_argument('--queries', type=int, default=200, help='Число запросов (по умолчанию: 200)')
+    parser.add_argument('--k', type=int, default=10, help='Глубина поиска для recall@k (по умолчанию: 10)')
+    parser.add_argument('--seed', type=int, default=42, help='Зерно генератора запросов')
+    parser.add_argument('--output', help='Сохранить результаты в JSON файл')
+    return parser.parse_args()
+
+
+def run(args):
+    vectors = load_vectors(args.index_dir)
+    queries = make_queries(vectors, args.queries, args.seed)
+
+    exact, _, _ = build(vectors, "flat")
+    _, truth = exact.search(queries, args.k)
+
+    variants = [("none", {}), ("fp16", {}), ("int8", {})]
+    variants += [("pq", {"pq_m": pq_m}) for pq_m in args.pq_m if vectors.shape[1] % pq_m == 0]
+    skipped = [pq_m for pq_m in args.pq_m if vectors.shape[1] % pq_m]
+    if skipped:
+        print(f"pq_m {skipped} не делят размерность {vectors.shape[1]} и пропущены; "
+              f"подходит, например, {vector_index.default_pq_m(vectors.shape[1])}")
+
+    results = []
+    for codec, options in variants:
+        index, params, build_seconds = build(vectors, args.index_type, codec=codec, **options)
+        row = measure(index, queries, args.k, truth)
+        row.update({
+            "codec": codec,
+            "params": params,
+            "bytes_per_vector": int(vector_index.bytes_per_vector(index)),
+            "size_mb": round(index_size(index) / 2**20, 2),
+            "build_seconds": build_seconds,
+        })
+        row["recall_loss"] = round(1 - row[f"recall@{args.k}"], 4)
+        results.append(row)
+    return vectors.shape, results
+
+
+def main_cli():
+    args = parse_arguments()
+    shape, results = run(args)
+
+    print(f"\nВекторов: {shape[0]}, размерность: {shape[1]}, тип индекса: {args.index_type}")
+    print(f"{'Кодек':<12} {'Байт/вектор':>12} {'Размер, МБ':>11} {'Recall@' + str(args.k):>10} {'Потеря':>8} "
+          f"{'Ср., мс':>9} {'p95, мс':>9} {'Сборка, с':>10}")
+    for row in results:
+        name = row["codec"] if row["codec"] != "pq" else f"pq m={row['params']['pq_m']}"
+        print(f"{name:<12} {row['bytes_per_vector']:>12} {row['size_mb']:>11} {row[f'recall@{args.k}']:>10} "
+              f"{row['recall_loss']:>8} {row['avg_ms']:>9} {row['p95_ms']:>9} {row['build_seconds']:>10}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                "created_at": datetime.now().isoformat(),
+                "index_dir": args.index_dir,
+                "index_type": args.index_type,
+                "vector_count": shape[0],
+                "dimension": shape[1],
+                "k": args.k,
+                "results": results,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
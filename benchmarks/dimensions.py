@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк укороченных эмбеддингов и двухэтапного поиска с переранжированием.
+
+По полным векторам собранного индекса строит flat индексы укороченной размерности
+(vector_index.reduce_dimensions) и сравнивает поиск по ним с точным поиском по полным векторам:
+одноэтапный (только укороченные векторы) и двухэтапный (кандидаты по укороченным, затем
+vector_index.rescore по полным векторам из full_vectors.npy через mmap). Для каждого варианта
+выводит recall@k, среднюю и p95 задержку, размер индекса в памяти и размер полных векторов на диске.
+
+Использование:
+    python benchmarks/dimensions.py [--index-dir DIR] [--dimensions N ...] [--candidates N] [--output FILE]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from datetime import datetime
+
+# index_types добавляет корень проекта в sys.path, поэтому импортируется первым
+from index_types import build, index_size, load_vectors, make_queries
+import numpy as np  # noqa: E402
+import vector_index  # noqa: E402
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Сравнение укороченных эмбеддингов и двухэтапного поиска.')
+    parser.add_argument('--index-dir', default="./index", help='Директория с индексом (по умолчанию: ./index)')
+    parser.add_argument('--dimensions', type=int, nargs='+', default=[256, 512, 768, 1024],
+                        help='Проверяемые размерности (по умолчанию: 256 512 768 1024)')
+    parser.add_argument('--candidates', type=int, default=vector_index.DEFAULT_RESCORE_CANDIDATES,
+                        help=f'Кандидатов для переранжирования (по умолчанию: {vector_index.DEFAULT_RESCORE_CANDIDATES})')
+    parser.add_argument('--queries', type=int, default=200, help='Число запросов (по умолчанию: 200)')
+    parser.add_argument('--k', type=int, default=10, help='Глубина поиска для recall@k (по умолчанию: 10)')
+    parser.add_argument('--seed', type=int, default=42, help='Зерно генератора запросов')
+    parser.add_argument('--output', help='Сохранить результаты в JSON файл')
+    return parser.parse_args()
+
+
+def measure(index, queries, k, truth, full_vectors=None, candidates=0):
+    """Поиск по одному запросу, как в main.dense_search; возвращает recall@k и задержки"""
+    latencies = []
+    hits = 0
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        vector = vector_index.reduce_dimensions(queries[i], index.d)
+        fetch_k = max(k, candidates) if full_vectors is not None else k
+        _, ids = index.search(vector[None, :], fetch_k)
+        positions = [int(position) for position in ids[0] if position != -1]
+        if full_vectors is not None:
+            positions = vector_index.rescore(full_vectors, queries[i], positions, k)
+        latencies.append(time.perf_counter() - start)
+        hits += len(set(positions[:k]) & set(truth[i].tolist()))
+    latencies = np.asarray(latencies) * 1000
+    return {
+        f"recall@{k}": round(hits / (len(queries) * k), 4),
+        "avg_ms": round(float(latencies.mean()), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+    }
+
+
+def run(args):
+    vectors = load_vectors(args.index_dir)
+    queries = make_queries(vectors, args.queries, args.seed)
+    full_dimensions = vectors.shape[1]
+
+    exact, _, _ = build(vectors, "flat")
+    _, truth = exact.search(queries, args.k)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        full_path = os.path.join(tmp_dir, vector_index.FULL_VECTORS_FILE)
+        np.save(full_path, vectors)
+        full_vectors = np.load(full_path, mmap_mode="r")
+        full_size_mb = round(os.path.getsize(full_path) / 2**20, 1)
+
+        results = []
+        row = measure(exact, queries, args.k, truth)
+        row.update({"dimensions": full_dimensions, "mode": "full", "index_mb": round(index_size(exact) / 2**20, 1),
+                    "disk_mb": 0})
+        results.append(row)
+
+        for dimensions in sorted(set(args.dimensions)):
+            if dimensions >= full_dimensions:
+                continue
+            index, _, _ = build(vector_index.reduce_dimensions(vectors, dimensions), "flat")
+            index_mb = round(index_size(index) / 2**20, 1)
+
+            row = measure(index, queries, args.k, truth)
+            row.update({"dimensions": dimensions, "mode": "reduced", "index_mb": index_mb, "disk_mb": 0})
+            results.append(row)
+
+            row = measure(index, queries, args.k, truth, full_vectors, args.candidates)
+            row.update({"dimensions": dimensions, "mode": f"rescore@{args.candidates}", "index_mb": index_mb,
+                        "disk_mb": full_size_mb})
+            results.append(row)
+
+        del full_vectors
+    return vectors.shape, results
+
+
+def main_cli():
+    args = parse_arguments()
+    shape, results = run(args)
+
+    print(f"\nВекторов: {shape[0]}, полная размерность: {shape[1]}, запросов: {min(args.queries, shape[0])}")
+    print(f"{'Размерность':>11} {'Режим':<14} {'Recall@' + str(args.k):>10} {'Ср., мс':>9} {'p95, мс':>9} "
+          f"{'Память, МБ':>11} {'Диск, МБ':>9}")
+    for row in results:
+        print(f"{row['dimensions']:>11} {row['mode']:<14} {row[f'recall@{args.k}']:>10} {row['avg_ms']:>9} "
+              f"{row['p95_ms']:>9} {row['index_mb']:>11} {row['disk_mb']:>9}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                "created_at": datetime.now().isoformat(),
+                "index_dir": args.index_dir,
+                "vector_count": shape[0],
+                "full_dimensions": shape[1],
+                "k": args.k,
+                "candidates": args.candidates,
+                "results": results,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк хранилища чанков: pickle docstore LangChain против chunks.sqlite.
+
+Берет index.pkl из индекса старого формата, строит по нему chunks.sqlite во временной
+директории и в отдельных процессах измеряет время загрузки и прирост собственной памяти
+процесса (RssAnon) для каждого способа,
+а также задержку получения top-k чанков (холодный и горячий LRU).
+
+Использование:
+    python benchmarks/docstore.py [--index-dir DIR] [--k K] [--output FILE]
+
+Нужен index.pkl (индекс, собранный до перехода на chunks.sqlite, или FAISS.save_local).
+"""
+
+import os
+import sys
+import json
+import time
+import pickle
+import argparse
+import tempfile
+import multiprocessing
+from datetime import datetime
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+os.chdir(PROJECT_DIR)
+
+import numpy as np  # noqa: E402
+
+from chunk_store import CHUNK_STORE_FILE, ChunkStore, build_chunk_store  # noqa: E402
+
+FETCHES = 200
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Сравнение pickle docstore и chunks.sqlite.')
+    parser.add_argument('--index-dir', default="./index", help='Директория с index.pkl (по умолчанию: ./index)')
+    parser.add_argument('--k', type=int, default=6, help='Сколько чанков читать за запрос (по умолчанию: 6)')
+    parser.add_argument('--output', help='Сохранить результаты в JSON файл')
+    return parser.parse_args()
+
+
+def rss_mb():
+    """Собственная (анонимная) память процесса; страницы файлов через mmap общие и сюда не входят"""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("RssAnon:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def load_pickle(index_dir):
+    with open(os.path.join(index_dir, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+
+    def fetch(positions):
+        return [docstore.search(index_to_docstore_id[position]) for position in positions]
+    return fetch, len(index_to_docstore_id)
+
+
+def load_sqlite(path):
+    store = ChunkStore(path)
+    return store.get_many, store.count
+
+
+def measure(method, path, k, results):
+    """Выполняется в отдельном процессе: загрузка, RSS и задержка выборки top-k"""
+    before = rss_mb()
+    start = time.perf_counter()
+    fetch, count = load_pickle(path) if method == "pickle" else load_sqlite(path)
+    load_seconds = time.perf_counter() - start
+    loaded_rss = rss_mb() - before
+
+    rng = np.random.default_rng(0)
+    queries = [rng.choice(count, size=min(k, count), replace=False).tolist() for _ in range(FETCHES)]
+    row = {"method": method, "chunks": count, "load_seconds": round(load_seconds, 3),
+           "rss_after_load_mb": round(loaded_rss, 1)}
+    for name in ("cold", "hot"):
+        latencies = []
+        for positions in queries:
+            start = time.perf_counter()
+            fetch(positions)
+            latencies.append(time.perf_counter() - start)
+        latencies = np.asarray(latencies) * 1000
+        row[f"{name}_avg_ms"] = round(float(latencies.mean()), 3)
+        row[f"{name}_p95_ms"] = round(float(np.percentile(latencies, 95)), 3)
+    row["rss_after_fetch_mb"] = round(rss_mb() - before, 1)
+    results.put(row)
+
+
+def run_isolated(method, path, k):
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=measure, args=(method, path, k, results))
+    process.start()
+    row = results.get()
+    process.join()
+    return row
+
+
+def main_cli():
+    args = parse_arguments()
+
+    with open(os.path.join(args.index_dir, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    documents = [docstore.search(index_to_docstore_id[i]) for i in range(len(index_to_docstore_id))]
+    del docstore
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sqlite_path = os.path.join(tmp_dir, CHUNK_STORE_FILE)
+        build_chunk_store(sqlite_path, documents)
+        sizes = {
+            "pickle": os.path.getsize(os.path.join(args.index_dir, "index.pkl")),
+            "sqlite": os.path.getsize(sqlite_path),
+        }
+        results = [run_isolated("pickle", args.index_dir, args.k), run_isolated("sqlite", sqlite_path, args.k)]
+    for row in results:
+        row["file_mb"] = round(sizes[row["method"]] / 2**20, 1)
+
+    print(f"\nЧанков: {len(documents)}, top-{args.k}, выборок: {FETCHES}")
+    print(f"{'Способ':<8} {'Файл, МБ':>9} {'Загрузка, с':>12} {'RSS, МБ':>8} {'Холодный, мс':>13} "
+          f"{'Горячий, мс':>12} {'RSS после, МБ':>14}")
+    for row in results:
+        print(f"{row['method']:<8} {row['file_mb']:>9} {row['load_seconds']:>12} {row['rss_after_load_mb']:>8} "
+              f"{row['cold_avg_ms']:>13} {row['hot_avg_ms']:>12} {row['rss_after_fetch_mb']:>14}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                "created_at": datetime.now().isoformat(),
+                "index_dir": args.index_dir,
+                "k": args.k,
+                "results": results,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Локальный OpenAI-совместимый сервер для нагрузочных тестов и бенчмарков без ключа OpenAI.
+
+Реализует:
+    POST /v1/embeddings         - детерминированные эмбеддинги нужной размерности (float и base64)
+    POST /v1/chat/completions   - ответ на последнее сообщение пользователя, в том числе stream=true
+    GET  /v1/models, /v1/models/{model} - для фоновой проверки доступности в main.py
+    GET/POST /_control          - текущие настройки и их изменение во время теста (JSON)
+    GET  /_stats                - число запросов и внесенных ошибок
+
+Эмбеддинг текста - нормированная сумма псевдослучайных векторов его слов (зерно - хэш слова),
+поэтому одинаковые тексты дают одинаковые векторы, а тексты с общими словами близки.
+Задержка и ошибки настраиваются: --embedding-latency-ms, --chat-latency-ms, --token-latency-ms,
+--error-rate и --error-status (429, 500, 503 ...).
+
+Запуск отдельным процессом:
+    python benchmarks/fake_openai.py --port 8100 --chat-latency-ms 800 --error-rate 0.01
+    OPENAI_BASE_URL=http://127.0.0.1:8100/v1 OPENAI_API_KEY=sk-fake uvicorn main:app
+    python build_index_local.py --openai-base-url http://127.0.0.1:8100/v1 --openai-api-key sk-fake
+
+Внутри процесса (ASGI): create_app(FakeOpenAIConfig(...)) и httpx.ASGITransport или TestClient.
+
+build_index_local.py считает токены документов через tiktoken, поэтому словарь cl100k_base
+должен быть доступен (скачан заранее или в TIKTOKEN_CACHE_DIR); main.py tiktoken для эмбеддингов не нужен.
+"""
+
+import re
+import sys
+import json
+import time
+import base64
+import random
+import asyncio
+import hashlib
+import argparse
+import threading
+from functools import lru_cache
+
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+MODEL_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+DEFAULT_DIMENSIONS = 1536
+WORD_PATTERN = re.compile(r"\w+")
+
+
+class FakeOpenAIConfig:
+    """Настройки поддельного сервера; меняются на лету через /_control"""
+
+    FIELDS = ("embedding_latency_ms", "chat_latency_ms", "token_latency_ms", "answer_words",
+              "error_rate", "error_status", "seed")
+
+    def __init__(self, embedding_latency_ms=0.0, chat_latency_ms=0.0, token_latency_ms=0.0, answer_words=60,
+                 error_rate=0.0, error_status=500, seed=0):
+        self.embedding_latency_ms = float(embedding_latency_ms)
+        self.chat_latency_ms = float(chat_latency_ms)
+        self.token_latency_ms = float(token_latency_ms)
+        self.answer_words = int(answer_words)
+        self.error_rate = float(error_rate)
+        self.error_status = int(error_status)
+        self.seed = int(seed)
+
+    def update(self, values):
+        for name, value in values.items():
+            if name not in self.FIELDS:
+                raise ValueError(f"Неизвестная настройка: {name}")
+            setattr(self, name, type(getattr(self, name))(value))
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+
+@lru_cache(maxsize=65536)
+def word_vector(word, dimensions):
+    seed = int.from_bytes(hashlib.sha256(word.encode()).digest()[:8], "little")
+    return np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+
+
+def fake_embedding(item, dimensions):
+    """Детерминированный эмбеддинг строки или списка токенов (как шлет OpenAIEmbeddings)"""
+    if isinstance(item, str):
+        words = WORD_PATTERN.findall(item.lower()) or [item]
+    else:
+        words = [f"token:{token}" for token in item] or [""]
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for word in words:
+        vector += word_vector(word, dimensions)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def count_words(item):
+    return len(item) if not isinstance(item, str) else max(1, len(item.split()))
+
+
+def fake_answer(question, words):
+    """Ответ фиксированной длины, зависящий только от вопроса"""
+    rng = random.Random(hashlib.sha256(question.encode()).digest())
+    vocabulary = WORD_PATTERN.findall(question.lower()) or ["ответ"]
+    body = " ".join(rng.choice(vocabulary + ["стандарт", "отчетность", "признание", "оценка"]) for _ in range(words))
+    return f"Тестовый ответ. {body}."
+
+
+def error_response(status):
+    error_type = "rate_limit_exceeded" if status == 429 else "server_error"
+    return JSONResponse({"error": {"message": f"Внесенная ошибка {status}", "type": error_type, "code": None}},
+                        status_code=status)
+
+
+def create_app(config=None):
+    config = config or FakeOpenAIConfig()
+    app = FastAPI(title="Fake OpenAI")
+    stats = {"embeddings": 0, "embedded_inputs": 0, "chat": 0, "chat_stream": 0, "errors": 0}
+    rng = random.Random(config.seed)
+    rng_lock = threading.Lock()
+
+    def should_fail():
+        with rng_lock:
+            failed = config.error_rate > 0 and rng.random() < config.error_rate
+        if failed:
+            stats["errors"] += 1
+        return failed
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        stats["embeddings"] += 1
+        if config.embedding_latency_ms:
+            await asyncio.sleep(config.embedding_latency_ms / 1000)
+        if should_fail():
+            return error_response(config.error_status)
+
+        inputs = body["input"]
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        model = body.get("model", "text-embedding-3-small")
+        dimensions = body.get("dimensions") or MODEL_DIMENSIONS.get(model, DEFAULT_DIMENSIONS)
+        stats["embedded_inputs"] += len(inputs)
+
+        data = []
+        for i, item in enumerate(inputs):
+            vector = fake_embedding(item, dimensions)
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.astype("<f4").tobytes()).decode()
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        tokens = sum(count_words(item) for item in inputs)
+        return {"object": "list", "data": data, "model": model,
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stream = bool(body.get("stream"))
+        stats["chat_stream" if stream else "chat"] += 1
+        if config.chat_latency_ms:
+            await asyncio.sleep(config.chat_latency_ms / 1000)
+        if should_fail():
+            return error_response(config.error_status)
+
+        messages = body.get("messages", [])
+        question = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+        if not isinstance(question, str):
+            question = json.dumps(question, ensure_ascii=False)
+        answer = fake_answer(question, config.answer_words)
+        model = body.get("model", "gpt-4o-mini")
+        completion_id = f"chatcmpl-{hashlib.sha256(question.encode()).hexdigest()[:24]}"
+        created = int(time.time())
+        prompt_tokens = sum(count_words(str(m.get("content", ""))) for m in messages)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": count_words(answer),
+                 "total_tokens": prompt_tokens + count_words(answer)}
+
+        if not stream:
+            return {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": answer},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            }
+
+        async def events():
+            def chunk(delta, finish_reason=None):
+                return "data: " + json.dumps({
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                }, ensure_ascii=False) + "\n\n"
+
+            yield chunk({"role": "assistant", "content": ""})
+            for i, word in enumerate(answer.split(" ")):
+                if config.token_latency_ms:
+                    await asyncio.sleep(config.token_latency_ms / 1000)
+                yield chunk({"content": word if i == 0 else " " + word})
+            yield chunk({}, "stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/v1/models")
+    def list_models():
+        return {"object": "list", "data": [{"id": model, "object": "model", "owned_by": "fake"}
+                                           for model in list(MODEL_DIMENSIONS) + ["gpt-4o-mini"]]}
+
+    @app.get("/v1/models/{model}")
+    def retrieve_model(model: str):
+        return {"id": model, "object": "model", "created": 0, "owned_by": "fake"}
+
+    @app.get("/_control")
+    def get_control():
+        return config.to_dict()
+
+    @app.post("/_control")
+    async def set_control(request: Request):
+        try:
+            config.update(await request.json())
+        except (ValueError, TypeError) as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+        return config.to_dict()
+
+    @app.get("/_stats")
+    def get_stats():
+        return dict(stats)
+
+    app.state.config = config
+    app.state.stats = stats
+    return app
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Локальный OpenAI-совместимый сервер для тестов и бенчмарков.')
+    parser.add_argument('--host', default="127.0.0.1", help='Адрес (по умолчанию: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8100, help='Порт (по умолчанию: 8100)')
+    parser.add_argument('--embedding-latency-ms', type=float, default=0, help='Задержка /v1/embeddings, мс')
+    parser.add_argument('--chat-latency-ms', type=float, default=0,
+                        help='Задержка /v1/chat/completions до первого токена, мс')
+    parser.add_argument('--token-latency-ms', type=float, default=0, help='Задержка между токенами потока, мс')
+    parser.add_argument('--answer-words', type=int, default=60, help='Слов в ответе (по умолчанию: 60)')
+    parser.add_argument('--error-rate', type=float, default=0, help='Доля запросов с ошибкой (0..1)')
+    parser.add_argument('--error-status', type=int, default=500, help='HTTP-код внесенных ошибок (по умолчанию: 500)')
+    parser.add_argument('--seed', type=int, default=0, help='Зерно генератора ошибок')
+    return parser.parse_args()
+
+
+def main_cli():
+    args = parse_arguments()
+    import uvicorn
+
+    config = FakeOpenAIConfig(
+        embedding_latency_ms=args.embedding_latency_ms,
+        chat_latency_ms=args.chat_latency_ms,
+        token_latency_ms=args.token_latency_ms,
+        answer_words=args.answer_words,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        seed=args.seed,
+    )
+    print(f"Fake OpenAI: http://{args.host}:{args.port}/v1, настройки: {config.to_dict()}")
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
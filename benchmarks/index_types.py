@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк типов FAISS индекса: recall@k и задержка поиска относительно точного (flat).
+
+Берет векторы чанков из собранного индекса, строит по ним IVF и HNSW (vector_index.py)
+и для каждого значения nprobe / efSearch измеряет долю найденных точных соседей (recall@k),
+среднюю и p95 задержку одного запроса, время построения и размер индекса.
+Запросами служат векторы случайных чанков с небольшим шумом - близко к реальным вопросам,
+ответ на которые есть в корпусе, и не требует обращений к API эмбеддингов.
+
+Использование:
+    python benchmarks/index_types.py [--index-dir DIR] [--queries N] [--k K] [--output FILE]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+os.chdir(PROJECT_DIR)
+
+import faiss  # noqa: E402
+import numpy as np  # noqa: E402
+
+import vector_index  # noqa: E402
+
+NPROBE_VALUES = [1, 4, 8, 16, 32, 64]
+EF_SEARCH_VALUES = [16, 32, 64, 128, 256]
+QUERY_NOISE = 0.02  # стандартное отклонение шума относительно нормы вектора
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Сравнение recall@k и задержки для flat, IVF и HNSW.')
+    parser.add_argument('--index-dir', default="./index", help='Директория с индексом (по умолчанию: ./index)')
+    parser.add_argument('--queries', type=int, default=200, help='Число запросов (по умолчанию: 200)')
+    parser.add_argument('--k', type=int, default=10, help='Глубина поиска для recall@k (по умолчанию: 10)')
+    parser.add_argument('--nlist', type=int, default=0, help='Число кластеров IVF (0 = по умолчанию)')
+    parser.add_argument('--hnsw-m', type=int, default=vector_index.DEFAULT_HNSW_M, help='M для HNSW')
+    parser.add_argument('--ef-construction', type=int, default=vector_index.DEFAULT_EF_CONSTRUCTION,
+                        help='efConstruction для HNSW')
+    parser.add_argument('--seed', type=int, default=42, help='Зерно генератора запросов')
+    parser.add_argument('--output', help='Сохранить результаты в JSON файл')
+    return parser.parse_args()
+
+
+def load_vectors(index_dir):
+    index = faiss.read_index(os.path.join(index_dir, "index.faiss"))
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def make_queries(vectors, count, seed):
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(vectors), size=min(count, len(vectors)), replace=False)
+    queries = vectors[picks].copy()
+    scale = QUERY_NOISE * np.linalg.norm(queries, axis=1, keepdims=True) / np.sqrt(vectors.shape[1])
+    queries += rng.normal(size=queries.shape).astype(np.float32) * scale
+    return np.ascontiguousarray(queries, dtype=np.float32)
+
+
+def index_size(index):
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def measure(index, queries, k, truth):
+    """Поиск по одному запросу, как в main.search_index; возвращает recall@k и задержки"""
+    latencies = []
+    hits = 0
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        _, ids = index.search(queries[i:i + 1], k)
+        latencies.append(time.perf_counter() - start)
+        hits += len(set(ids[0].tolist()) & set(truth[i].tolist()))
+    latencies = np.asarray(latencies) * 1000
+    return {
+        f"recall@{k}": round(hits / (len(queries) * k), 4),
+        "avg_ms": round(float(latencies.mean()), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+    }
+
+
+def build(vectors, index_type, **options):
+    start = time.perf_counter()
+    index, params = vector_index.build_faiss_index(vectors, index_type, **options)
+    return index, params, round(time.perf_counter() - start, 2)
+
+
+def run(args):
+    vectors = load_vectors(args.index_dir)
+    queries = make_queries(vectors, args.queries, args.seed)
+    results = []
+
+    flat, _, build_seconds = build(vectors, "flat")
+    _, truth = flat.search(queries, args.k)
+    row = measure(flat, queries, args.k, truth)
+    row.update({"type": "flat", "params": {}, "build_seconds": build_seconds, "size_mb": round(index_size(flat) / 2**20, 1)})
+    results.append(row)
+
+    ivf, params, build_seconds = build(vectors, "ivf", nlist=args.nlist)
+    size_mb = round(index_size(ivf) / 2**20, 1)
+    for nprobe in NPROBE_VALUES:
+        if nprobe > params["nlist"]:
+            break
+        vector_index.configure_search(ivf, params, nprobe=nprobe)
+        row = measure(ivf, queries, args.k, truth)
+        row.update({"type": "ivf", "params": {"nlist": params["nlist"], "nprobe": nprobe},
+                    "build_seconds": build_seconds, "size_mb": size_mb})
+        results.append(row)
+
+    hnsw, params, build_seconds = build(vectors, "hnsw", hnsw_m=args.hnsw_m, ef_construction=args.ef_construction)
+    size_mb = round(index_size(hnsw) / 2**20, 1)
+    for ef_search in EF_SEARCH_VALUES:
+        vector_index.configure_search(hnsw, params, ef_search=ef_search)
+        row = measure(hnsw, queries, args.k, truth)
+        row.update({"type": "hnsw", "params": {"M": args.hnsw_m, "ef_search": ef_search},
+                    "build_seconds": build_seconds, "size_mb": size_mb})
+        results.append(row)
+
+    return vectors.shape, results
+
+
+def main_cli():
+    args = parse_arguments()
+    shape, results = run(args)
+
+    print(f"\nВекторов: {shape[0]}, размерность: {shape[1]}, запросов: {min(args.queries, shape[0])}")
+    print(f"{'Тип':<6} {'Параметры':<28} {'Recall@' + str(args.k):>10} {'Ср., мс':>9} {'p95, мс':>9} "
+          f"{'Сборка, с':>10} {'Размер, МБ':>11}")
+    for row in results:
+        params = ", ".join(f"{key}={value}" for key, value in row["params"].items())
+        print(f"{row['type']:<6} {params:<28} {row[f'recall@{args.k}']:>10} {row['avg_ms']:>9} {row['p95_ms']:>9} "
+              f"{row['build_seconds']:>10} {row['size_mb']:>11}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                "created_at": datetime.now().isoformat(),
+                "index_dir": args.index_dir,
+                "vector_count": shape[0],
+                "dimension": shape[1],
+                "k": args.k,
+                "results": results,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест /ask от начала до конца против локального OpenAI-совместимого сервера.
+
+Запускает benchmarks/fake_openai.py и приложение (uvicorn main:app с OPENAI_BASE_URL на него)
+отдельными процессами, затем воспроизводит корпус вопросов (benchmarks/data/questions.json:
+МСФО и банковское законодательство РК) в одном из режимов:
+    замкнутый (по умолчанию) - --concurrency виртуальных пользователей, каждый ведет диалог:
+                               основной вопрос и уточняющие в одной сессии, без пауз
+    открытый                 - --rate запросов в секунду с пуассоновским потоком прибытия,
+                               каждый вопрос в новой сессии, независимо от времени ответа
+
+Отчет: пропускная способность, p50/p95/p99 задержки клиента и каждого этапа (по заголовку
+Server-Timing из /ask), коды ответов и доля ошибок. --output сохраняет JSON с коммитом git,
+--compare выводит разницу с сохраненным ранее прогоном.
+
+Без --index-dir строится синтетический индекс (--synthetic-chunks чанков) с эмбеддингами
+того же fake_openai, поэтому поиск находит тематически близкие чанки.
+По умолчанию кэши эмбеддингов и ответов отключены (ANSWER_CACHE_SIZE=0, EMBEDDING_CACHE_SIZE=0),
+чтобы повторы вопросов корпуса не превращались в попадания кэша; --warm-caches включает их.
+
+Использование:
+    python benchmarks/load_test.py [--concurrency N | --rate RPS] [--duration SEC] [--output FILE]
+    python benchmarks/load_test.py --app-url http://127.0.0.1:8000  # уже запущенное приложение
+"""
+
+import os
+import re
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import signal
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, PROJECT_DIR)
+
+import httpx  # noqa: E402
+import numpy as np  # noqa: E402
+
+DEFAULT_QUESTIONS = os.path.join(BENCHMARKS_DIR, "data", "questions.json")
+SERVER_TIMING_PATTERN = re.compile(r"([\w-]+)(?:;desc=\"[^\"]*\")?;dur=([\d.]+)")
+READY_TIMEOUT = 180
+
+# Документы синтетического корпуса: имя файла (для карты ссылок), заголовок и термины темы
+SYNTHETIC_DOCUMENTS = [
+    ("ifrs-15-revenue-ru.pdf", "МСФО (IFRS) 15 Выручка по договорам с покупателями",
+     "выручка договор покупатель обязанность исполнению цена сделки признание"),
+    ("ifrs-9-financial-instruments-ru.pdf", "МСФО (IFRS) 9 Финансовые инструменты",
+     "финансовый актив ожидаемые кредитные убытки стадия классификация SPPI хеджирование модификация"),
+    ("ifrs-16-leases-ru.pdf", "МСФО (IFRS) 16 Аренда",
+     "аренда арендатор обязательство актив право пользования ставка дисконтирования"),
+    ("ias-36-impairment-of-assets-ru.pdf", "МСФО (IAS) 36 Обесценение активов",
+     "обесценение возмещаемая сумма ценность использования единица генерирующая тест"),
+    ("ias-12-income-taxes-ru.pdf", "МСФО (IAS) 12 Налоги на прибыль",
+     "отложенный налог налоговый актив временная разница налогооблагаемая прибыль"),
+    ("ias-2-inventories-ru.pdf", "МСФО (IAS) 2 Запасы", "запасы себестоимость чистая цена продажи ФИФО оценка"),
+    ("ifrs-7-disclosures-ru.pdf", "МСФО (IFRS) 7 Финансовые инструменты: раскрытие информации",
+     "раскрытие риски ликвидность кредитный риск рыночный риск"),
+    ("ias-16-property-plant-equipment-ru.pdf", "МСФО (IAS) 16 Основные средства",
+     "основные средства переоценка амортизация первоначальное признание"),
+    ("ifrs-13-fair-value-ru.pdf", "МСФО (IFRS) 13 Оценка справедливой стоимости",
+     "справедливая стоимость иерархия исходные данные рынок оценка"),
+    ("ias-19-employee-benefits-ru.pdf", "МСФО (IAS) 19 Вознаграждения работникам",
+     "вознаграждения работникам пенсионный план установленные выплаты актуарный"),
+    ("ias-37-provisions-ru.pdf", "МСФО (IAS) 37 Оценочные обязательства",
+     "резерв условное обязательство оценочное обязательство вероятность"),
+    ("ias-21-foreign-exchange-ru.pdf", "МСФО (IAS) 21 Влияние изменений валютных курсов",
+     "иностранная валюта функциональная валюта пересчет курсовая разница"),
+    ("ifrs-3-business-combinations-ru.pdf", "МСФО (IFRS) 3 Объединения бизнесов",
+     "объединение бизнеса гудвил приобретение справедливая стоимость"),
+    ("Закон о банках.docx", "Закон о банках и банковской деятельности в Республике Казахстан",
+     "банк крупный участник согласие лицензия банковская тайна уполномоченный орган"),
+    ("Правила риски 188.rus.docx", "Правила формирования системы управления рисками и внутреннего контроля 188",
+     "управление рисками внутренний аудит риск-менеджмент совет директоров контроль"),
+    ("Постановление нормативы 170.docx", "Постановление о пруденциальных нормативах 170",
+     "пруденциальные нормативы достаточность капитала коэффициент k1 ликвидность LCR провизии"),
+]
+FILLER_WORDS = ("организация отражает информацию в финансовой отчетности в соответствии с требованиями "
+                "стандарта при этом учитываются существенные суждения и оценки руководства").split()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест /ask против локального OpenAI-совместимого сервера.')
+    parser.add_argument('--questions', default=DEFAULT_QUESTIONS, help='JSON с корпусом вопросов')
+    parser.add_argument('--concurrency', type=int, default=8, help='Виртуальных пользователей (по умолчанию: 8)')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='Открытый режим: запросов в секунду (по умолчанию 0 - замкнутый режим)')
+    parser.add_argument('--duration', type=float, default=30, help='Длительность замера, секунд (по умолчанию: 30)')
+    parser.add_argument('--requests', type=int, default=0, help='Остановиться после N запросов (0 - по времени)')
+    parser.add_argument('--warmup', type=int, default=5, help='Запросов для прогрева до замера (по умолчанию: 5)')
+    parser.add_argument('--seed', type=int, default=42, help='Зерно выбора вопросов и потока прибытия')
+    parser.add_argument('--index-dir', help='Готовый индекс (по умолчанию строится синтетический)')
+    parser.add_argument('--synthetic-chunks', type=int, default=3000,
+                        help='Чанков в синтетическом индексе (по умолчанию: 3000)')
+    parser.add_argument('--embedding-latency-ms', type=float, default=20, help='Задержка эмбеддингов, мс')
+    parser.add_argument('--chat-latency-ms', type=float, default=600, help='Задержка ответа LLM, мс')
+    parser.add_argument('--token-latency-ms', type=float, default=0, help='Задержка между токенами потока, мс')
+    parser.add_argument('--error-rate', type=float, default=0, help='Доля ошибок, вносимых fake_openai')
+    parser.add_argument('--error-status', type=int, default=500, help='HTTP-код вносимых ошибок')
+    parser.add_argument('--warm-caches', action='store_true', help='Не отключать кэши эмбеддингов и ответов')
+    parser.add_argument('--app-url', help='Тестировать уже запущенное приложение (fake_openai не запускается)')
+    parser.add_argument('--port', type=int, default=8710, help='Порт приложения (fake_openai - следующий)')
+    parser.add_argument('--timeout', type=float, default=60, help='Таймаут одного запроса, секунд')
+    parser.add_argument('--output', help='Сохранить результаты в JSON файл')
+    parser.add_argument('--compare', help='JSON предыдущего прогона для сравнения')
+    parser.add_argument('--serve-app', action='store_true', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def load_conversations(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return [[item["q"]] + list(item.get("follow_up", [])) for item in data["questions"]]
+
+
+def build_synthetic_index(output_dir, chunk_count, seed=42):
+    """Индекс в формате build_index_local.py: index.faiss, chunks.sqlite, лексический индекс и карта ссылок"""
+    import faiss
+    from langchain_core.documents import Document
+
+    from fake_openai import MODEL_DIMENSIONS, fake_embedding
+    from chunk_store import CHUNK_STORE_FILE, build_chunk_store
+    from lexical_index import LEXICAL_INDEX_FILE, LexicalIndex
+    from reference_map import REFERENCE_MAP_FILE, ReferenceMap, build_reference_map
+    from vector_index import build_faiss_index
+
+    rng = random.Random(seed)
+    per_document = math.ceil(chunk_count / len(SYNTHETIC_DOCUMENTS))
+    documents = []
+    for file_name, title, terms in SYNTHETIC_DOCUMENTS:
+        vocabulary = terms.split()
+        for part in range(per_document):
+            if len(documents) >= chunk_count:
+                break
+            words = [rng.choice(vocabulary) if rng.random() < 0.4 else rng.choice(FILLER_WORDS) for _ in range(150)]
+            text = f"{title}. Пункт {part + 1}. " + " ".join(words) + "."
+            documents.append(Document(page_content=text, metadata={"source": title, "file": file_name}))
+
+    dimensions = MODEL_DIMENSIONS["text-embedding-3-small"]
+    vectors = np.vstack([fake_embedding(document.page_content, dimensions) for document in documents])
+    index, params = build_faiss_index(vectors)
+    faiss.write_index(index, os.path.join(output_dir, "index.faiss"))
+    build_chunk_store(os.path.join(output_dir, CHUNK_STORE_FILE), documents)
+    LexicalIndex.build([f"{d.metadata['source']}\n{d.page_content}" for d in documents]).save(
+        os.path.join(output_dir, LEXICAL_INDEX_FILE))
+    ReferenceMap(build_reference_map([d.metadata["file"] for d in documents])).save(
+        os.path.join(output_dir, REFERENCE_MAP_FILE))
+    with open(os.path.join(output_dir, "index_metadata.json"), 'w', encoding='utf-8') as f:
+        json.dump({
+            "created_at": datetime.now().isoformat(),
+            "document_count": len(SYNTHETIC_DOCUMENTS),
+            "chunk_count": len(documents),
+            "index_type": "flat",
+            "codec": "none",
+            "dimensions": dimensions,
+            "full_dimensions": dimensions,
+            "full_vectors": None,
+            "index_params": params,
+            "chunk_store": CHUNK_STORE_FILE,
+            "lexical_index": LEXICAL_INDEX_FILE,
+            "reference_map": REFERENCE_MAP_FILE,
+        }, f, ensure_ascii=False, indent=2)
+    return len(documents)
+
+
+def serve_app(args):
+    """Режим дочернего процесса: приложение с индексом из --index-dir"""
+    import uvicorn
+    os.chdir(PROJECT_DIR)
+    import main
+    main.INDEX_PATH = os.path.abspath(args.index_dir)
+    main.LOCAL_INDEX_PATH = os.path.abspath(args.index_dir)
+    uvicorn.run(main.app, host="127.0.0.1", port=args.port, log_level="warning")
+    return 0
+
+
+def start_process(command, env, log_path):
+    log = open(log_path, 'w', encoding='utf-8')
+    return subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT, cwd=PROJECT_DIR)
+
+
+def stop_process(process):
+    if process is not None and process.poll() is None:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def wait_ready(url, process, check):
+    deadline = time.time() + READY_TIMEOUT
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Процесс завершился при запуске (код {process.returncode})")
+        try:
+            response = httpx.get(url, timeout=2)
+            if response.status_code == 200 and check(response):
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.3)
+    raise RuntimeError(f"{url} не ответил за {READY_TIMEOUT} секунд")
+
+
+def parse_server_timing(header):
+    return {name: float(duration) for name, duration in SERVER_TIMING_PATTERN.findall(header or "")}
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = np.asarray(values)
+    return {
+        "p50": round(float(np.percentile(values, 50)), 1),
+        "p95": round(float(np.percentile(values, 95)), 1),
+        "p99": round(float(np.percentile(values, 99)), 1),
+        "avg": round(float(values.mean()), 1),
+        "max": round(float(values.max()), 1),
+        "count": int(values.size),
+    }
+
+
+class LoadRun:
+    """Отправка вопросов и накопление результатов одного прогона"""
+
+    def __init__(self, client, url, conversations, args):
+        self.client = client
+        self.url = url
+        self.conversations = conversations
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.results = []
+        self.sent = 0
+        self.deadline = None
+
+    def stopped(self):
+        if self.args.requests and self.sent >= self.args.requests:
+            return True
+        return self.deadline is not None and time.perf_counter() >= self.deadline
+
+    async def ask(self, question, session_id, record=True):
+        self.sent += record
+        start = time.perf_counter()
+        try:
+            response = await self.client.post(f"{self.url}/ask", data={"q": question},
+                                              cookies={"session_id": session_id})
+            status = response.status_code
+            stages = parse_server_timing(response.headers.get("server-timing"))
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+            stages = {}
+        if record:
+            self.results.append({"latency_ms": (time.perf_counter() - start) * 1000, "status": status,
+                                 "stages": stages})
+
+    async def conversation_user(self):
+        """Замкнутый режим: диалоги подряд, следующий вопрос после ответа на предыдущий"""
+        while not self.stopped():
+            session_id = f"load-{uuid.uuid4()}"
+            for question in self.rng.choice(self.conversations):
+                if self.stopped():
+                    return
+                await self.ask(question, session_id)
+
+    async def closed_loop(self):
+        await asyncio.gather(*[self.conversation_user() for _ in range(self.args.concurrency)])
+
+    async def open_loop(self):
+        """Открытый режим: пуассоновский поток независимых вопросов с заданной частотой"""
+        tasks = []
+        next_at = time.perf_counter()
+        while not self.stopped():
+            next_at += self.rng.expovariate(self.args.rate)
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+            question = self.rng.choice(self.conversations)[0]
+            tasks.append(asyncio.create_task(self.ask(question, f"load-{uuid.uuid4()}")))
+        await asyncio.gather(*tasks)
+
+    async def run(self):
+        for i in range(self.args.warmup):
+            await self.ask(self.conversations[i % len(self.conversations)][0], f"warmup-{uuid.uuid4()}",
+                           record=False)
+        started = time.perf_counter()
+        self.deadline = started + self.args.duration if not self.args.requests else None
+        if self.args.rate > 0:
+            await self.open_loop()
+        else:
+            await self.closed_loop()
+        return time.perf_counter() - started
+
+
+def summarize(results, elapsed):
+    ok = [row for row in results if row["status"] == 200]
+    statuses = {}
+    for row in results:
+        statuses[str(row["status"])] = statuses.get(str(row["status"]), 0) + 1
+    stage_names = []
+    for row in ok:
+        for name in row["stages"]:
+            if name not in stage_names:
+                stage_names.append(name)
+    return {
+        "requests": len(results),
+        "ok": len(ok),
+        "elapsed_seconds": round(elapsed, 2),
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else 0,
+        "error_rate": round(1 - len(ok) / len(results), 4) if results else 0,
+        "statuses": statuses,
+        "latency_ms": percentiles([row["latency_ms"] for row in ok]),
+        "stages_ms": {name: percentiles([row["stages"][name] for row in ok if name in row["stages"]])
+                      for name in stage_names},
+    }
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=PROJECT_DIR,
+                               capture_output=True, text=True).stdout.strip()
+        return f"{commit}-dirty" if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_summary(summary):
+    latency = summary["latency_ms"] or {}
+    print(f"\nЗапросов: {summary['requests']}, успешных: {summary['ok']}, за {summary['elapsed_seconds']} с")
+    print(f"Пропускная способность: {summary['throughput_rps']} запр/с, доля ошибок: {summary['error_rate']}")
+    print(f"Коды ответов: {summary['statuses']}")
+    print(f"\n{'Этап':<12} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} {'Ср., мс':>9}")
+    for name, stats in [("клиент", latency)] + list(summary["stages_ms"].items()):
+        if stats:
+            print(f"{name:<12} {stats['p50']:>9} {stats['p95']:>9} {stats['p99']:>9} {stats['avg']:>9}")
+
+
+def print_comparison(previous, summary):
+    """Разница с прошлым прогоном по пропускной способности, ошибкам и процентилям"""
+    before = previous["summary"]
+    print(f"\nСравнение с {previous.get('commit')} ({previous.get('created_at')}):")
+    rows = [("throughput_rps", before["throughput_rps"], summary["throughput_rps"]),
+            ("error_rate", before["error_rate"], summary["error_rate"])]
+    stages = [("клиент", before.get("latency_ms"), summary.get("latency_ms"))]
+    stages += [(name, before["stages_ms"].get(name), stats) for name, stats in summary["stages_ms"].items()]
+    for name, old, new in stages:
+        if old and new:
+            rows += [(f"{name} p50", old["p50"], new["p50"]), (f"{name} p99", old["p99"], new["p99"])]
+    for name, old, new in rows:
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "-"
+        print(f"  {name:<18} {old:>10} -> {new:<10} {change}")
+
+
+def main_cli():
+    args = parse_arguments()
+    if args.serve_app:
+        return serve_app(args)
+
+    conversations = load_conversations(args.questions)
+    processes = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        try:
+            url = args.app_url.rstrip("/") if args.app_url else None
+            if url is None:
+                fake_port = args.port + 1
+                fake = start_process([
+                    sys.executable, os.path.join(BENCHMARKS_DIR, "fake_openai.py"), "--port", str(fake_port),
+                    "--embedding-latency-ms", str(args.embedding_latency_ms),
+                    "--chat-latency-ms", str(args.chat_latency_ms),
+                    "--token-latency-ms", str(args.token_latency_ms),
+                    "--error-rate", str(args.error_rate), "--error-status", str(args.error_status),
+                ], dict(os.environ), os.path.join(tmp_dir, "fake_openai.log"))
+                processes.append(fake)
+
+                index_dir = args.index_dir
+                if not index_dir:
+                    index_dir = os.path.join(tmp_dir, "index")
+                    os.makedirs(index_dir)
+                    print(f"Построение синтетического индекса ({args.synthetic_chunks} чанков)...")
+                    sys.path.insert(0, BENCHMARKS_DIR)
+                    build_synthetic_index(index_dir, args.synthetic_chunks, args.seed)
+
+                env = dict(os.environ, OPENAI_API_KEY="sk-load-test",
+                           OPENAI_BASE_URL=f"http://127.0.0.1:{fake_port}/v1")
+                if not args.warm_caches:
+                    env.update(ANSWER_CACHE_SIZE="0", EMBEDDING_CACHE_SIZE="0", EMBEDDING_CACHE_DB="")
+                app_log = os.path.join(tmp_dir, "app.log")
+                app = start_process([sys.executable, os.path.abspath(__file__), "--serve-app",
+                                     "--index-dir", index_dir, "--port", str(args.port)], env, app_log)
+                processes.append(app)
+                wait_ready(f"http://127.0.0.1:{fake_port}/v1/models", fake, lambda response: True)
+                url = f"http://127.0.0.1:{args.port}"
+                wait_ready(f"{url}/ping", app, lambda response: response.json().get("index_loaded"))
+                print(f"Приложение запущено: {url}")
+
+            mode = f"открытый, {args.rate} запр/с" if args.rate > 0 else f"замкнутый, {args.concurrency} польз."
+            print(f"Нагрузка: {mode}, "
+                  f"{f'{args.requests} запросов' if args.requests else f'{args.duration} с'}...")
+
+            async def run():
+                limits = httpx.Limits(max_connections=max(args.concurrency, 100))
+                async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+                    load = LoadRun(client, url, conversations, args)
+                    elapsed = await load.run()
+                    ping = (await client.get(f"{url}/ping")).json()
+                    return load.results, elapsed, ping
+
+            results, elapsed, ping = asyncio.run(run())
+        finally:
+            for process in reversed(processes):
+                stop_process(process)
+
+    summary = summarize(results, elapsed)
+    print_summary(summary)
+
+    report = {
+        "created_at": datetime.now().isoformat(),
+        "commit": git_commit(),
+        "config": {name: value for name, value in vars(args).items()
+                   if name not in ("output", "compare", "serve_app")},
+        "summary": summary,
+        "server": {"ask_admission": ping.get("ask_admission"), "coalesced_questions": ping.get("coalesced_questions"),
+                   "index_version": ping.get("index_version")},
+    }
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            print_comparison(json.load(f), summary)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк поискового запроса с учетом истории диалога.
+
+Сравнивает прежний способ (последние три полных ответа + вопрос) с build_retrieval_query()
+из main.py на наборе диалогов с уточняющими вопросами. Для каждого способа выводит размер
+запроса, отправляемого на эмбеддинг (символы и токены), время эмбеддинга и долю уточняющих
+вопросов, для которых нужный документ попал в top-k.
+
+Использование:
+    python benchmarks/retrieval_query.py [--index-dir DIR] [--k K] [--output FILE]
+
+Требуется собранный индекс (build_index_local.py) и доступ к API эмбеддингов.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import asyncio
+from datetime import datetime
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+os.chdir(PROJECT_DIR)
+
+import main  # noqa: E402
+
+# Диалоги: вопросы по порядку и подстрока имени файла документа, который должен найтись
+DIALOGUES = [
+    (["Что такое обесценение активов?", "Как определяется возмещаемая сумма?", "А когда его нужно признавать?"],
+     "ias-36"),
+    (["Как учитывается аренда у арендатора по МСФО 16?", "А как рассчитать обязательство?"],
+     "(IFRS) 16"),
+    (["Какие пруденциальные нормативы установлены для банков второго уровня?",
+      "Как рассчитывается коэффициент достаточности капитала?"],
+     "пруднормативы 170"),
+    (["Как оцениваются запасы по IAS 2?", "А что включается в их себестоимость?"],
+     "ias-2-"),
+    (["Какие требования к системе управления рисками в банке?", "Кто за это отвечает?"],
+     "риски 188"),
+    (["Как признается выручка по договорам с покупателями?", "Что такое обязанность к исполнению?"],
+     "(IFRS) 15"),
+    (["Как учитывать основные средства?", "Как начислять по ним амортизацию?"],
+     "ias-16"),
+    (["Что такое отложенный налог?", "Как его признавать?"],
+     "ias-12"),
+    (["Что регулирует Закон о банках?", "Какие требования к учредителям?"],
+     "Закон о банках"),
+    (["Как пересчитываются операции в иностранной валюте?", "А курсовые разницы куда относить?"],
+     "ias-21"),
+]
+
+ANSWER_CHUNKS = 3  # ответ в истории имитируется текстом лучших чанков
+ANSWER_MAX_CHARS = 2500
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Сравнение способов построения поискового запроса.')
+    parser.add_argument('--index-dir', default=main.LOCAL_INDEX_PATH,
+                        help=f'Директория с индексом (по умолчанию: {main.LOCAL_INDEX_PATH})')
+    parser.add_argument('--k', type=int, default=6, help='Сколько документов искать (по умолчанию: 6)')
+    parser.add_argument('--output', help='Сохранить результаты в JSON файл')
+    return parser.parse_args()
+
+
+def legacy_retrieval_query(q, chat_history):
+    """Прежний способ: три последних вопроса с полными ответами плюс текущий вопрос"""
+    recent_dialogue = " ".join([qa[0] + " " + qa[1] for qa in chat_history[-3:]]) if chat_history else ""
+    return f"{recent_dialogue} {q}"
+
+
+def is_hit(docs, expected):
+    return any(expected.lower() in doc.metadata.get("source", "").lower() for doc in docs)
+
+
+async def embed(query):
+    start = time.perf_counter()
+    vector = await main.get_embeddings().aembed_query(query)
+    return vector, time.perf_counter() - start
+
+
+async def run(args):
+    main.INDEX_PATH = args.index_dir
+    vectorstore = main.load_vectorstore()
+
+    methods = {"legacy": legacy_retrieval_query, "builder": main.build_retrieval_query}
+    stats = {name: {"chars": [], "tokens": [], "embed_seconds": [], "hits": 0} for name in methods}
+    follow_ups = 0
+
+    for questions, expected in DIALOGUES:
+        chat_history = []
+        for turn, q in enumerate(questions):
+            if turn > 0:
+                follow_ups += 1
+                for name, build in methods.items():
+                    query = build(q, chat_history)
+                    vector, seconds = await embed(query)
+                    docs = vectorstore.similarity_search_by_vector(vector, k=args.k)
+                    stats[name]["chars"].append(len(query))
+                    stats[name]["tokens"].append(main.count_tokens(query))
+                    stats[name]["embed_seconds"].append(seconds)
+                    stats[name]["hits"] += int(is_hit(docs, expected))
+
+            # Ответ для истории не зависит от способа: текст лучших чанков по самому вопросу
+            vector, _ = await embed(q)
+            docs = vectorstore.similarity_search_by_vector(vector, k=ANSWER_CHUNKS)
+            answer = "\n".join(doc.page_content for doc in docs)[:ANSWER_MAX_CHARS]
+            chat_history.append((q, answer))
+
+    report = {}
+    for name, values in stats.items():
+        count = len(values["chars"])
+        report[name] = {
+            "avg_chars": round(sum(values["chars"]) / count, 1),
+            "max_chars": max(values["chars"]),
+            "avg_tokens": round(sum(values["tokens"]) / count, 1),
+            "avg_embed_ms": round(sum(values["embed_seconds"]) / count * 1000, 1),
+            f"hit_rate@{args.k}": round(values["hits"] / count, 3),
+        }
+    return follow_ups, report
+
+
+def main_cli():
+    args = parse_arguments()
+    follow_ups, report = asyncio.run(run(args))
+
+    print(f"\nУточняющих вопросов: {follow_ups}, индекс: {args.index_dir}")
+    print(f"{'Способ':<10} {'Симв. ср.':>10} {'Симв. макс.':>12} {'Токены ср.':>11} {'Эмбеддинг, мс':>14} {'Hit@' + str(args.k):>8}")
+    for name, values in report.items():
+        print(f"{name:<10} {values['avg_chars']:>10} {values['max_chars']:>12} {values['avg_tokens']:>11} "
+              f"{values['avg_embed_ms']:>14} {values[f'hit_rate@{args.k}']:>8}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                "created_at": datetime.now().isoformat(),
+                "index_dir": args.index_dir,
+                "k": args.k,
+                "follow_ups": follow_ups,
+                "results": report,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
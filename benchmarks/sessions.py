@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк хранилища сессий: стоимость очистки устаревших сессий и объем памяти.
+
+Заполняет session_store.MemorySessionStore заданным числом сессий (по несколько шагов
+диалога в каждой) и замеряет время clean_old_sessions-подобного вызова expire(), когда
+устаревших сессий нет (так бывает почти на каждом /ask), и когда устарела доля сессий.
+Для сравнения замеряется прежний полный проход по словарю последней активности.
+
+Затем для хранилищ memory, sqlite (временный файл) и redis (если задан --redis-url) замеряет
+задержку append() и history() на пути запроса и время фоновой записи накопленной очереди.
+
+Использование:
+    python benchmarks/sessions.py [--sessions N ...] [--turns N] [--redis-url URL] [--output FILE]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from datetime import datetime
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+from session_store import MemorySessionStore, create_session_store  # noqa: E402
+
+REPEATS = 200
+BACKEND_SESSIONS = 2000
+QUESTION = "Как отражается обесценение финансовых активов по МСФО 9?"
+ANSWER = "Ожидаемые кредитные убытки признаются в зависимости от стадии кредитного риска. " * 10
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Стоимость очистки сессий и объем истории в памяти.')
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1000, 10000, 50000],
+                        help='Число сессий (по умолчанию: 1000 10000 50000)')
+    parser.add_argument('--turns', type=int, default=5, help='Шагов диалога в сессии (по умолчанию: 5)')
+    parser.add_argument('--expired-share', type=float, default=0.1,
+                        help='Доля устаревших сессий во втором замере (по умолчанию: 0.1)')
+    parser.add_argument('--redis-url', help='Адрес Redis для замера хранилища redis (по умолчанию не замеряется)')
+    parser.add_argument('--output', help='Сохранить результаты в JSON файл')
+    return parser.parse_args()
+
+
+def fill(count, turns):
+    store = MemorySessionStore(max_bytes=2**40)
+    last_activity = {}
+    for i in range(count):
+        session_id = f"session-{i}"
+        for _ in range(turns):
+            store.append(session_id, QUESTION, ANSWER)
+        last_activity[session_id] = time.time()
+    return store, last_activity
+
+
+def full_scan(last_activity, now, max_age):
+    """Прежняя очистка: проход по всем сессиям на каждом запросе"""
+    return [session_id for session_id, last_active in last_activity.items() if now - last_active > max_age]
+
+
+def run_one(count, turns, expired_share):
+    store, last_activity = fill(count, turns)
+    now = time.time()
+
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        store.expire(now)
+    expire_idle_ms = (time.perf_counter() - start) * 1000 / REPEATS
+
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        full_scan(last_activity, now, store.max_age)
+    scan_ms = (time.perf_counter() - start) * 1000 / REPEATS
+
+    # Момент, когда устарела первая доля сессий (они в начале очереди)
+    boundary = store._sessions[f"session-{max(int(count * expired_share) - 1, 0)}"].last_activity
+    start = time.perf_counter()
+    removed = 0
+    while True:
+        batch = store.expire(boundary + store.max_age + 1e-6)
+        removed += batch
+        if batch < store.expire_batch:
+            break
+    expire_share_ms = (time.perf_counter() - start) * 1000
+
+    stats = store.stats()
+    return {
+        "sessions": count,
+        "turns": turns,
+        "expire_idle_ms": round(expire_idle_ms, 4),
+        "full_scan_ms": round(scan_ms, 4),
+        "expired": removed,
+        "expire_expired_ms": round(expire_share_ms, 3),
+        "history_mb": round((stats["bytes"]) / 2**20, 1),
+    }
+
+
+def run_backend(backend, turns, **options):
+    """Задержка append()/history() на пути запроса и время записи очереди"""
+    # Запись только явным flush(), без фонового потока
+    store = create_session_store(backend, flush_interval=3600, flush_batch=2**31, **options)
+    session_ids = [f"session-{i}" for i in range(BACKEND_SESSIONS)]
+
+    start = time.perf_counter()
+    for _ in range(turns):
+        for session_id in session_ids:
+            store.append(session_id, QUESTION, ANSWER)
+    append_us = (time.perf_counter() - start) * 1e6 / (turns * len(session_ids))
+
+    start = time.perf_counter()
+    flushed = store.flush() if hasattr(store, "flush") else 0
+    flush_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    for session_id in session_ids:
+        store.history(session_id)
+    history_us = (time.perf_counter() - start) * 1e6 / len(session_ids)
+    store.close()
+    return {
+        "backend": backend,
+        "append_us": round(append_us, 1),
+        "history_us": round(history_us, 1),
+        "flushed_sessions": flushed,
+        "flush_ms": round(flush_ms, 1),
+    }
+
+
+def main_cli():
+    args = parse_arguments()
+    results = [run_one(count, args.turns, args.expired_share) for count in args.sessions]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        backends = [run_backend("memory", args.turns, max_bytes=2**40),
+                    run_backend("sqlite", args.turns, path=os.path.join(tmp_dir, "sessions.sqlite"))]
+    if args.redis_url:
+        backends.append(run_backend("redis", args.turns, url=args.redis_url))
+
+    print(f"\n{'Сессий':>8} {'expire(), мс':>13} {'Полный проход, мс':>18} {'Удалено':>8} {'Удаление, мс':>13} "
+          f"{'История, МБ':>12}")
+    for row in results:
+        print(f"{row['sessions']:>8} {row['expire_idle_ms']:>13} {row['full_scan_ms']:>18} {row['expired']:>8} "
+              f"{row['expire_expired_ms']:>13} {row['history_mb']:>12}")
+
+    print(f"\nСессий: {BACKEND_SESSIONS}, шагов: {args.turns}")
+    print(f"{'Хранилище':<10} {'append(), мкс':>14} {'history(), мкс':>15} {'Запись очереди, мс':>19}")
+    for row in backends:
+        print(f"{row['backend']:<10} {row['append_us']:>14} {row['history_us']:>15} {row['flush_ms']:>19}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                "created_at": datetime.now().isoformat(),
+                "results": results,
+                "backends": backends,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Замер памяти воркеров при разных способах загрузки индекса.
+
+Запускает N процессов-воркеров, каждый из которых загружает индекс через main.vectorstore_holder
+и выполняет несколько поисков (страницы индекса становятся резидентными), затем снимает
+для каждого воркера RSS и PSS (/proc/<pid>/smaps_rollup). RSS учитывает общие страницы в каждом
+процессе, PSS делит их между процессами, поэтому сумма PSS - реальный расход памяти.
+
+Режимы:
+    spawn        - каждый воркер сам читает индекс в память (как uvicorn --workers)
+    spawn+mmap   - каждый воркер читает index.faiss через mmap
+    preload      - индекс загружается до fork, воркеры наследуют страницы (gunicorn --preload)
+    preload+mmap - preload и mmap вместе (режим start.sh при WEB_CONCURRENCY > 1)
+
+Использование:
+    python benchmarks/worker_memory.py [--index-dir DIR] [--workers N] [--output FILE]
+
+mmap дает выигрыш только для индекса, собранного с build_index_local.py --mmap (или IVF).
+"""
+
+import os
+import sys
+import json
+import argparse
+import multiprocessing
+from datetime import datetime
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+os.chdir(PROJECT_DIR)
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")  # клиенты создаются, но запросы к API не выполняются
+
+import numpy as np  # noqa: E402
+
+MODES = ["spawn", "spawn+mmap", "preload", "preload+mmap"]
+SEARCHES = 20
+QUERIES = ["обесценение активов", "аренда МСФО 16", "достаточность капитала банка", "отложенный налог"]
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Замер RSS/PSS воркеров при разных способах загрузки индекса.')
+    parser.add_argument('--index-dir', default="./index", help='Директория с индексом (по умолчанию: ./index)')
+    parser.add_argument('--workers', type=int, default=4, help='Число воркеров (по умолчанию: 4)')
+    parser.add_argument('--output', help='Сохранить результаты в JSON файл')
+    return parser.parse_args()
+
+
+def memory_kb(pid):
+    """Возвращает (RSS, PSS) процесса в килобайтах"""
+    rss = pss = 0
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                rss = int(line.split()[1])
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            if line.startswith("Pss:"):
+                pss = int(line.split()[1])
+    return rss, pss
+
+
+def configure(index_dir, mmap):
+    import main
+    main.INDEX_PATH = os.path.abspath(index_dir)
+    main.LOCAL_INDEX_PATH = os.path.abspath(index_dir)
+    main.FAISS_MMAP = mmap
+    return main
+
+
+def exercise(main):
+    """Несколько поисков, как при обработке запросов"""
+    index = main.vectorstore_holder.snapshot()
+    rng = np.random.default_rng(os.getpid())
+    dimension = index.full_vectors.shape[1] if index.full_vectors is not None else index.vectorstore.index.d
+    for i in range(SEARCHES):
+        vector = rng.normal(size=dimension).astype(np.float32)
+        vector /= np.linalg.norm(vector)
+        main.search_index(index, QUERIES[i % len(QUERIES)], vector.tolist())
+
+
+def spawn_worker(index_dir, mmap, ready, done):
+    main = configure(index_dir, mmap)
+    main.vectorstore_holder.get()
+    exercise(main)
+    ready.put(os.getpid())
+    done.wait()
+
+
+def forked_worker(ready, done):
+    exercise(sys.modules["main"])
+    ready.put(os.getpid())
+    done.wait()
+
+
+def run_mode(mode, index_dir, workers):
+    mmap = mode.endswith("+mmap")
+    if mode.startswith("preload"):
+        main = configure(index_dir, mmap)
+        main.vectorstore_holder.get()
+        context = multiprocessing.get_context("fork")
+        ready, done = context.Queue(), context.Event()
+        processes = [context.Process(target=forked_worker, args=(ready, done)) for _ in range(workers)]
+    else:
+        context = multiprocessing.get_context("spawn")
+        ready, done = context.Queue(), context.Event()
+        processes = [context.Process(target=spawn_worker, args=(index_dir, mmap, ready, done))
+                     for _ in range(workers)]
+
+    for process in processes:
+        process.start()
+    pids = [ready.get(timeout=600) for _ in processes]
+    measurements = [memory_kb(pid) for pid in pids]
+    # При preload мастер-процесс тоже держит индекс (в gunicorn это arbiter)
+    master_pss = memory_kb(os.getpid())[1] / 1024 if mode.startswith("preload") else 0
+    done.set()
+    for process in processes:
+        process.join()
+
+    rss = [value[0] / 1024 for value in measurements]
+    pss = [value[1] / 1024 for value in measurements]
+    return {
+        "mode": mode,
+        "workers": workers,
+        "avg_rss_mb": round(sum(rss) / len(rss), 1),
+        "avg_pss_mb": round(sum(pss) / len(pss), 1),
+        "master_pss_mb": round(master_pss, 1),
+        "total_pss_mb": round(sum(pss) + master_pss, 1),
+    }
+
+
+def run_mode_isolated(mode, index_dir, workers, results):
+    results.put(run_mode(mode, index_dir, workers))
+
+
+def main_cli():
+    args = parse_arguments()
+    results = []
+    # Каждый режим - в отдельном мастер-процессе, чтобы предыдущий режим не влиял на замер
+    context = multiprocessing.get_context("spawn")
+    for mode in MODES:
+        print(f"Режим {mode}: запуск {args.workers} воркеров...")
+        queue = context.Queue()
+        master = context.Process(target=run_mode_isolated, args=(mode, args.index_dir, args.workers, queue))
+        master.start()
+        results.append(queue.get())
+        master.join()
+
+    print(f"\n{'Режим':<14} {'RSS воркера, МБ':>16} {'PSS воркера, МБ':>16} {'PSS мастера, МБ':>16} {'Сумма PSS, МБ':>14}")
+    for row in results:
+        print(f"{row['mode']:<14} {row['avg_rss_mb']:>16} {row['avg_pss_mb']:>16} {row['master_pss_mb']:>16} "
+              f"{row['total_pss_mb']:>14}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                "created_at": datetime.now().isoformat(),
+                "index_dir": args.index_dir,
+                "results": results,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -4,6 +4,10 @@
 
 Использование:
     python build_index_local.py [--docs-dir DIR] [--openai-api-key KEY] [--max-docs NUM] [--direct-copy]
+                                [--index-type flat|ivf|hnsw] [--nlist N] [--nprobe N]
+                                [--hnsw-m M] [--ef-construction N] [--ef-search N]
+                                [--codec none|fp16|int8|pq] [--pq-m M] [--dimensions N] [--rescore]
+                                [--mmap]
 
 По умолчанию скрипт:
 1. Использует документы из директории ./docs внутри проекта
@@ -31,10 +35,17 @@ try:
     )
     from langchain_community.vectorstores import FAISS
     from langchain_openai import OpenAIEmbeddings
+    import tiktoken
+    from lexical_index import LEXICAL_INDEX_FILE, LexicalIndex
+    from reference_map import REFERENCE_MAP_FILE, ReferenceMap, build_reference_map
+    import numpy as np
+    import faiss
+    import vector_index
+    from chunk_store import CHUNK_STORE_FILE, build_chunk_store
 except ImportError as e:
     print(f"Ошибка импорта: {e}")
     print("Для работы скрипта необходимо установить библиотеки. Запустите:")
-    print("pip install langchain langchain_community langchain_openai pypdf python-dotenv")
+    print("pip install langchain langchain_community langchain_openai pypdf python-dotenv tiktoken")
     sys.exit(1)
 
 # Загрузка переменных окружения из .env файла, если он существует
@@ -44,6 +55,7 @@ load_dotenv()
 DEFAULT_DOCS_DIR = "./docs"  # Директория с документами внутри проекта
 INDEX_DIR = "./index"  # Путь для сохранения индекса внутри проекта
 RENDER_INDEX_DIR = "/data"  # Путь к директории Render для возможности прямого копирования
+TOKEN_ENCODING = "cl100k_base"  # Токенизатор для подсчета токенов чанков (используется в main.py)
 
 
 def parse_arguments():
@@ -53,10 +65,36 @@ def parse_arguments():
                         help=f'Директория с документами (по умолчанию: {DEFAULT_DOCS_DIR})')
     parser.add_argument('--openai-api-key',
                         help='API ключ OpenAI (по умолчанию берется из переменной OPENAI_API_KEY)')
+    parser.add_argument('--openai-base-url',
+                        help='Адрес OpenAI-совместимого API, например http://127.0.0.1:8100/v1 для '
+                             'benchmarks/fake_openai.py (по умолчанию берется из переменной OPENAI_BASE_URL)')
     parser.add_argument('--max-docs', type=int, default=0,
                         help='Максимальное количество документов для обработки (0 = все документы)')
     parser.add_argument('--direct-copy', action='store_true',
                         help='Копировать индекс напрямую в директорию Render (для запуска на Render)')
+    parser.add_argument('--index-type', choices=vector_index.INDEX_TYPES, default='flat',
+                        help='Тип FAISS индекса: flat (точный), ivf или hnsw (по умолчанию: flat)')
+    parser.add_argument('--nlist', type=int, default=0,
+                        help='Число кластеров IVF (0 = около 4 * sqrt(число чанков))')
+    parser.add_argument('--nprobe', type=int, default=vector_index.DEFAULT_NPROBE,
+                        help=f'Число просматриваемых кластеров IVF при поиске (по умолчанию: {vector_index.DEFAULT_NPROBE})')
+    parser.add_argument('--hnsw-m', type=int, default=vector_index.DEFAULT_HNSW_M,
+                        help=f'Число связей узла HNSW (по умолчанию: {vector_index.DEFAULT_HNSW_M})')
+    parser.add_argument('--ef-construction', type=int, default=vector_index.DEFAULT_EF_CONSTRUCTION,
+                        help=f'efConstruction для HNSW (по умолчанию: {vector_index.DEFAULT_EF_CONSTRUCTION})')
+    parser.add_argument('--ef-search', type=int, default=vector_index.DEFAULT_EF_SEARCH,
+                        help=f'efSearch для HNSW при поиске (по умолчанию: {vector_index.DEFAULT_EF_SEARCH})')
+    parser.add_argument('--codec', choices=vector_index.CODECS, default='none',
+                        help='Хранение векторов: none (float32), fp16, int8 или pq (по умолчанию: none)')
+    parser.add_argument('--pq-m', type=int, default=0,
+                        help=f'Число подвекторов PQ, делитель размерности (0 = наибольший делитель '
+                             f'не больше {vector_index.DEFAULT_PQ_M})')
+    parser.add_argument('--dimensions', type=int, default=0,
+                        help='Размерность векторов в индексе (0 = полная размерность модели эмбеддингов)')
+    parser.add_argument('--rescore', action='store_true',
+                        help='Сохранить полные векторы для переранжирования кандидатов (вместе с --dimensions)')
+    parser.add_argument('--mmap', action='store_true',
+                        help='Сохранить индекс в формате для чтения через mmap (общая копия для всех воркеров)')
 
     return parser.parse_args()
 
@@ -88,8 +126,11 @@ def extract_title(text, filename):
         return f"Документ: {filename}"
 
 
-def build_index(docs_dir, max_docs=0):
-    """Строит FAISS индекс из всех документов в указанной директории"""
+def build_index(docs_dir, max_docs=0, index_options=None):
+    """Строит FAISS индекс из всех документов в указанной директории.
+
+    index_options - параметры vector_index.build_faiss_index (тип индекса, nlist, nprobe, ...)
+    """
     print(f"Начинаем индексацию документов из {docs_dir}...")
 
     # Проверяем наличие директории с документами
@@ -134,10 +175,7 @@ def build_index(docs_dir, max_docs=0):
         return None
 
     # Создаем векторайзер для эмбеддингов
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-
-    # Инициализируем словарь для хранения чанков
-    chunk_store = {}
+    embeddings = OpenAIEmbeddings(model="text-embedding-3-small", openai_api_base=os.environ.get("OPENAI_BASE_URL"))
 
     # Обрабатываем все файлы
     all_docs = []
@@ -168,6 +206,7 @@ def build_index(docs_dir, max_docs=0):
             for page in pages:
                 source_title = extract_title(page.page_content, file.name)
                 page.metadata["source"] = source_title
+                page.metadata["file"] = file.name
                 all_docs.append(page)
 
             print(f"  Документ успешно обработан")
@@ -200,15 +239,64 @@ def build_index(docs_dir, max_docs=0):
     texts = splitter.split_documents(all_docs)
     print(f"Создано {len(texts)} чанков")
 
+    # Заранее считаем токены каждого чанка, чтобы бюджет промпта собирался без токенизации
+    encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+    for text in texts:
+        text.metadata["token_count"] = len(encoding.encode(text.page_content))
+
     # Создаем FAISS индекс
     print("Создаем FAISS индекс...")
     db = FAISS.from_documents(texts, embeddings)
 
+    # Перестраиваем индекс нужного типа, кодека и размерности по тем же векторам;
+    # позиции чанков не меняются
+    index_options = dict(index_options or {})
+    index_type = index_options.pop("index_type", "flat")
+    codec = index_options.pop("codec", "none")
+    dimensions = index_options.pop("dimensions", 0)
+    keep_full_vectors = index_options.pop("rescore", False)
+    mmap = index_options.get("mmap", False)
+    full_dimensions = db.index.d
+    dimensions = dimensions if 0 < dimensions < full_dimensions else full_dimensions
+    index_params = {"codec": codec}
+    full_vectors = None
+    if index_type != "flat" or codec != "none" or dimensions != full_dimensions or mmap:
+        print(f"Перестраиваем FAISS индекс как {index_type} (кодек {codec}, {dimensions} измерений)...")
+        build_start = time.time()
+        vectors = db.index.reconstruct_n(0, db.index.ntotal)
+        if dimensions != full_dimensions and keep_full_vectors:
+            full_vectors = vectors
+        vectors = vector_index.reduce_dimensions(vectors, dimensions)
+        try:
+            db.index, index_params = vector_index.build_faiss_index(vectors, index_type, codec, **index_options)
+        except ValueError as e:
+            print(f"Ошибка: не удалось построить индекс {index_type} (кодек {codec}): {e}")
+            return None
+        print(f"Индекс {index_type} построен за {time.time() - build_start:.1f} сек, параметры: {index_params}")
+        print(f"Байт на вектор: {vector_index.bytes_per_vector(db.index)} (полный float32: {full_dimensions * 4})")
+
     print("FAISS индекс успешно создан!")
 
+    # Лексический индекс BM25: номер документа совпадает с позицией вектора в FAISS
+    print("Создаем лексический индекс BM25...")
+    lexical_index = LexicalIndex.build([f"{text.metadata.get('source', '')}\n{text.page_content}" for text in texts])
+    print(f"Лексический индекс создан: {len(lexical_index.vocab)} терминов")
+
+    # Карта ссылок на стандарты и нормы: идентификатор -> диапазоны позиций чанков в FAISS
+    reference_map = ReferenceMap(build_reference_map([text.metadata.get("file", "") for text in texts]))
+    print(f"Карта ссылок создана: {len(reference_map.ranges)} идентификаторов")
+
     return {
         "vectorstore": db,
-        "chunk_store": chunk_store,
+        "index_type": index_type,
+        "codec": codec,
+        "index_params": index_params,
+        "dimensions": dimensions,
+        "full_dimensions": full_dimensions,
+        "full_vectors": full_vectors,
+        "lexical_index": lexical_index,
+        "reference_map": reference_map,
+        "chunks": texts,
         "document_count": len(all_docs),
         "chunk_count": len(texts),
         "error_files": error_files
@@ -222,15 +310,29 @@ def save_index_to_directory(index_data, output_dir):
     # Создаем директорию если её нет
     os.makedirs(output_dir, exist_ok=True)
 
-    # Сохраняем FAISS индекс
-    index_data["vectorstore"].save_local(output_dir)
+    # Сохраняем FAISS индекс; текст чанков хранится в chunks.sqlite вместо pickle (index.pkl)
+    faiss.write_index(index_data["vectorstore"].index, os.path.join(output_dir, "index.faiss"))
+    stale_pickle = os.path.join(output_dir, "index.pkl")
+    if os.path.exists(stale_pickle):
+        os.remove(stale_pickle)
     print("Индекс FAISS сохранен")
 
-    # Сохраняем chunk_store
-    chunk_store_path = os.path.join(output_dir, "chunk_store.json")
-    with open(chunk_store_path, 'w', encoding='utf-8') as f:
-        json.dump(index_data["chunk_store"], f, ensure_ascii=False, indent=2)
-    print(f"Сохранен chunk_store с {len(index_data['chunk_store'])} чанками")
+    # Сохраняем хранилище чанков: номер чанка совпадает с позицией вектора в FAISS
+    chunk_count, source_count = build_chunk_store(os.path.join(output_dir, CHUNK_STORE_FILE), index_data["chunks"])
+    print(f"Хранилище чанков сохранено: {chunk_count} чанков, {source_count} уникальных источников")
+
+    # Сохраняем полные векторы для двухэтапного поиска
+    if index_data["full_vectors"] is not None:
+        np.save(os.path.join(output_dir, vector_index.FULL_VECTORS_FILE), index_data["full_vectors"])
+        print(f"Полные векторы для переранжирования сохранены ({index_data['full_dimensions']} измерений)")
+
+    # Сохраняем лексический индекс
+    index_data["lexical_index"].save(os.path.join(output_dir, LEXICAL_INDEX_FILE))
+    print("Лексический индекс сохранен")
+
+    # Сохраняем карту ссылок
+    index_data["reference_map"].save(os.path.join(output_dir, REFERENCE_MAP_FILE))
+    print("Карта ссылок сохранена")
 
     # Сохраняем метаданные индекса
     metadata_path = os.path.join(output_dir, "index_metadata.json")
@@ -239,6 +341,16 @@ def save_index_to_directory(index_data, output_dir):
         "document_count": index_data["document_count"],
         "chunk_count": index_data["chunk_count"],
         "error_count": len(index_data["error_files"]),
+        "token_encoding": TOKEN_ENCODING,
+        "index_type": index_data["index_type"],
+        "codec": index_data["codec"],
+        "dimensions": index_data["dimensions"],
+        "full_dimensions": index_data["full_dimensions"],
+        "full_vectors": vector_index.FULL_VECTORS_FILE if index_data["full_vectors"] is not None else None,
+        "index_params": index_data["index_params"],
+        "chunk_store": CHUNK_STORE_FILE,
+        "lexical_index": LEXICAL_INDEX_FILE,
+        "reference_map": REFERENCE_MAP_FILE,
     }
 
     with open(metadata_path, 'w', encoding='utf-8') as f:
@@ -336,6 +448,9 @@ def main():
     # Установка API ключа OpenAI, если указан
     if args.openai_api_key:
         os.environ["OPENAI_API_KEY"] = args.openai_api_key
+    if args.openai_base_url:
+        os.environ["OPENAI_BASE_URL"] = args.openai_base_url
+        print(f"OpenAI-совместимый API: {args.openai_base_url}")
 
     # Проверяем наличие API ключа OpenAI
     if not os.environ.get("OPENAI_API_KEY"):
@@ -356,8 +471,26 @@ def main():
     else:
         print(f"Стандартный режим. Индекс будет сохранен в локальную директорию {INDEX_DIR}")
 
+    if args.codec == "pq" and args.pq_m and args.dimensions and args.dimensions % args.pq_m:
+        print(f"Ошибка: --pq-m {args.pq_m} должно делить --dimensions {args.dimensions}; "
+              f"подходит, например, {vector_index.default_pq_m(args.dimensions)} (или --pq-m 0)")
+        return 1
+
     # Строим индекс из локальной директории документов
-    index_data = build_index(args.docs_dir, args.max_docs)
+    index_options = {
+        "index_type": args.index_type,
+        "nlist": args.nlist,
+        "nprobe": args.nprobe,
+        "hnsw_m": args.hnsw_m,
+        "ef_construction": args.ef_construction,
+        "ef_search": args.ef_search,
+        "codec": args.codec,
+        "pq_m": args.pq_m or None,
+        "dimensions": args.dimensions,
+        "rescore": args.rescore,
+        "mmap": args.mmap,
+    }
+    index_data = build_index(args.docs_dir, args.max_docs, index_options)
     if not index_data:
         print("Ошибка: не удалось создать индекс")
         return 1
@@ -42,6 +42,11 @@ switch ($action) {
         handle_chat_request();
         break;
 
+    case 'ask_stream':
+        // Потоковый запрос к боту (Server-Sent Events)
+        handle_chat_stream_request();
+        break;
+
     case 'login':
         // Проверка пароля администратора
         handle_admin_login();
@@ -162,6 +167,114 @@ function handle_chat_request() {
     echo $body;
 }
 
+// Функция для потоковой передачи ответа бота (Server-Sent Events)
+function handle_chat_stream_request() {
+    global $bot_api_url;
+
+    $question = isset($_POST['q']) ? $_POST['q'] : '';
+
+    if (empty($question)) {
+        echo json_encode([
+            'status' => 'error',
+            'message' => 'Вопрос не может быть пустым',
+            'answer' => 'Пожалуйста, введите ваш вопрос.'
+        ]);
+        return;
+    }
+
+    $ch = curl_init($bot_api_url . '/ask/stream');
+    curl_setopt($ch, CURLOPT_POST, true);
+    curl_setopt($ch, CURLOPT_POSTFIELDS, http_build_query(['q' => $question]));
+    curl_setopt($ch, CURLOPT_CONNECTTIMEOUT, 10);
+    // Общий таймаут не ограничиваем жестко 30 секундами: данные идут непрерывно
+    curl_setopt($ch, CURLOPT_TIMEOUT, 300);
+
+    if (!empty($_COOKIE['session_id'])) {
+        curl_setopt($ch, CURLOPT_COOKIE, 'session_id=' . $_COOKIE['session_id']);
+    }
+
+    // Поток пересылаем только для ответа 200 с text/event-stream; ошибки бота (очередь
+    // переполнена, недоступен OpenAI и т.п.) приходят JSON-ом и отдаются клиенту с исходным кодом
+    $upstream = ['status' => 0, 'content_type' => '', 'streaming' => false, 'body' => ''];
+
+    curl_setopt($ch, CURLOPT_HEADERFUNCTION, function ($ch, $header_line) use (&$upstream) {
+        if (preg_match('/^HTTP\/\S+\s+(\d{3})/', $header_line, $match)) {
+            // Строка статуса; после промежуточного ответа (100 Continue) придет следующая
+            $upstream['status'] = (int)$match[1];
+            $upstream['content_type'] = '';
+        } elseif (preg_match('/^Content-Type:\s*([^;\r\n]*)/i', $header_line, $match)) {
+            $upstream['content_type'] = strtolower(trim($match[1]));
+        } elseif (preg_match('/^Set-Cookie:\s*([^;]*)/i', $header_line, $match)) {
+            // Передаем куки сессии из ответа бота клиенту
+            $parts = explode('=', $match[1], 2);
+            if (count($parts) === 2) {
+                setcookie(trim($parts[0]), trim($parts[1]), 0, '/');
+            }
+        } elseif (trim($header_line) === '' && $upstream['status'] >= 200) {
+            // Заголовки ответа закончились: решаем, пересылать ли поток
+            if ($upstream['status'] === 200 && $upstream['content_type'] === 'text/event-stream') {
+                $upstream['streaming'] = true;
+                // Заголовки потока: ответ отдается клиенту по мере генерации
+                header('Content-Type: text/event-stream; charset=utf-8');
+                header('X-Accel-Buffering: no');
+                while (ob_get_level() > 0) {
+                    ob_end_flush();
+                }
+            } else {
+                http_response_code($upstream['status']);
+            }
+        }
+        return strlen($header_line);
+    });
+
+    // Фрагменты потока пересылаем сразу, тело ответа с ошибкой собираем целиком
+    curl_setopt($ch, CURLOPT_WRITEFUNCTION, function ($ch, $data) use (&$upstream) {
+        if ($upstream['streaming']) {
+            echo $data;
+            flush();
+        } else {
+            $upstream['body'] .= $data;
+        }
+        return strlen($data);
+    });
+
+    $result = curl_exec($ch);
+
+    if ($result === false || curl_errno($ch)) {
+        $error = curl_error($ch);
+        curl_close($ch);
+        if ($upstream['streaming']) {
+            echo "event: error\ndata: " . json_encode([
+                'message' => 'Извините, произошла ошибка при обработке вашего запроса. Пожалуйста, попробуйте позже.'
+            ]) . "\n\n";
+            flush();
+        } else {
+            echo json_encode([
+                'status' => 'error',
+                'message' => 'Ошибка при подключении к API бота: ' . $error,
+                'answer' => 'Извините, произошла ошибка при обработке вашего запроса. Пожалуйста, попробуйте позже.'
+            ]);
+        }
+        return;
+    }
+
+    curl_close($ch);
+
+    if (!$upstream['streaming']) {
+        // Ответ бота не поток: JSON отдаем как есть, иное тело заменяем описанием ошибки
+        json_decode($upstream['body']);
+        if ($upstream['content_type'] === 'application/json' && json_last_error() === JSON_ERROR_NONE) {
+            echo $upstream['body'];
+        } else {
+            echo json_encode([
+                'status' => 'error',
+                'message' => 'API бота вернул ошибку. Код: ' . $upstream['status'],
+                'answer' => 'Извините, сервис временно недоступен. Пожалуйста, попробуйте позже.'
+            ]);
+        }
+    }
+}
+
 // Функция для обработки запроса на логин администратора
 function handle_admin_login() {
     global $admin_password;
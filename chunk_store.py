@@ -0,0 +1,216 @@
+"""
+Хранилище чанков на диске вместо pickle docstore LangChain.
+
+build_index_local.py записывает текст и метаданные каждого чанка в SQLite (chunks.sqlite)
+по номеру чанка, который совпадает с позицией его вектора в index.faiss. Заголовки источников
+хранятся один раз в отдельной таблице. main.py открывает базу только для чтения и читает
+текст лишь найденных чанков; недавно прочитанные чанки держатся в небольшом LRU.
+
+Схема:
+    sources(id, title)                    - уникальные заголовки источников
+    chunks(position, source_id, content, metadata) - metadata без "source", JSON
+"""
+
+import os
+import sys
+import json
+import sqlite3
+import operator
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+
+from langchain_core.documents import Document
+
+CHUNK_STORE_FILE = "chunks.sqlite"
+
+DEFAULT_CACHE_SIZE = 512
+MMAP_SIZE = 256 * 1024 * 1024  # SQLite читает файл через mmap: страницы общие для всех воркеров
+
+
+class ChunkStoreReplaced(RuntimeError):
+    """Файл чанков заменен новой версией индекса после того, как хранилище было открыто"""
+
+
+def file_identity(path):
+    """Идентичность файла: новый файл под тем же именем (os.replace) дает другое значение"""
+    stat = os.stat(path)
+    return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def build_chunk_store(path, documents):
+    """Записывает чанки в новую базу; номер чанка - его порядковый номер в documents"""
+    if os.path.exists(path):
+        os.remove(path)
+    db = sqlite3.connect(path)
+    try:
+        db.execute("CREATE TABLE sources (id INTEGER PRIMARY KEY, title TEXT NOT NULL UNIQUE)")
+        db.execute(
+            "CREATE TABLE chunks (position INTEGER PRIMARY KEY, source_id INTEGER NOT NULL, "
+            "content TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+
+        source_ids = {}
+        rows = []
+        for position, document in enumerate(documents):
+            metadata = dict(document.metadata)
+            title = metadata.pop("source", "")
+            source_id = source_ids.get(title)
+            if source_id is None:
+                source_id = len(source_ids)
+                source_ids[title] = source_id
+            rows.append((position, source_id, document.page_content, json.dumps(metadata, ensure_ascii=False)))
+
+        db.executemany("INSERT INTO sources (id, title) VALUES (?, ?)",
+                       [(source_id, title) for title, source_id in source_ids.items()])
+        db.executemany("INSERT INTO chunks (position, source_id, content, metadata) VALUES (?, ?, ?, ?)", rows)
+        db.commit()
+        db.execute("VACUUM")
+    finally:
+        db.close()
+    return len(rows), len(source_ids)
+
+
+class PositionIds(Mapping):
+    """index_to_docstore_id для ChunkStore: позиция вектора в FAISS и есть идентификатор чанка.
+
+    Отображение тождественное, поэтому вычисляется при обращении, а не хранится словарем
+    на каждый вектор индекса.
+    """
+
+    def __init__(self, count):
+        self.count = count
+
+    def __getitem__(self, position):
+        try:
+            position = operator.index(position)  # FAISS отдает позиции как numpy.int64
+        except TypeError:
+            raise KeyError(position) from None
+        if not 0 <= position < self.count:
+            raise KeyError(position)
+        return position
+
+    def __iter__(self):
+        return iter(range(self.count))
+
+    def __len__(self):
+        return self.count
+
+
+class ChunkStore:
+    """Чтение чанков по номеру из chunks.sqlite с LRU недавно прочитанных чанков.
+
+    Реализует search() как docstore LangChain, поэтому подходит для FAISS(..., docstore=...)
+    с index_to_docstore_id = PositionIds(count): идентификатор чанка - его позиция.
+
+    Хранилище привязано к версии файла, открытой вместе с индексом: если после fork файл по
+    тому же пути уже заменен новой версией, чтение завершается ChunkStoreReplaced, а не
+    возвращает тексты новой таблицы по позициям старого FAISS индекса.
+    """
+
+    def __init__(self, path, cache_size=DEFAULT_CACHE_SIZE):
+        self.path = path
+        self.cache_size = cache_size
+        self._db = None
+        self._db_pid = None
+        self._db_lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._identity = file_identity(path)
+        self.hits = 0
+        self.misses = 0
+
+        # Заголовки источников загружаются один раз; все чанки источника ссылаются на одну строку
+        with self._db_lock:
+            db = self._connection()
+            self._titles = {source_id: sys.intern(title)
+                            for source_id, title in db.execute("SELECT id, title FROM sources")}
+            # Позиции идут подряд с нуля; MAX по первичному ключу не читает всю таблицу, в отличие от COUNT(*)
+            self.count = db.execute("SELECT COALESCE(MAX(position) + 1, 0) FROM chunks").fetchone()[0]
+
+    def _connection(self):
+        """Соединение текущего процесса: после fork (gunicorn --preload) открывается заново"""
+        if self._db is None or self._db_pid != os.getpid():
+            if file_identity(self.path) != self._identity:
+                raise ChunkStoreReplaced(f"{self.path} заменен новой версией индекса")
+            db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            # Файл могли заменить между проверкой и открытием
+            if file_identity(self.path) != self._identity:
+                db.close()
+                raise ChunkStoreReplaced(f"{self.path} заменен новой версией индекса")
+            db.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+            self._db = db
+            self._db_pid = os.getpid()
+        return self._db
+
+    def _cached(self, position):
+        with self._cache_lock:
+            document = self._cache.get(position)
+            if document is not None:
+                self._cache.move_to_end(position)
+            return document
+
+    def _remember(self, position, document):
+        with self._cache_lock:
+            self._cache[position] = document
+            self._cache.move_to_end(position)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _document(self, source_id, content, metadata):
+        metadata = json.loads(metadata)
+        metadata["source"] = self._titles[source_id]
+        return Document(page_content=content, metadata=metadata)
+
+    def get_many(self, positions):
+        """Возвращает чанки в порядке positions; недостающие читаются одним запросом"""
+        positions = [int(position) for position in positions]
+        found = {}
+        missing = []
+        for position in dict.fromkeys(positions):
+            document = self._cached(position)
+            if document is not None:
+                found[position] = document
+            else:
+                missing.append(position)
+        self.hits += len(found)
+        self.misses += len(missing)
+
+        if missing:
+            placeholders = ",".join("?" * len(missing))
+            with self._db_lock:
+                rows = self._connection().execute(
+                    f"SELECT position, source_id, content, metadata FROM chunks WHERE position IN ({placeholders})",
+                    missing,
+                ).fetchall()
+            for position, source_id, content, metadata in rows:
+                document = self._document(source_id, content, metadata)
+                found[position] = document
+                self._remember(position, document)
+
+        return [found[position] for position in positions if position in found]
+
+    def get(self, position):
+        documents = self.get_many([position])
+        return documents[0] if documents else None
+
+    def search(self, search):
+        """Интерфейс docstore LangChain: чанк по идентификатору (позиции) или строка с ошибкой"""
+        document = self.get(search)
+        return document if document is not None else f"ID {search} not found."
+
+    def close(self):
+        with self._db_lock:
+            if self._db is not None and self._db_pid == os.getpid():
+                self._db.close()
+            self._db = None
+
+    def stats(self):
+        return {
+            "chunks": self.count,
+            "sources": len(self._titles),
+            "cached": len(self._cache),
+            "cache_size": self.cache_size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,304 @@
+"""
+Лексический индекс BM25 по нормализованным русским токенам.
+
+Строится в build_index_local.py рядом с FAISS индексом и используется в main.py
+для гибридного поиска. Документы индекса - чанки в том же порядке, что и векторы
+в index.faiss, поэтому номер документа совпадает с позицией вектора в FAISS.
+
+Формат на диске (lexical_index.npz, numpy):
+    vocab         - термины через "\\n" в UTF-8
+    term_offsets  - границы списков вхождений каждого термина (CSR)
+    postings_docs - номера чанков
+    postings_tf   - частота термина в чанке
+    doc_lengths   - длина чанка в токенах
+"""
+
+import re
+import math
+
+import numpy as np
+
+LEXICAL_INDEX_FILE = "lexical_index.npz"
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+TOKEN_PATTERN = re.compile(r"[а-яёa-z0-9]+")
+
+STOPWORDS = {
+    "и", "в", "во", "не", "что", "он", "на", "я", "с", "со", "как", "а", "то", "все", "она", "так",
+    "его", "но", "да", "ты", "к", "у", "же", "вы", "за", "бы", "по", "только", "ее", "мне", "было",
+    "вот", "от", "меня", "еще", "нет", "о", "из", "ему", "теперь", "когда", "даже", "ну", "ли",
+    "если", "уже", "или", "ни", "быть", "был", "него", "до", "вас", "нибудь", "опять", "уж", "вам",
+    "ведь", "там", "потом", "себя", "ничего", "ей", "может", "они", "тут", "где", "есть", "надо",
+    "ней", "для", "мы", "тебя", "их", "чем", "была", "сам", "чтоб", "без", "будто", "чего", "раз",
+    "тоже", "себе", "под", "будет", "ж", "тогда", "кто", "этот", "того", "потому", "этого", "какой",
+    "ним", "здесь", "этом", "один", "мой", "тем", "чтобы", "нее", "были", "куда", "зачем", "всех",
+    "можно", "при", "об", "это", "эти", "который", "которые", "такое", "также",
+}
+
+# --- Стеммер Snowball для русского языка ---
+
+_VOWELS = "аеиоуыэюя"
+
+_PERFECTIVE_GERUND_1 = ("вшись", "вши", "в")  # после "а" или "я"
+_PERFECTIVE_GERUND_2 = ("ывшись", "ившись", "ывши", "ивши", "ыв", "ив")
+_REFLEXIVE = ("ся", "сь")
+_ADJECTIVE = ("ими", "ыми", "его", "ого", "ему", "ому", "ее", "ие", "ые", "ое", "ей", "ий", "ый", "ой",
+              "ем", "им", "ым", "ом", "их", "ых", "ую", "юю", "ая", "яя", "ою", "ею")
+_PARTICIPLE_1 = ("ем", "нн", "вш", "ющ", "щ")  # после "а" или "я"
+_PARTICIPLE_2 = ("ивш", "ывш", "ующ")
+_VERB_1 = ("ете", "йте", "ешь", "нно", "ла", "на", "ли", "ем", "ло", "но", "ет", "ют", "ны", "ть",
+           "й", "л", "н")  # после "а" или "я"
+_VERB_2 = ("ейте", "уйте", "ила", "ыла", "ена", "ите", "или", "ыли", "ило", "ыло", "ено", "ует", "уют",
+           "ены", "ить", "ыть", "ишь", "ей", "уй", "ил", "ыл", "им", "ым", "ен", "ят", "ит", "ыт",
+           "ую", "ю")
+_NOUN = ("иями", "ями", "ами", "ией", "иям", "ием", "иях", "ев", "ов", "ие", "ье", "еи", "ии", "ей",
+         "ой", "ий", "ям", "ем", "ам", "ом", "ах", "ях", "ию", "ью", "ия", "ья", "а", "е", "и", "й",
+         "о", "у", "ы", "ь", "ю", "я")
+_SUPERLATIVE = ("ейше", "ейш")
+_DERIVATIONAL = ("ость", "ост")
+
+
+def _by_length(endings):
+    return tuple(sorted(endings, key=len, reverse=True))
+
+
+_PERFECTIVE_GERUND_1 = _by_length(_PERFECTIVE_GERUND_1)
+_PERFECTIVE_GERUND_2 = _by_length(_PERFECTIVE_GERUND_2)
+_ADJECTIVE = _by_length(_ADJECTIVE)
+_PARTICIPLE_1 = _by_length(_PARTICIPLE_1)
+_PARTICIPLE_2 = _by_length(_PARTICIPLE_2)
+_VERB_1 = _by_length(_VERB_1)
+_VERB_2 = _by_length(_VERB_2)
+_NOUN = _by_length(_NOUN)
+
+
+def _strip(word, endings, after_a_ya=False):
+    """Удаляет самое длинное подходящее окончание; возвращает None, если ничего не подошло"""
+    for ending in endings:
+        if word.endswith(ending):
+            stem = word[:-len(ending)]
+            if after_a_ya and not stem.endswith(("а", "я")):
+                continue
+            return stem
+    return None
+
+
+def _regions(word):
+    """Возвращает начало областей RV и R2 по правилам Snowball"""
+    rv = len(word)
+    for i, char in enumerate(word):
+        if char in _VOWELS:
+            rv = i + 1
+            break
+
+    def next_region(start):
+        for i in range(start + 1, len(word)):
+            if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+                return i + 1
+        return len(word)
+
+    r1 = next_region(0)
+    r2 = next_region(r1)
+    return rv, r2
+
+
+def stem_russian(word):
+    """Упрощенная реализация стеммера Snowball для русского языка"""
+    word = word.replace("ё", "е")
+    rv_start, r2_start = _regions(word)
+    prefix, rv = word[:rv_start], word[rv_start:]
+
+    # Шаг 1
+    stem = _strip(rv, _PERFECTIVE_GERUND_1, after_a_ya=True)
+    if stem is None:
+        stem = _strip(rv, _PERFECTIVE_GERUND_2)
+    if stem is not None:
+        rv = stem
+    else:
+        reflexive = _strip(rv, _REFLEXIVE)
+        if reflexive is not None:
+            rv = reflexive
+        stem = _strip(rv, _ADJECTIVE)
+        if stem is not None:
+            participle = _strip(stem, _PARTICIPLE_1, after_a_ya=True)
+            if participle is None:
+                participle = _strip(stem, _PARTICIPLE_2)
+            rv = participle if participle is not None else stem
+        else:
+            stem = _strip(rv, _VERB_1, after_a_ya=True)
+            if stem is None:
+                stem = _strip(rv, _VERB_2)
+            if stem is None:
+                stem = _strip(rv, _NOUN)
+            if stem is not None:
+                rv = stem
+
+    # Шаг 2
+    if rv.endswith("и"):
+        rv = rv[:-1]
+
+    # Шаг 3: словообразовательные окончания только в области R2
+    r2_in_rv = max(r2_start - rv_start, 0)
+    for ending in _DERIVATIONAL:
+        if rv.endswith(ending) and len(rv) - len(ending) >= r2_in_rv:
+            rv = rv[:-len(ending)]
+            break
+
+    # Шаг 4
+    if rv.endswith("нн"):
+        rv = rv[:-1]
+    else:
+        stem = _strip(rv, _SUPERLATIVE)
+        if stem is not None:
+            rv = stem[:-1] if stem.endswith("нн") else stem
+        elif rv.endswith("ь"):
+            rv = rv[:-1]
+
+    return prefix + rv
+
+
+def tokenize(text):
+    """Разбивает текст на нормализованные токены для BM25.
+
+    Кириллические слова приводятся к основе, латиница и числа сохраняются как есть.
+    Для пары "слово число" ("IAS 36", "Правила 188", "статья 40") дополнительно
+    добавляется составной токен "ias_36", чтобы точные ссылки находились надежно.
+    """
+    tokens = []
+    previous = None
+    for raw in TOKEN_PATTERN.findall(text.lower()):
+        if raw.isdigit():
+            if previous is not None:
+                tokens.append(f"{previous}_{raw}")
+            tokens.append(raw)
+            previous = None
+            continue
+
+        if raw in STOPWORDS or len(raw) < 2:
+            previous = None
+            continue
+
+        token = stem_russian(raw) if raw[0] >= "а" else raw
+        tokens.append(token)
+        previous = token
+    return tokens
+
+
+class LexicalIndex:
+    """Инвертированный индекс BM25 в формате CSR"""
+
+    def __init__(self, vocab, term_offsets, postings_docs, postings_tf, doc_lengths):
+        self.vocab = vocab  # термин -> номер
+        self.term_offsets = term_offsets
+        self.postings_docs = postings_docs
+        self.postings_tf = postings_tf
+        self.doc_lengths = doc_lengths
+        self.doc_count = len(doc_lengths)
+        self.avg_doc_length = float(doc_lengths.mean()) if self.doc_count else 0.0
+
+    @classmethod
+    def build(cls, texts):
+        """Строит индекс по списку текстов; номер текста становится номером документа"""
+        postings = {}
+        doc_lengths = np.zeros(len(texts), dtype=np.int32)
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths[doc_id] = len(tokens)
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                postings.setdefault(token, []).append((doc_id, tf))
+
+        terms = sorted(postings)
+        term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        for i, term in enumerate(terms):
+            term_offsets[i + 1] = term_offsets[i] + len(postings[term])
+
+        postings_docs = np.empty(term_offsets[-1], dtype=np.int32)
+        postings_tf = np.empty(term_offsets[-1], dtype=np.uint16)
+        for i, term in enumerate(terms):
+            entries = postings[term]
+            start = term_offsets[i]
+            postings_docs[start:start + len(entries)] = [doc_id for doc_id, _ in entries]
+            postings_tf[start:start + len(entries)] = [min(tf, 65535) for _, tf in entries]
+
+        vocab = {term: i for i, term in enumerate(terms)}
+        return cls(vocab, term_offsets, postings_docs, postings_tf, doc_lengths)
+
+    def save(self, path):
+        terms = sorted(self.vocab, key=self.vocab.get)
+        np.savez_compressed(
+            path,
+            vocab=np.frombuffer("\n".join(terms).encode("utf-8"), dtype=np.uint8),
+            term_offsets=self.term_offsets,
+            postings_docs=self.postings_docs,
+            postings_tf=self.postings_tf,
+            doc_lengths=self.doc_lengths,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            raw_vocab = data["vocab"].tobytes().decode("utf-8")
+            terms = raw_vocab.split("\n") if raw_vocab else []
+            return cls(
+                {term: i for i, term in enumerate(terms)},
+                data["term_offsets"],
+                data["postings_docs"],
+                data["postings_tf"],
+                data["doc_lengths"],
+            )
+
+    def search(self, query, k=20, candidates=None):
+        """Возвращает до k пар (номер документа, оценка BM25) по убыванию оценки.
+
+        candidates - необязательный массив номеров документов, среди которых ведется поиск.
+        """
+        if self.doc_count == 0:
+            return []
+
+        scores = np.zeros(self.doc_count, dtype=np.float32)
+        matched = False
+        for token in set(tokenize(query)):
+            term_id = self.vocab.get(token)
+            if term_id is None:
+                continue
+            matched = True
+            start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+            docs = self.postings_docs[start:end]
+            tf = self.postings_tf[start:end].astype(np.float32)
+            df = end - start
+            idf = math.log(1 + (self.doc_count - df + 0.5) / (df + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[docs] / self.avg_doc_length)
+            scores[docs] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+        if not matched:
+            return []
+
+        if candidates is not None:
+            mask = np.zeros(self.doc_count, dtype=bool)
+            mask[candidates] = True
+            scores[~mask] = 0
+
+        k = min(k, self.doc_count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(doc_id), float(scores[doc_id])) for doc_id in top if scores[doc_id] > 0]
+
+
+def reciprocal_rank_fusion(rankings, k=60, with_scores=False):
+    """Объединяет несколько ранжированных списков номеров документов методом RRF.
+
+    with_scores=True - возвращает пары (номер документа, оценка RRF).
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    ordered = sorted(fused, key=fused.get, reverse=True)
+    if with_scores:
+        return [(doc_id, fused[doc_id]) for doc_id in ordered]
+    return ordered
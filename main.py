@@ -1,8 +1,11 @@
 from fastapi import FastAPI, Form, Request, Cookie, Response, Header
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
 from pathlib import Path
+from pydantic import BaseModel
+from typing import List
 from dotenv import load_dotenv
 from datetime import datetime
 import os
@@ -13,11 +16,37 @@ import hashlib
 import subprocess
 import tempfile
 import json
+import re
 import shutil
 import sys
+import threading
+import asyncio
+import sqlite3
+import math
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+
+import numpy as np
+import tiktoken
 
 from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+from langchain_core.embeddings import Embeddings
+from langchain_openai import ChatOpenAI
+from lexical_index import LEXICAL_INDEX_FILE, LexicalIndex, reciprocal_rank_fusion
+from reference_map import REFERENCE_MAP_FILE, ReferenceMap, references_from_query
+from chunk_store import CHUNK_STORE_FILE, ChunkStore, PositionIds
+from session_store import create_session_store
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY as METRICS
+from tracing import RequestTrace, TraceBuffer, current_trace
+from vector_index import (
+    DEFAULT_RESCORE_CANDIDATES, FULL_VECTORS_FILE, configure_search, describe as describe_faiss_index,
+    filtered_search, is_mmap_compatible, read_index as read_faiss_index, reduce_dimensions, rescore,
+)
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, stop_after_delay, wait_random_exponential
+import httpx
+import openai
 import traceback
 
 load_dotenv()
@@ -55,9 +84,150 @@ INDEX_PATH = "/data"  # Основной диск на Render
 LOCAL_INDEX_PATH = "./index"  # Локальный путь к индексу в проекте
 
 # Хранение сессий
-session_memories = {}
-session_last_activity = {}
 SESSION_MAX_AGE = 86400  # 24 часа
+SESSION_MAX_TURNS = 15  # шагов диалога в истории сессии
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_MB", "64")) * 1024 * 1024  # общий объем истории всех сессий
+# Где хранится история: memory (в процессе), sqlite (файл, общий для воркеров), redis
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "/data/sessions.sqlite")
+SESSION_REDIS_URL = os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0")
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "0.2"))  # секунд между записями истории
+# Сессий в очереди записи, пока sqlite/redis недоступны; самые давние изменения сверх лимита отбрасываются
+SESSION_MAX_PENDING = int(os.getenv("SESSION_MAX_PENDING", "10000"))
+try:
+    session_store = create_session_store(
+        SESSION_BACKEND, path=SESSION_DB_PATH, url=SESSION_REDIS_URL, max_age=SESSION_MAX_AGE,
+        max_turns=SESSION_MAX_TURNS, max_bytes=SESSION_MAX_BYTES, flush_interval=SESSION_FLUSH_INTERVAL,
+        max_pending=SESSION_MAX_PENDING,
+    )
+except Exception as e:
+    print(f"Не удалось открыть хранилище сессий {SESSION_BACKEND}: {e}. История будет храниться в памяти процесса.")
+    session_store = create_session_store("memory", max_age=SESSION_MAX_AGE, max_turns=SESSION_MAX_TURNS,
+                                         max_bytes=SESSION_MAX_BYTES)
+
+# Фоновая проверка доступности OpenAI
+OPENAI_HEALTH_INTERVAL = int(os.getenv("OPENAI_HEALTH_INTERVAL", "60"))  # секунд между проверками
+OPENAI_HEALTH_RETRY_INTERVAL = int(os.getenv("OPENAI_HEALTH_RETRY_INTERVAL", "15"))  # после неудачной проверки
+EMBEDDING_MODEL = "text-embedding-3-small"
+LLM_MODEL = "gpt-4o-mini"
+
+# Параметры общих клиентов OpenAI
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "50"))
+# OpenAI-совместимый сервер вместо api.openai.com, например benchmarks/fake_openai.py (пусто - OpenAI)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+OPENAI_MAX_ATTEMPTS = int(os.getenv("OPENAI_MAX_ATTEMPTS", "3"))
+OPENAI_RETRY_MAX_DELAY = float(os.getenv("OPENAI_RETRY_MAX_DELAY", "20"))  # секунд на все повторы
+OPENAI_BREAKER_THRESHOLD = int(os.getenv("OPENAI_BREAKER_THRESHOLD", "5"))
+OPENAI_BREAKER_RESET_TIMEOUT = int(os.getenv("OPENAI_BREAKER_RESET_TIMEOUT", "30"))
+
+# Кэш эмбеддингов запросов
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "2048"))
+# Путь к SQLite-кэшу на диске, например /data/embedding_cache.sqlite (пусто - только память)
+EMBEDDING_CACHE_DB = os.getenv("EMBEDDING_CACHE_DB", "")
+
+# Семантический кэш ответов на первые вопросы сессии
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))  # косинусная близость
+
+# Бюджет токенов промпта
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+PROMPT_HISTORY_SHARE = float(os.getenv("PROMPT_HISTORY_SHARE", "0.3"))  # доля бюджета под историю диалога
+TOKEN_ENCODING = "cl100k_base"
+CHARS_PER_TOKEN_ESTIMATE = 3  # для русского текста, если tiktoken недоступен
+
+# Поисковый запрос с учетом истории диалога
+RETRIEVAL_QUERY_MAX_CHARS = int(os.getenv("RETRIEVAL_QUERY_MAX_CHARS", "400"))
+RETRIEVAL_HISTORY_TURNS = 3  # сколько последних реплик просматривать
+RETRIEVAL_HISTORY_TERMS = 12  # сколько терминов из истории добавлять к вопросу
+
+# Гибридный поиск (FAISS + BM25)
+RETRIEVAL_K = 6  # сколько документов передавать в промпт
+HYBRID_FETCH_K = int(os.getenv("HYBRID_FETCH_K", "30"))  # кандидатов от каждого вида поиска
+RRF_K = 60  # константа reciprocal rank fusion
+
+# Эндпоинт /search: поиск без LLM, несколько запросов за один вызов
+SEARCH_MAX_QUERIES = int(os.getenv("SEARCH_MAX_QUERIES", "32"))
+SEARCH_MAX_K = int(os.getenv("SEARCH_MAX_K", "50"))
+
+# Контроль нагрузки /ask: сколько вопросов обрабатывается одновременно и сколько ждет в очереди
+ASK_MAX_IN_FLIGHT = int(os.getenv("ASK_MAX_IN_FLIGHT", "8"))
+ASK_MAX_QUEUE = int(os.getenv("ASK_MAX_QUEUE", "16"))
+ASK_QUEUE_TIMEOUT = float(os.getenv("ASK_QUEUE_TIMEOUT", "10"))  # секунд ожидания; прокси обрывает через 30
+ASK_SESSION_LIMIT = int(os.getenv("ASK_SESSION_LIMIT", "2"))  # вопросов одной сессии в работе и в очереди
+
+# Переопределение параметров поиска IVF / HNSW (по умолчанию берутся из index_metadata.json)
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "0")) or None
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "0")) or None
+
+# Двухэтапный поиск для индекса укороченных векторов: сколько кандидатов переранжировать по полным
+RESCORE_CANDIDATES = int(os.getenv("RESCORE_CANDIDATES", str(DEFAULT_RESCORE_CANDIDATES)))
+
+# Недавно прочитанные чанки из chunks.sqlite, которые держатся в памяти
+CHUNK_CACHE_SIZE = int(os.getenv("CHUNK_CACHE_SIZE", "512"))
+
+# Чтение index.faiss через mmap: векторы остаются в page cache и общие для всех воркеров
+FAISS_MMAP = os.getenv("FAISS_MMAP", "1") == "1"
+# Загрузка индекса при импорте модуля, до fork воркеров (gunicorn --preload, см. start.sh)
+PRELOAD_INDEX = os.getenv("PRELOAD_INDEX", "0") == "1"
+# Как часто каждый воркер сверяет загруженный индекс с версией на диске (обновление через другой воркер)
+INDEX_CHECK_INTERVAL = float(os.getenv("INDEX_CHECK_INTERVAL", "10"))
+
+# Пул потоков для CPU-операций (поиск FAISS), чтобы не блокировать цикл событий
+SEARCH_WORKERS = int(os.getenv("SEARCH_WORKERS", "4"))
+search_executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="faiss-search")
+
+# Метрики Prometheus (/metrics); значения кэшей, сессий и индекса собираются в момент запроса
+HTTP_REQUESTS = METRICS.counter("rag_http_requests_total", "HTTP-запросы по пути и коду ответа", ["path", "status"])
+HTTP_SECONDS = METRICS.histogram("rag_http_request_duration_seconds", "Время до ответа (заголовков) по пути", ["path"])
+STAGE_SECONDS = METRICS.histogram("rag_stage_duration_seconds", "Длительность этапов обработки вопроса", ["stage"])
+STAGE_ERRORS = METRICS.counter("rag_stage_errors_total", "Ошибки по этапам обработки вопроса", ["stage"])
+LLM_TOKENS = METRICS.counter("rag_llm_tokens_total", "Токены LLM: промпт (оценка) и ответ", ["kind"])
+ADMISSION_WAIT_SECONDS = METRICS.histogram("rag_admission_wait_seconds", "Ожидание места в очереди /ask")
+
+# Трассы последних запросов /ask для администратора (/admin/traces)
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+request_traces = TraceBuffer(TRACE_BUFFER_SIZE)
+
+
+def trace_stage(stage, seconds, trace=None):
+    """Добавляет этап в переданную трассу или в трассу текущего запроса, если она есть"""
+    if trace is None:
+        trace = current_trace.get()
+    if trace is not None:
+        trace.add_stage(stage, seconds)
+
+
+def finish_trace(trace, response):
+    """Завершает трассу, сохраняет ее для /admin/traces и добавляет заголовки трассы к ответу"""
+    trace.finish(response.status_code)
+    request_traces.add(trace)
+    return set_trace_headers(response, trace)
+
+
+def set_trace_headers(response, trace):
+    """Заголовки Server-Timing (длительность этапов) и X-Trace-Id"""
+    response.headers["Server-Timing"] = trace.server_timing()
+    response.headers["X-Trace-Id"] = trace.trace_id
+    return response
+
+
+@contextmanager
+def stage_timer(stage, trace=None):
+    """Замеряет этап обработки вопроса; исключение внутри этапа считается ошибкой этапа.
+
+    Без trace этап записывается в трассу текущего запроса (current_trace).
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_SECONDS.observe(seconds, stage=stage)
+        trace_stage(stage, seconds, trace)
 
 
 # Функция для очистки диска Render при необходимости
@@ -99,6 +269,17 @@ def clear_render_storage(except_files=None):
         return False
 
 
+def persistent_cache_files():
+    """Файлы кэшей и истории сессий в директории индекса, которые не удаляются при обновлении индекса"""
+    files = []
+    for path in (EMBEDDING_CACHE_DB, SESSION_DB_PATH):
+        if path and os.path.dirname(os.path.abspath(path)) == os.path.abspath(INDEX_PATH):
+            name = os.path.basename(path)
+            # Базы SQLite открыты процессом: рядом лежат журнал WAL (-wal), общая память (-shm) или -journal
+            files += [name, f"{name}-wal", f"{name}-shm", f"{name}-journal"]
+    return files
+
+
 # Копирование индекса из локальной директории проекта на Render
 def copy_index_to_render_storage(clear_first=True):
     """Копирует индекс из локального проекта в persistent storage на Render"""
@@ -115,7 +296,7 @@ def copy_index_to_render_storage(clear_first=True):
 
         # Очищаем директорию перед копированием, если запрошено
         if clear_first:
-            clear_render_storage(except_files=["error.log"])
+            clear_render_storage(except_files=["error.log"] + persistent_cache_files())
 
         # Создаем файл блокировки для предотвращения конфликтов
         lock_file = os.path.join(INDEX_PATH, "index_building.lock")
@@ -128,7 +309,11 @@ def copy_index_to_render_storage(clear_first=True):
             destination = os.path.join(INDEX_PATH, item)
 
             if os.path.isfile(source):
-                shutil.copy2(source, destination)
+                # Через временный файл и rename: загруженный индекс может читать старый файл через mmap,
+                # перезапись на месте обрезала бы отображенные страницы
+                temporary = destination + ".tmp"
+                shutil.copy2(source, temporary)
+                os.replace(temporary, destination)
                 print(f"Скопирован файл: {item}")
             elif os.path.isdir(source):
                 if os.path.exists(destination):
@@ -157,6 +342,382 @@ def copy_index_to_render_storage(clear_first=True):
         return False
 
 
+def update_index_from_local():
+    """Копирует локальный индекс в persistent storage и один раз подменяет загруженный в память.
+
+    Копирование работает только с файлами; загрузка новой версии выполняется здесь, а не внутри
+    copy_index_to_render_storage(), которую load_vectorstore() вызывает при первой загрузке.
+    """
+    if not copy_index_to_render_storage(clear_first=True):
+        return False
+    if vectorstore_holder.is_loaded:
+        try:
+            vectorstore_holder.reload()
+        except Exception as e:
+            print(f"Не удалось загрузить новый индекс, продолжаем работу на прежнем: {e}")
+    return True
+
+
+# Общие клиенты OpenAI с пулом соединений, повторами и circuit breaker
+class CircuitOpenError(RuntimeError):
+    """Вызов отклонен: circuit breaker разомкнут из-за серии ошибок upstream"""
+
+
+class CircuitBreaker:
+    """Простой circuit breaker: после серии ошибок временно отклоняет вызовы без обращения к upstream.
+
+    Состояния: closed (вызовы идут), open (вызовы отклоняются до истечения reset_timeout),
+    half_open (пропускается один пробный вызов, его результат решает, закрыть или снова открыть цепь).
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == "open":
+                if time.time() - self.opened_at < self.reset_timeout:
+                    raise CircuitOpenError(f"Circuit breaker {self.name} разомкнут")
+                self.state = "half_open"
+                self._probe_in_flight = False
+            if self.state == "half_open":
+                if self._probe_in_flight:
+                    raise CircuitOpenError(f"Circuit breaker {self.name}: выполняется пробный вызов")
+                self._probe_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    print(f"Circuit breaker {self.name} разомкнут после {self.failures} ошибок подряд")
+                self.state = "open"
+                self.opened_at = time.time()
+
+    def release_probe(self):
+        """Снимает отметку пробного вызова, если он завершился без результата (отмена, ошибка клиента)"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def status(self):
+        return {"state": self.state, "failures": self.failures}
+
+
+# Ошибки OpenAI, при которых имеет смысл повторить запрос (429, 5xx, сеть, таймаут)
+OPENAI_RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+openai_breaker = CircuitBreaker(
+    "openai",
+    failure_threshold=OPENAI_BREAKER_THRESHOLD,
+    reset_timeout=OPENAI_BREAKER_RESET_TIMEOUT,
+)
+
+_openai_clients = {}
+_openai_clients_lock = threading.Lock()
+
+
+class QueryEmbeddings(Embeddings):
+    """Эмбеддинги поисковых запросов одним вызовом API через общий клиент OpenAI.
+
+    Запросы короткие, поэтому разбиение текста на куски по токенам tiktoken, которое
+    OpenAIEmbeddings делает для длинных документов, не нужно: текст уходит как есть.
+    Словарь tiktoken не загружается, что позволяет работать и с локальным сервером (OPENAI_BASE_URL).
+    """
+
+    def __init__(self, client, async_client, model=EMBEDDING_MODEL):
+        self.client = client
+        self.async_client = async_client
+        self.model = model
+
+    @staticmethod
+    def _vectors(response):
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    def embed_documents(self, texts):
+        return self._vectors(self.client.create(model=self.model, input=list(texts)))
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts):
+        return self._vectors(await self.async_client.create(model=self.model, input=list(texts)))
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
+
+
+def _create_openai_clients():
+    """Создает клиентов OpenAI и LangChain поверх общих keep-alive пулов httpx"""
+    limits = httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+        keepalive_expiry=60,
+    )
+    timeout = httpx.Timeout(OPENAI_TIMEOUT, connect=10)
+    http_client = httpx.Client(limits=limits, timeout=timeout)
+    http_async_client = httpx.AsyncClient(limits=limits, timeout=timeout)
+
+    # Повторы выполняем сами через tenacity, встроенные повторы SDK отключены
+    sync_client = openai.OpenAI(http_client=http_client, max_retries=0, timeout=OPENAI_TIMEOUT,
+                                base_url=OPENAI_BASE_URL)
+    async_client = openai.AsyncOpenAI(http_client=http_async_client, max_retries=0, timeout=OPENAI_TIMEOUT,
+                                      base_url=OPENAI_BASE_URL)
+
+    return {
+        "http": http_client,
+        "http_async": http_async_client,
+        "sync": sync_client,
+        "async": async_client,
+        "embeddings": QueryEmbeddings(sync_client.embeddings, async_client.embeddings),
+        "llm": ChatOpenAI(
+            model_name=LLM_MODEL,
+            temperature=0.2,
+            client=sync_client.chat.completions,
+            async_client=async_client.chat.completions,
+            max_retries=0,
+        ),
+    }
+
+
+def get_openai_clients():
+    """Возвращает общие для процесса клиенты, создавая их при первом обращении"""
+    clients = _openai_clients.get("default")
+    if clients is None:
+        with _openai_clients_lock:
+            clients = _openai_clients.get("default")
+            if clients is None:
+                clients = _create_openai_clients()
+                _openai_clients["default"] = clients
+    return clients
+
+
+def get_embeddings():
+    return get_openai_clients()["embeddings"]
+
+
+def get_llm():
+    return get_openai_clients()["llm"]
+
+
+async def close_openai_clients():
+    clients = _openai_clients.pop("default", None)
+    if clients is not None:
+        clients["http"].close()
+        await clients["http_async"].aclose()
+
+
+async def call_openai(func, *args, **kwargs):
+    """Вызывает OpenAI через circuit breaker с экспоненциальными повторами при 429/5xx"""
+    openai_breaker.before_call()
+    try:
+        async for attempt in AsyncRetrying(
+            stop=stop_after_attempt(OPENAI_MAX_ATTEMPTS) | stop_after_delay(OPENAI_RETRY_MAX_DELAY),
+            wait=wait_random_exponential(multiplier=0.5, max=8),
+            retry=retry_if_exception_type(OPENAI_RETRYABLE_ERRORS),
+            reraise=True,
+        ):
+            with attempt:
+                result = await func(*args, **kwargs)
+    except OPENAI_RETRYABLE_ERRORS:
+        openai_breaker.record_failure()
+        raise
+    finally:
+        # Прочие ошибки (например, 400) и отмена запроса не говорят о недоступности upstream
+        openai_breaker.release_probe()
+    openai_breaker.record_success()
+    return result
+
+
+# Контроль нагрузки: ограничение одновременных запросов и короткая очередь
+class AdmissionRejected(Exception):
+    """Запрос не принят: очередь заполнена, ожидание истекло или превышен лимит сессии"""
+
+    def __init__(self, status_code, retry_after, reason):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionTicket:
+    """Занятое место обработки; release() можно вызывать несколько раз"""
+
+    def __init__(self, controller, key):
+        self.controller = controller
+        self.key = key
+        self.started_at = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release(self)
+
+
+class AdmissionController:
+    """Не больше max_in_flight запросов одновременно, остальные ждут в очереди до max_wait секунд.
+
+    Очередь разбита по сессиям и обслуживается по кругу: освободившееся место получает следующая
+    сессия, а не следующий запрос, поэтому частые вопросы одной сессии не вытесняют остальных.
+    Сессия может держать не больше session_limit запросов (в работе и в очереди), лишние получают 429.
+    При заполненной очереди или истечении ожидания - 503. В обоих случаях возвращается Retry-After.
+    """
+
+    def __init__(self, max_in_flight=ASK_MAX_IN_FLIGHT, max_queue=ASK_MAX_QUEUE, max_wait=ASK_QUEUE_TIMEOUT,
+                 session_limit=ASK_SESSION_LIMIT):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.session_limit = session_limit
+        self.in_flight = 0
+        self._waiters = OrderedDict()  # ключ сессии -> deque ожидающих future, в порядке обслуживания
+        self._queued = 0
+        self._per_session = {}  # ключ сессии -> запросов в работе и в очереди
+        self._anonymous = 0
+        self._service_seconds = 5.0  # сглаженное время обработки запроса, для Retry-After
+        self.admitted = 0
+        self.rejected = {"session_limit": 0, "queue_full": 0, "timeout": 0}
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _key(self, session_id):
+        if session_id:
+            return session_id
+        # Новые пользователи без cookie не объединяются в одну "сессию"
+        self._anonymous += 1
+        return f"anonymous-{self._anonymous}"
+
+    def retry_after(self):
+        """Оценка секунд до освобождения места: очередь впереди, деленная на пропускную способность"""
+        waves = (self._queued + 1) / max(self.max_in_flight, 1)
+        return max(1, math.ceil(waves * self._service_seconds))
+
+    def _reject(self, status_code, reason):
+        self.rejected[reason] += 1
+        raise AdmissionRejected(status_code, self.retry_after(), reason)
+
+    async def acquire(self, session_id=None):
+        """Ждет свободного места; возвращает AdmissionTicket или бросает AdmissionRejected"""
+        key = self._key(session_id)
+        if self._per_session.get(key, 0) >= self.session_limit:
+            self._reject(429, "session_limit")
+
+        if self.in_flight < self.max_in_flight and not self._queued:
+            self.in_flight += 1
+            self._per_session[key] = self._per_session.get(key, 0) + 1
+            return self._admitted(key, 0.0)
+        if self._queued >= self.max_queue:
+            self._reject(503, "queue_full")
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(key, []).append(future)
+        self._queued += 1
+        self._per_session[key] = self._per_session.get(key, 0) + 1
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done():
+                # Место передано одновременно с таймаутом или отменой - отдаем его дальше
+                self._finish(key)
+            else:
+                self._dequeue(key, future)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self._reject(503, "timeout")
+        return self._admitted(key, time.monotonic() - started)
+
+    def _admitted(self, key, waited):
+        ADMISSION_WAIT_SECONDS.observe(waited)
+        trace_stage("queue", waited)
+        self.admitted += 1
+        self.wait_seconds_total += waited
+        self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        return AdmissionTicket(self, key)
+
+    def _forget(self, key):
+        self._per_session[key] -= 1
+        if not self._per_session[key]:
+            del self._per_session[key]
+
+    def _dequeue(self, key, future):
+        """Убирает из очереди запрос, который не дождался места"""
+        waiters = self._waiters[key]
+        waiters.remove(future)
+        if not waiters:
+            del self._waiters[key]
+        self._queued -= 1
+        self._forget(key)
+
+    def _finish(self, key):
+        """Освобождает место и передает его следующей по кругу сессии из очереди"""
+        self._forget(key)
+        if not self._waiters:
+            self.in_flight -= 1
+            return
+        next_key, waiters = next(iter(self._waiters.items()))
+        future = waiters.pop(0)
+        if waiters:
+            self._waiters.move_to_end(next_key)
+        else:
+            del self._waiters[next_key]
+        self._queued -= 1
+        future.set_result(None)  # место переходит ожидающему, in_flight не меняется
+
+    def _release(self, ticket):
+        duration = time.monotonic() - ticket.started_at
+        self._service_seconds = 0.8 * self._service_seconds + 0.2 * duration
+        self._finish(ticket.key)
+
+    def stats(self):
+        admitted = max(self.admitted, 1)
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queued": self._queued,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "avg_wait_ms": round(self.wait_seconds_total / admitted * 1000, 1),
+            "max_wait_ms": round(self.wait_seconds_max * 1000, 1),
+            "avg_service_s": round(self._service_seconds, 2),
+        }
+
+
+ask_admission = AdmissionController()
+
+
+def admission_rejected_answer(e):
+    """Быстрый ответ 429/503 с Retry-After вместо ожидания в общей очереди"""
+    if e.status_code == 429:
+        message = "Пожалуйста, дождитесь ответа на предыдущий вопрос."
+    else:
+        message = "Сервер сейчас перегружен. Пожалуйста, повторите вопрос через несколько секунд."
+    print(f"Запрос отклонен контролем нагрузки: {e.reason}, Retry-After {e.retry_after} с")
+    response = error_answer(message, e.status_code)
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+
 # Загружаем векторное хранилище
 def load_vectorstore():
     print("Загрузка векторного хранилища...")
@@ -174,10 +735,26 @@ def load_vectorstore():
         else:
             raise RuntimeError("Индекс не найден ни в persistent storage, ни в локальной директории.")
 
+    chunk_store_path = os.path.join(INDEX_PATH, CHUNK_STORE_FILE)
+    if not os.path.exists(chunk_store_path):
+        # Индекс старого формата (docstore LangChain в index.pkl): pickle не загружается
+        raise RuntimeError(f"{CHUNK_STORE_FILE} не найден в {INDEX_PATH}: индекс старого формата. "
+                           "Пересоберите индекс скриптом build_index_local.py")
+
     try:
         print("Попытка загрузки индекса из:", INDEX_PATH)
-        vectorstore = FAISS.load_local(INDEX_PATH, OpenAIEmbeddings())
-        print("Векторное хранилище успешно загружено")
+        # index.faiss при возможности читается через mmap
+        index = read_faiss_index(index_file, mmap=FAISS_MMAP)
+
+        # Текст чанков читается из SQLite по позиции только для найденных чанков
+        docstore = ChunkStore(chunk_store_path, cache_size=CHUNK_CACHE_SIZE)
+        if docstore.count != index.ntotal:
+            raise RuntimeError(f"{CHUNK_STORE_FILE} не соответствует FAISS ({docstore.count} != {index.ntotal})")
+        index_to_docstore_id = PositionIds(index.ntotal)
+        print(f"Хранилище чанков: {docstore.count} чанков, {docstore.stats()['sources']} источников")
+        vectorstore = FAISS(get_embeddings(), index, docstore, index_to_docstore_id)
+        mapped = FAISS_MMAP and is_mmap_compatible(index)
+        print(f"Векторное хранилище успешно загружено ({'mmap' if mapped else 'в память процесса'})")
         return vectorstore
     except Exception as e:
         print("Ошибка при загрузке индекса:", e)
@@ -185,20 +762,650 @@ def load_vectorstore():
         raise RuntimeError(f"Индекс найден, но не удалось загрузить: {str(e)}")
 
 
+def read_index_metadata(index_dir=None):
+    """Читает index_metadata.json из директории индекса; при отсутствии возвращает пустой словарь"""
+    metadata_path = os.path.join(index_dir or INDEX_PATH, "index_metadata.json")
+    if not os.path.exists(metadata_path):
+        return {}
+    try:
+        with open(metadata_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Ошибка чтения метаданных индекса: {e}")
+        return {}
+
+
+def read_index_version():
+    """Вычисляет версию индекса в persistent storage по метаданным и файлу index.faiss"""
+    index_file = os.path.join(INDEX_PATH, "index.faiss")
+    created_at = read_index_metadata().get("created_at", "")
+
+    stat = os.stat(index_file)
+    raw = f"{created_at}|{stat.st_size}|{stat.st_mtime_ns}"
+    return hashlib.sha256(raw.encode()).hexdigest()[:12]
+
+
+def load_lexical_index(vectorstore):
+    """Загружает лексический индекс BM25, если он собран вместе с FAISS индексом"""
+    path = os.path.join(INDEX_PATH, LEXICAL_INDEX_FILE)
+    if not os.path.exists(path):
+        print("Лексический индекс не найден, используется только векторный поиск")
+        return None
+    try:
+        lexical = LexicalIndex.load(path)
+    except Exception as e:
+        print(f"Ошибка загрузки лексического индекса: {e}")
+        return None
+    if lexical.doc_count != vectorstore.index.ntotal:
+        print(f"Лексический индекс не соответствует FAISS ({lexical.doc_count} != {vectorstore.index.ntotal}), "
+              f"используется только векторный поиск")
+        return None
+    print(f"Лексический индекс загружен: {len(lexical.vocab)} терминов, {lexical.doc_count} чанков")
+    return lexical
+
+
+def load_reference_map(vectorstore):
+    """Загружает карту ссылок на стандарты и нормы, если она собрана вместе с индексом"""
+    path = os.path.join(INDEX_PATH, REFERENCE_MAP_FILE)
+    if not os.path.exists(path):
+        print("Карта ссылок на стандарты не найдена, поиск по ссылкам отключен")
+        return None
+    try:
+        reference_map = ReferenceMap.load(path)
+    except Exception as e:
+        print(f"Ошибка загрузки карты ссылок: {e}")
+        return None
+    last_position = max((end for ranges in reference_map.ranges.values() for _, end in ranges), default=0)
+    if last_position > vectorstore.index.ntotal:
+        print("Карта ссылок не соответствует FAISS индексу, поиск по ссылкам отключен")
+        return None
+    print(f"Карта ссылок загружена: {len(reference_map.ranges)} идентификаторов")
+    return reference_map
+
+
+def load_full_vectors(vectorstore):
+    """Открывает полные векторы для двухэтапного поиска (mmap, в память не читаются)"""
+    path = os.path.join(INDEX_PATH, FULL_VECTORS_FILE)
+    if not os.path.exists(path):
+        return None
+    try:
+        full_vectors = np.load(path, mmap_mode="r")
+    except Exception as e:
+        print(f"Ошибка открытия полных векторов: {e}")
+        return None
+    if full_vectors.shape[0] != vectorstore.index.ntotal or full_vectors.shape[1] < vectorstore.index.d:
+        print(f"Полные векторы не соответствуют FAISS индексу {full_vectors.shape}, переранжирование отключено")
+        return None
+    print(f"Двухэтапный поиск: индекс {vectorstore.index.d} измерений, переранжирование по {full_vectors.shape[1]}")
+    return full_vectors
+
+
+class LoadedIndex:
+    """Загруженная версия индекса: векторное хранилище и связанные с ним структуры"""
+
+    def __init__(self, vectorstore, version, lexical=None, reference_map=None, metadata=None, full_vectors=None):
+        self.vectorstore = vectorstore
+        self.version = version
+        self.lexical = lexical
+        self.reference_map = reference_map
+        self.metadata = metadata or {}
+        self.full_vectors = full_vectors
+
+    def search_vector(self, query_embedding):
+        """Приводит эмбеддинг запроса к размерности FAISS индекса"""
+        return reduce_dimensions(query_embedding, self.vectorstore.index.d)
+
+    def documents(self, positions):
+        """Возвращает чанки по позициям векторов в FAISS, сохраняя порядок"""
+        docstore = self.vectorstore.docstore
+        if isinstance(docstore, ChunkStore):
+            return docstore.get_many(positions)
+        return [docstore.search(self.vectorstore.index_to_docstore_id[position]) for position in positions]
+
+
+class VectorstoreHolder:
+    """Хранит загруженный индекс в памяти процесса и атомарно подменяет его при обновлении.
+
+    Запросы берут ссылку на текущий экземпляр через get() или snapshot() и дорабатывают на нем,
+    даже если в это время reload() опубликовал новую версию индекса.
+    """
+
+    def __init__(self):
+        self._current = None  # LoadedIndex - подменяется одним присваиванием
+        self._loaded_at = None
+        self._load_seconds = None
+        self._lock = threading.RLock()
+
+    @property
+    def is_loaded(self):
+        return self._current is not None
+
+    @property
+    def version(self):
+        current = self._current
+        return current.version if current is not None else None
+
+    @property
+    def current(self):
+        """Текущий LoadedIndex без загрузки; None, пока индекс не загружен"""
+        return self._current
+
+    @property
+    def load_seconds(self):
+        """Длительность последней загрузки индекса, сек"""
+        return self._load_seconds
+
+    def snapshot(self):
+        """Возвращает текущий LoadedIndex, загружая индекс при первом обращении"""
+        current = self._current
+        if current is not None:
+            return current
+
+        with self._lock:
+            if self._current is None:
+                self._load_locked()
+            return self._current
+
+    def get(self):
+        """Возвращает текущее векторное хранилище, загружая его при первом обращении"""
+        return self.snapshot().vectorstore
+
+    def reload(self):
+        """Загружает индекс заново и подменяет текущий экземпляр"""
+        with self._lock:
+            self._load_locked()
+        return self._current.vectorstore
+
+    def _load_locked(self):
+        start = time.time()
+        vectorstore = load_vectorstore()
+        metadata = read_index_metadata()
+
+        # Параметры поиска приближенного индекса (nprobe / efSearch) из метаданных или окружения
+        configure_search(vectorstore.index, metadata.get("index_params", {}),
+                         nprobe=FAISS_NPROBE, ef_search=FAISS_EF_SEARCH)
+        print(f"Тип FAISS индекса: {describe_faiss_index(vectorstore.index)}")
+
+        loaded = LoadedIndex(
+            vectorstore,
+            read_index_version(),
+            lexical=load_lexical_index(vectorstore),
+            reference_map=load_reference_map(vectorstore),
+            metadata=metadata,
+            full_vectors=load_full_vectors(vectorstore),
+        )
+        # Одно присваивание ссылки - запросы видят либо старый, либо новый индекс целиком
+        self._current = loaded
+        self._loaded_at = datetime.now().isoformat()
+        self._load_seconds = round(time.time() - start, 3)
+        print(f"Индекс версии {loaded.version} загружен в память за {self._load_seconds} сек")
+
+    def info(self):
+        current = self._current
+        return {
+            "loaded": current is not None,
+            "version": self.version,
+            "loaded_at": self._loaded_at,
+            "load_seconds": self._load_seconds,
+            "lexical_index": current is not None and current.lexical is not None,
+            "reference_map": current is not None and current.reference_map is not None,
+            "faiss": describe_faiss_index(current.vectorstore.index) if current is not None else None,
+            "rescoring": current is not None and current.full_vectors is not None,
+            "chunk_store": (current.vectorstore.docstore.stats()
+                            if current is not None and isinstance(current.vectorstore.docstore, ChunkStore) else None),
+        }
+
+
+vectorstore_holder = VectorstoreHolder()
+
+
+def normalize_query_text(text):
+    """Нормализует текст запроса для ключей кэшей: регистр и пробелы не влияют на ключ"""
+    return " ".join(text.lower().split())
+
+
+class EmbeddingCache:
+    """Кэш эмбеддингов запросов: LRU в памяти и необязательный уровень SQLite на диске.
+
+    Ключ - хэш от модели эмбеддингов и нормализованного текста запроса.
+    """
+
+    def __init__(self, max_size=EMBEDDING_CACHE_SIZE, db_path=EMBEDDING_CACHE_DB):
+        self.max_size = max_size
+        self.db_path = db_path
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model, text):
+        return hashlib.sha256(f"{model}\n{normalize_query_text(text)}".encode()).hexdigest()
+
+    def _get_db(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            self._db.commit()
+        return self._db
+
+    def _disk_get(self, key):
+        try:
+            with self._db_lock:
+                row = self._get_db().execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+        except Exception as e:
+            print(f"Ошибка чтения кэша эмбеддингов с диска: {e}")
+            return None
+        if row is None:
+            return None
+        return np.frombuffer(row[0], dtype=np.float32).tolist()
+
+    def _disk_put(self, key, vector):
+        try:
+            blob = np.asarray(vector, dtype=np.float32).tobytes()
+            with self._db_lock:
+                db = self._get_db()
+                db.execute("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", (key, blob))
+                db.commit()
+        except Exception as e:
+            print(f"Ошибка записи кэша эмбеддингов на диск: {e}")
+
+    def _memory_get(self, key):
+        with self._lock:
+            vector = self._items.get(key)
+            if vector is not None:
+                self._items.move_to_end(key)
+            return vector
+
+    def _memory_put(self, key, vector):
+        with self._lock:
+            self._items[key] = vector
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    async def aembed_query(self, text, model=EMBEDDING_MODEL):
+        """Возвращает эмбеддинг запроса из кэша или запрашивает его у OpenAI"""
+        key = self.make_key(model, text)
+
+        vector = self._memory_get(key)
+        if vector is not None:
+            self.memory_hits += 1
+            return vector
+
+        if self.db_path:
+            vector = await asyncio.to_thread(self._disk_get, key)
+            if vector is not None:
+                self.disk_hits += 1
+                self._memory_put(key, vector)
+                return vector
+
+        self.misses += 1
+        vector = await call_openai(get_embeddings().aembed_query, text)
+        self._memory_put(key, vector)
+        if self.db_path:
+            await asyncio.to_thread(self._disk_put, key, vector)
+        return vector
+
+    async def aembed_many(self, texts, model=EMBEDDING_MODEL):
+        """Эмбеддинги нескольких запросов: все промахи кэша запрашиваются одним вызовом API"""
+        keys = [self.make_key(model, text) for text in texts]
+        vectors = {}
+        for key in keys:
+            vector = self._memory_get(key)
+            if vector is not None:
+                self.memory_hits += 1
+                vectors[key] = vector
+
+        missing = [key for key in dict.fromkeys(keys) if key not in vectors]
+        if missing and self.db_path:
+            for key in missing:
+                vector = await asyncio.to_thread(self._disk_get, key)
+                if vector is not None:
+                    self.disk_hits += 1
+                    self._memory_put(key, vector)
+                    vectors[key] = vector
+            missing = [key for key in missing if key not in vectors]
+
+        if missing:
+            self.misses += len(missing)
+            texts_by_key = dict(zip(keys, texts))
+            embedded = await call_openai(get_embeddings().aembed_documents, [texts_by_key[key] for key in missing])
+            for key, vector in zip(missing, embedded):
+                self._memory_put(key, vector)
+                vectors[key] = vector
+                if self.db_path:
+                    await asyncio.to_thread(self._disk_put, key, vector)
+
+        return [vectors[key] for key in keys]
+
+    def close(self):
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def stats(self):
+        return {
+            "size": len(self._items),
+            "max_size": self.max_size,
+            "disk": bool(self.db_path),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+        }
+
+
+embedding_cache = EmbeddingCache()
+
+
+def question_references(text):
+    """Идентификаторы в вопросе: ссылки на стандарты и нормы и все числа (номера статей, пунктов)"""
+    keys = {key for variants in references_from_query(text) for key in variants}
+    keys.update(str(int(number)) for number in re.findall(r"\d+", text))
+    return frozenset(keys)
+
+
+class AnswerCache:
+    """Семантический кэш ответов на вопросы без истории диалога.
+
+    Вопрос совпадает с сохраненным, если косинусная близость их эмбеддингов не ниже threshold
+    и в них одни и те же идентификаторы: "МСФО 16" и "МСФО 17" почти не различаются эмбеддингом.
+    Кэш очищается при смене версии индекса.
+    """
+
+    def __init__(self, max_size=ANSWER_CACHE_SIZE, threshold=ANSWER_CACHE_THRESHOLD):
+        self.max_size = max_size
+        self.threshold = threshold
+        self._entries = OrderedDict()  # нормализованный вопрос -> запись
+        self._matrix = None  # нормированные эмбеддинги в порядке self._keys
+        self._keys = []
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _unit(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _reset_if_stale(self, index_version):
+        if index_version != self._version:
+            if self._entries:
+                print(f"Версия индекса изменилась ({self._version} -> {index_version}), кэш ответов очищен")
+            self._entries.clear()
+            self._matrix = None
+            self._keys = []
+            self._version = index_version
+
+    def _rebuild_matrix(self):
+        self._keys = list(self._entries.keys())
+        if self._keys:
+            self._matrix = np.vstack([self._entries[key]["vector"] for key in self._keys])
+        else:
+            self._matrix = None
+
+    def lookup(self, question, vector, index_version):
+        with self._lock:
+            self._reset_if_stale(index_version)
+            key = normalize_query_text(question)
+
+            entry = self._entries.get(key)
+            if entry is None and self._matrix is not None:
+                scores = self._matrix @ self._unit(vector)
+                references = question_references(question)
+                # Самый близкий вопрос выше порога с теми же номерами стандартов, статей и норм
+                for position in np.argsort(-scores):
+                    if scores[position] < self.threshold:
+                        break
+                    candidate = self._entries[self._keys[position]]
+                    if candidate["references"] == references:
+                        key = self._keys[position]
+                        entry = candidate
+                        break
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, question, vector, answer, sources, index_version):
+        with self._lock:
+            # Ответ, подготовленный на старой версии индекса, не сохраняем
+            if index_version != vectorstore_holder.version:
+                return
+            self._reset_if_stale(index_version)
+            self._entries[normalize_query_text(question)] = {
+                "vector": self._unit(vector),
+                "references": question_references(question),
+                "answer": answer,
+                "sources": sources,
+                "created_at": time.time(),
+            }
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._rebuild_matrix()
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "threshold": self.threshold,
+            "index_version": self._version,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+answer_cache = AnswerCache()
+
+
+class SingleFlight:
+    """Объединяет одновременные одинаковые вызовы: первый выполняет работу, остальные ждут его результат.
+
+    Работа идет в отдельной задаче, поэтому отмена одного из ожидающих (клиент закрыл соединение)
+    не прерывает ее для остальных.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def __contains__(self, key):
+        return key in self._calls
+
+    async def run(self, key, func, *args):
+        task = self._calls.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(func(*args))
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.followers += 1
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {"in_flight": len(self._calls), "leaders": self.leaders, "followers": self.followers}
+
+
+answer_flights = SingleFlight()
+
+
+def answer_flight_key(q, chat_history, index_version):
+    """Ключ объединения вопросов: нормализованный вопрос, история диалога и версия индекса"""
+    digest = hashlib.sha256()
+    digest.update(normalize_query_text(q).encode())
+    for prev_q, prev_a in chat_history:
+        digest.update(b"\0" + prev_q.encode() + b"\0" + prev_a.encode())
+    digest.update(b"\0" + str(index_version).encode())
+    return digest.hexdigest()
+
+
+async def run_in_search_executor(func, *args, **kwargs):
+    """Выполняет блокирующую функцию в ограниченном пуле потоков поиска"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(search_executor, lambda: func(*args, **kwargs))
+
+
+class OpenAIHealthMonitor:
+    """Периодически проверяет ключ и доступность OpenAI в фоне и кэширует результат.
+
+    /ask читает закэшированное состояние вместо тестового эмбеддинга на каждый запрос.
+    """
+
+    def __init__(self, interval=OPENAI_HEALTH_INTERVAL, retry_interval=OPENAI_HEALTH_RETRY_INTERVAL):
+        self.interval = interval
+        self.retry_interval = retry_interval
+        self.healthy = None  # None - проверка еще не выполнялась
+        self.checked_at = None
+        self.latency_ms = None
+        self.error = None
+        self._task = None
+
+    def check(self):
+        """Выполняет одну проверку: запрос метаданных модели эмбеддингов (бесплатный вызов API)"""
+        start = time.time()
+        try:
+            if not os.getenv("OPENAI_API_KEY"):
+                raise RuntimeError("Ключ API OpenAI не найден в переменных окружения")
+            get_openai_clients()["sync"].with_options(timeout=10).models.retrieve(EMBEDDING_MODEL)
+            self.healthy = True
+            self.error = None
+        except Exception as e:
+            self.healthy = False
+            self.error = str(e)
+            print(f"Проверка OpenAI не пройдена: {e}")
+        self.checked_at = time.time()
+        self.latency_ms = round((self.checked_at - start) * 1000, 1)
+        return self.healthy
+
+    def is_stale(self):
+        """Результат устарел, если фоновая проверка давно не выполнялась"""
+        return self.checked_at is None or time.time() - self.checked_at > self.interval * 3
+
+    def is_unavailable(self):
+        """True только если свежая проверка явно показала недоступность OpenAI"""
+        return self.healthy is False and not self.is_stale()
+
+    async def run(self):
+        while True:
+            await asyncio.to_thread(self.check)
+            await asyncio.sleep(self.interval if self.healthy else self.retry_interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def status(self):
+        return {
+            "healthy": self.healthy,
+            "checked_at": datetime.fromtimestamp(self.checked_at).isoformat() if self.checked_at else None,
+            "latency_ms": self.latency_ms,
+            "stale": self.is_stale(),
+            "error": self.error,
+        }
+
+
+openai_health = OpenAIHealthMonitor()
+
+
+class IndexVersionWatcher:
+    """Сверяет загруженный в процесс индекс с версией в persistent storage и загружает новую.
+
+    /update-index подменяет индекс только в воркере, который обработал запрос; остальные воркеры
+    (и воркеры, заново созданные из мастер-процесса gunicorn со старым индексом) видят новую
+    версию по read_index_version() и загружают ее сами. Пока идет копирование, проверка пропускается.
+    """
+
+    def __init__(self, interval=INDEX_CHECK_INTERVAL):
+        self.interval = interval
+        self.checked_at = None
+        self.reloads = 0
+        self.failed_version = None  # версия, которую не удалось загрузить; повторно не загружается
+        self._task = None
+
+    def check(self):
+        """Одна проверка; возвращает True, если индекс был загружен заново"""
+        self.checked_at = time.time()
+        if not vectorstore_holder.is_loaded:
+            return False
+        if os.path.exists(os.path.join(INDEX_PATH, "index_building.lock")):
+            return False
+        try:
+            disk_version = read_index_version()
+        except OSError:
+            return False  # index.faiss удален на время копирования
+        if disk_version in (vectorstore_holder.version, self.failed_version):
+            return False
+
+        print(f"Индекс на диске обновлен ({vectorstore_holder.version} -> {disk_version}), "
+              f"загрузка в процессе {os.getpid()}")
+        try:
+            vectorstore_holder.reload()
+        except Exception as e:
+            self.failed_version = disk_version
+            print(f"Не удалось загрузить новый индекс, продолжаем работу на прежнем: {e}")
+            return False
+        self.failed_version = None
+        self.reloads += 1
+        return True
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await asyncio.to_thread(self.check)
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def status(self):
+        return {
+            "interval": self.interval,
+            "checked_at": datetime.fromtimestamp(self.checked_at).isoformat() if self.checked_at else None,
+            "reloads": self.reloads,
+            "failed_version": self.failed_version,
+        }
+
+
+index_watcher = IndexVersionWatcher()
+
+
 # Очистка старых сессий
 def clean_old_sessions():
-    """Очищает старые сессии для экономии памяти"""
-    current_time = time.time()
-    expired_sessions = [
-        session_id for session_id, last_active in session_last_activity.items()
-        if current_time - last_active > SESSION_MAX_AGE
-    ]
-
-    for session_id in expired_sessions:
-        if session_id in session_memories:
-            del session_memories[session_id]
-        if session_id in session_last_activity:
-            del session_last_activity[session_id]
+    """Очищает старые сессии для экономии памяти (только устаревшие, с начала очереди активности)"""
+    session_store.expire()
 
 
 # Вспомогательная функция для проверки доступности директории
@@ -246,23 +1453,8 @@ def check_directory_access(directory):
 
 
 # События приложения
-@app.on_event("startup")
-async def startup_event():
-    print("Запуск приложения...")
-    print(f"Текущая рабочая директория: {os.getcwd()}")
-
-    # Проверяем параметры системы
-    print(f"Платформа: {sys.platform}")
-    print(f"Версия Python: {sys.version}")
-    print("Переменные окружения:")
-    for env_var in ['RENDER', 'PATH', 'HOME']:
-        print(f"  {env_var}={os.environ.get(env_var, 'Не задано')}")
-
-    # Проверка доступности директорий
-    print("\nПроверка директорий:")
-    check_directory_access(INDEX_PATH)
-    check_directory_access(LOCAL_INDEX_PATH)
-
+def sync_index_storage():
+    """Копирует локальный индекс в persistent storage, если там его нет или он устарел"""
     # Проверяем наличие индекса в persistent storage
     index_in_persistent = os.path.exists(os.path.join(INDEX_PATH, "index.faiss"))
     print(f"\nИндекс в persistent storage: {'Найден' if index_in_persistent else 'Не найден'}")
@@ -296,9 +1488,69 @@ async def startup_event():
         print("ВНИМАНИЕ: Индекс не найден ни в persistent storage, ни локально!")
         print("Приложение может работать некорректно без индекса.")
 
+
+@app.on_event("startup")
+async def startup_event():
+    print("Запуск приложения...")
+    print(f"Текущая рабочая директория: {os.getcwd()}")
+
+    # Проверяем параметры системы
+    print(f"Платформа: {sys.platform}")
+    print(f"Версия Python: {sys.version}")
+    print("Переменные окружения:")
+    for env_var in ['RENDER', 'PATH', 'HOME']:
+        print(f"  {env_var}={os.environ.get(env_var, 'Не задано')}")
+
+    # Проверка доступности директорий
+    print("\nПроверка директорий:")
+    check_directory_access(INDEX_PATH)
+    check_directory_access(LOCAL_INDEX_PATH)
+
+    sync_index_storage()
+
+    # Загружаем индекс в память один раз на процесс
+    if os.path.exists(os.path.join(INDEX_PATH, "index.faiss")):
+        try:
+            await asyncio.to_thread(vectorstore_holder.get)
+            # Воркер, созданный из мастер-процесса после обновления индекса, унаследовал старую версию
+            await asyncio.to_thread(index_watcher.check)
+        except Exception as e:
+            print(f"Не удалось загрузить индекс при запуске: {e}")
+            print("Индекс будет загружен при первом запросе.")
+
+    # Запускаем фоновую проверку OpenAI и версии индекса на диске
+    openai_health.start()
+    index_watcher.start()
+
     print("Приложение запущено и готово к работе!")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await openai_health.stop()
+    await index_watcher.stop()
+    search_executor.shutdown(wait=False)
+    await close_openai_clients()
+    embedding_cache.close()
+    session_store.close()
+
+
+def preload_index():
+    """Загружает индекс до fork воркеров, чтобы его страницы были общими (copy-on-write)"""
+    print(f"Предварительная загрузка индекса в процессе {os.getpid()} до запуска воркеров...")
+    try:
+        sync_index_storage()
+        if os.path.exists(os.path.join(INDEX_PATH, "index.faiss")):
+            vectorstore_holder.get()
+    except Exception as e:
+        print(f"Предварительная загрузка индекса не удалась: {e}")
+        print("Каждый воркер загрузит индекс при запуске.")
+
+
+if PRELOAD_INDEX:
+    preload_index()
+
+
 # Эндпоинты
 @app.get("/ping")
 def ping():
@@ -308,10 +1560,120 @@ def ping():
     return {
         "status": "ok",
         "message": "Сервер работает",
-        "index_status": "Индекс найден" if index_exists else "Индекс не найден"
+        "index_status": "Индекс найден" if index_exists else "Индекс не найден",
+        "index_loaded": vectorstore_holder.is_loaded,
+        "index_version": vectorstore_holder.version,
+        "openai": openai_health.status(),
+        "openai_circuit": openai_breaker.status(),
+        "embedding_cache": embedding_cache.stats(),
+        "answer_cache": answer_cache.stats(),
+        "sessions": session_store.stats(),
+        "ask_admission": ask_admission.stats(),
+        "coalesced_questions": answer_flights.stats()
+    }
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Счетчик и время ответа по пути; неизвестные пути объединяются, чтобы не плодить метки"""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        path = getattr(route, "path", None) or "other"
+        HTTP_REQUESTS.inc(path=path, status=str(status))
+        HTTP_SECONDS.observe(time.perf_counter() - start, path=path)
+
+
+@METRICS.collector
+def collect_runtime_metrics():
+    """Значения, которые уже считают кэши, сессии, контроль нагрузки и индекс"""
+    embedding = embedding_cache.stats()
+    answers = answer_cache.stats()
+    sessions = session_store.stats()
+    admission = ask_admission.stats()
+    flights = answer_flights.stats()
+    current = vectorstore_holder.current
+    index_file = os.path.join(INDEX_PATH, "index.faiss")
+    result = [
+        ("rag_cache_hits_total", "counter", "Попадания в кэши", [
+            ({"cache": "embedding_memory"}, embedding["memory_hits"]),
+            ({"cache": "embedding_disk"}, embedding["disk_hits"]),
+            ({"cache": "answer"}, answers["hits"]),
+        ]),
+        ("rag_cache_misses_total", "counter", "Промахи кэшей", [
+            ({"cache": "embedding"}, embedding["misses"]),
+            ({"cache": "answer"}, answers["misses"]),
+        ]),
+        ("rag_active_sessions", "gauge", "Сессии в хранилище истории",
+         [({"backend": sessions["backend"]}, sessions["sessions"])]),
+        ("rag_session_dropped_total", "counter", "Изменения истории сессий, отброшенные при переполнении очереди записи",
+         [({"backend": sessions["backend"]}, sessions.get("dropped"))]),
+        ("rag_admission_in_flight", "gauge", "Вопросы /ask в обработке", [({}, admission["in_flight"])]),
+        ("rag_admission_queue_depth", "gauge", "Вопросы /ask в очереди", [({}, admission["queued"])]),
+        ("rag_admission_rejected_total", "counter", "Отклоненные вопросы /ask по причине",
+         [({"reason": reason}, count) for reason, count in admission["rejected"].items()]),
+        ("rag_coalesced_questions_total", "counter", "Повторы вопросов, получившие общий ответ",
+         [({}, flights["followers"])]),
+        ("rag_index_loaded", "gauge", "Индекс загружен в память процесса", [({}, int(current is not None))]),
+        ("rag_index_vectors", "gauge", "Векторов в индексе FAISS",
+         [({}, current.vectorstore.index.ntotal if current is not None else None)]),
+        ("rag_index_file_bytes", "gauge", "Размер index.faiss на диске",
+         [({}, os.path.getsize(index_file) if os.path.exists(index_file) else None)]),
+        ("rag_index_load_seconds", "gauge", "Время последней загрузки индекса",
+         [({}, vectorstore_holder.load_seconds)]),
+    ]
+    if current is not None and isinstance(current.vectorstore.docstore, ChunkStore):
+        chunks = current.vectorstore.docstore.stats()
+        result[0][3].append(({"cache": "chunk"}, chunks["hits"]))
+        result[1][3].append(({"cache": "chunk"}, chunks["misses"]))
+    return result
+
+
+@app.get("/metrics")
+def metrics():
+    """Метрики процесса в текстовом формате Prometheus"""
+    return PlainTextResponse(METRICS.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+def is_admin_token(admin_token):
+    """Проверяет заголовок admin_token: SHA-256 от ADMIN_PASSWORD"""
+    admin_password = os.getenv("ADMIN_PASSWORD")
+    if not admin_password or not admin_token:
+        return False
+    return admin_token == hashlib.sha256(admin_password.encode()).hexdigest()
+
+
+@app.get("/admin/traces")
+def get_traces(limit: int = 50, session_id: str = None, min_duration_ms: float = None,
+               admin_token: str = Header(None)):
+    """Последние трассы запросов /ask из кольцевого буфера, от новых к старым"""
+    if not is_admin_token(admin_token):
+        return JSONResponse({"status": "error", "message": "Доступ запрещен: неверный пароль администратора"},
+                            status_code=403)
+    return {
+        "status": "success",
+        "buffer": request_traces.stats(),
+        "traces": request_traces.recent(limit, session_id=session_id, min_duration_ms=min_duration_ms),
     }
 
 
+@app.get("/admin/traces/{trace_id}")
+def get_trace(trace_id: str, admin_token: str = Header(None)):
+    """Одна трасса по X-Trace-Id из ответа /ask"""
+    if not is_admin_token(admin_token):
+        return JSONResponse({"status": "error", "message": "Доступ запрещен: неверный пароль администратора"},
+                            status_code=403)
+    trace = request_traces.get(trace_id)
+    if trace is None:
+        return JSONResponse({"status": "error", "message": "Трасса не найдена"}, status_code=404)
+    return {"status": "success", "trace": trace}
+
+
 @app.post("/update-index")
 async def update_index(admin_token: str = Header(None)):
     """Копирует индекс из локальной директории проекта в persistent storage на Render"""
@@ -333,7 +1695,7 @@ async def update_index(admin_token: str = Header(None)):
     # Копирование индекса
     try:
         print("Запрос на копирование индекса из локального проекта в persistent storage...")
-        success = copy_index_to_render_storage(clear_first=True)
+        success = await asyncio.to_thread(update_index_from_local)
 
         if success:
             return JSONResponse({
@@ -357,8 +1719,7 @@ async def update_index(admin_token: str = Header(None)):
 @app.post("/clear-session")
 def clear_session(session_id: str = Cookie(None), response: Response = None):
     """Очищает историю сессии"""
-    if session_id and session_id in session_memories:
-        session_memories[session_id] = []
+    if session_id and session_store.clear(session_id):
         return {"status": "success", "message": "История диалога очищена"}
     else:
         return {"status": "error", "message": "Сессия не найдена"}
@@ -373,6 +1734,8 @@ def get_index_info():
             "index_location": INDEX_PATH,
             "index_exists": os.path.exists(os.path.join(INDEX_PATH, "index.faiss")),
             "local_index_exists": os.path.exists(os.path.join(LOCAL_INDEX_PATH, "index.faiss")),
+            "in_memory": vectorstore_holder.info(),
+            "version_watcher": index_watcher.status(),
         }
 
         # Добавляем информацию о метаданных, если они есть
@@ -399,137 +1762,90 @@ def get_index_info():
         return {"status": "error", "message": f"Ошибка при получении информации об индексе: {str(e)}"}
 
 
-@app.post("/ask")
-async def ask(q: str = Form(...), session_id: str = Cookie(None), response: Response = None):
-    """Основной эндпоинт для вопросов к чат-боту"""
-    print(f"Получен запрос: {q[:50]}...")
+# Системный промпт
+SYSTEM_PROMPT = """
+        Ты ассистент с доступом к базе знаний. Используй информацию из базы знаний для ответа на вопросы.
 
-    # Проверяем, есть ли текст в запросе
-    if not q or len(q.strip()) == 0:
-        return JSONResponse({
-            "answer": "Пожалуйста, введите ваш вопрос.",
-            "sources": ""
-        })
+        ОЧЕНЬ ВАЖНО: При ответе обязательно учитывай историю диалога и предыдущие вопросы пользователя!
+        Если пользователь задает вопрос, который связан с предыдущим (например "Как его рассчитать?"), 
+        то обязательно восстанови контекст из предыдущих сообщений.
 
-    try:
-        # Очищаем старые сессии
-        clean_old_sessions()
+        Если в базе знаний нет достаточной информации для полного ответа, честно признайся, что не знаешь.
 
-        # Управление сессией
-        if not session_id:
-            session_id = str(uuid.uuid4())
-            if response:
-                response.set_cookie(key="session_id", value=session_id, max_age=SESSION_MAX_AGE)
-            print(f"Создана новая сессия: {session_id}")
-        else:
-            print(f"Использована существующая сессия: {session_id}")
-            if response:
-                response.set_cookie(key="session_id", value=session_id, max_age=SESSION_MAX_AGE)
+        Структурируй ответ с абзацами для лучшей читаемости. Используй маркированные списки где уместно.
+        Избегай длинных параграфов без разбивки - максимум 5-7 строк в одном абзаце.
 
-        # История диалога
-        if session_id not in session_memories:
-            session_memories[session_id] = []
+        Твоя цель — дать экспертный, логичный и понятный ответ, даже если прямых данных нет, используя всё, что тебе доступно.
+        """
 
-        session_last_activity[session_id] = time.time()
-        chat_history = session_memories[session_id]
 
-        # Проверяем API ключ
-        openai_api_key = os.getenv("OPENAI_API_KEY")
-        if not openai_api_key:
-            print("ОШИБКА: Ключ API OpenAI не найден в переменных окружения")
-            return JSONResponse({
-                "answer": "Ошибка: Не найден ключ API OpenAI. Пожалуйста, проверьте настройки .env файла.",
-                "sources": ""
-            }, status_code=500)
+class PreparedQuestion:
+    """Результат подготовки вопроса: сессия, найденные документы и промпт для LLM.
 
-        # Проверка валидности ключа OpenAI
-        try:
-            print("Проверка API ключа OpenAI...")
-            embeddings = OpenAIEmbeddings()
-            # Маленький тест для проверки работоспособности API
-            _ = embeddings.embed_query("тестовый запрос")
-            print("API ключ OpenAI валиден")
-        except Exception as e:
-            error_msg = f"Ошибка API OpenAI: {str(e)}"
-            print(error_msg)
-            traceback.print_exc()
-            return JSONResponse({
-                "answer": f"Извините, возникла проблема с сервисом OpenAI. Пожалуйста, попробуйте позже.",
-                "sources": ""
-            }, status_code=500)
+    Если ответ найден в семантическом кэше, cached содержит его и промпт не собирается.
+    """
 
-        # Загружаем индекс с дополнительными проверками
-        try:
-            print("Загрузка векторного хранилища...")
-            vectorstore = load_vectorstore()
-            print("Векторное хранилище успешно загружено")
-        except Exception as e:
-            error_msg = f"Ошибка загрузки индекса: {str(e)}"
-            print(error_msg)
-            traceback.print_exc()
-            return JSONResponse({
-                "answer": "Извините, произошла ошибка при доступе к базе знаний. Пожалуйста, попробуйте позже.",
-                "sources": ""
-            }, status_code=500)
+    def __init__(self, session_id, relevant_docs, full_prompt, query_embedding=None,
+                 index_version=None, cacheable=False, cached=None, prompt_tokens=None):
+        self.session_id = session_id
+        self.relevant_docs = relevant_docs
+        self.full_prompt = full_prompt
+        self.prompt_tokens = prompt_tokens
+        self.query_embedding = query_embedding
+        self.index_version = index_version
+        self.cacheable = cacheable
+        self.cached = cached
 
-        # Подготовка контекста из истории диалога
-        dialog_context = ""
-        if chat_history:
-            dialog_context = "История диалога:\n"
-            for i, (prev_q, prev_a) in enumerate(chat_history):
-                dialog_context += f"Вопрос пользователя: {prev_q}\nТвой ответ: {prev_a}\n\n"
 
-        # Обогащенный запрос с контекстом
-        recent_dialogue = " ".join([qa[0] + " " + qa[1] for qa in chat_history[-3:]]) if chat_history else ""
-        enhanced_query = f"{recent_dialogue} {q}"
+def error_answer(message, status_code=500):
+    """Ответ с ошибкой в формате, который ожидает фронтенд"""
+    return JSONResponse({"answer": message, "sources": ""}, status_code=status_code)
 
-        # Получаем релевантные документы с обработкой исключений
+
+def set_session_cookie(response, session_id):
+    response.set_cookie(key="session_id", value=session_id, max_age=SESSION_MAX_AGE)
+    return response
+
+
+@lru_cache(maxsize=1)
+def get_token_encoding():
+    """Токенизатор для подсчета размера промпта (cl100k_base, если модель неизвестна tiktoken).
+
+    Если словарь tiktoken недоступен (нет сети при первом запуске), возвращает None
+    и размер промпта оценивается по числу символов.
+    """
+    try:
         try:
-            print(f"Выполняется поиск по запросу: '{enhanced_query[:50]}...'")
-            retriever = vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": 6})
-            relevant_docs = retriever.get_relevant_documents(enhanced_query)
-            print(f"Найдено {len(relevant_docs)} релевантных документов")
-
-            # Вывод метаданных первого документа для диагностики
-            if relevant_docs:
-                doc_metadata = relevant_docs[0].metadata
-                print(f"Пример метаданных документа: {doc_metadata}")
-        except Exception as e:
-            error_msg = f"Ошибка при поиске документов: {str(e)}"
-            print(error_msg)
-            traceback.print_exc()
+            return tiktoken.encoding_for_model(LLM_MODEL)
+        except KeyError:
+            return tiktoken.get_encoding(TOKEN_ENCODING)
+    except Exception as e:
+        print(f"Не удалось загрузить токенизатор tiktoken, используется оценка по символам: {e}")
+        return None
 
-            # Пробуем продолжить без документов
-            relevant_docs = []
-            print("Продолжаем работу без документов...")
 
-        # Готовим контекст для LLM
-        if len(relevant_docs) == 0:
-            context = "Документов не найдено. Постарайся ответить, используя только историю диалога, если это возможно."
-        else:
-            context = ""
-            for i, doc in enumerate(relevant_docs):
-                context += f"Документ {i + 1}: {doc.page_content}\n\n"
+def count_tokens(text):
+    encoding = get_token_encoding()
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN_ESTIMATE + 1
+    return len(encoding.encode(text))
 
-        # Системный промпт
-        system_prompt = """
-        Ты ассистент с доступом к базе знаний. Используй информацию из базы знаний для ответа на вопросы.
 
-        ОЧЕНЬ ВАЖНО: При ответе обязательно учитывай историю диалога и предыдущие вопросы пользователя!
-        Если пользователь задает вопрос, который связан с предыдущим (например "Как его рассчитать?"), 
-        то обязательно восстанови контекст из предыдущих сообщений.
+def doc_token_count(doc):
+    """Число токенов чанка: берется из метаданных индекса, для старых индексов считается на лету"""
+    token_count = doc.metadata.get("token_count")
+    if token_count is None:
+        token_count = count_tokens(doc.page_content)
+    return token_count
 
-        Если в базе знаний нет достаточной информации для полного ответа, честно признайся, что не знаешь.
 
-        Структурируй ответ с абзацами для лучшей читаемости. Используй маркированные списки где уместно.
-        Избегай длинных параграфов без разбивки - максимум 5-7 строк в одном абзаце.
+def format_dialog_turn(prev_q, prev_a):
+    return f"Вопрос пользователя: {prev_q}\nТвой ответ: {prev_a}\n\n"
 
-        Твоя цель — дать экспертный, логичный и понятный ответ, даже если прямых данных нет, используя всё, что тебе доступно.
-        """
 
-        # Полный промпт для LLM
-        full_prompt = f"""
-        {system_prompt}
+def render_full_prompt(q, dialog_context, context):
+    return f"""
+        {SYSTEM_PROMPT}
 
         {dialog_context}
 
@@ -542,50 +1858,400 @@ async def ask(q: str = Form(...), session_id: str = Cookie(None), response: Resp
         Если вопрос связан с предыдущими вопросами, обязательно учти это в ответе.
         """
 
-        # Запрос к LLM с обработкой исключений
-        try:
-            print("Инициализация модели LLM...")
-            llm = ChatOpenAI(model_name="gpt-4o-mini", temperature=0.2)
 
-            print("Отправка запроса к LLM...")
-            result = llm.invoke(full_prompt)
-            print("Ответ от LLM получен")
-            answer = result.content
-        except Exception as e:
-            error_msg = f"Ошибка при работе с LLM: {str(e)}"
-            print(error_msg)
-            traceback.print_exc()
-            return JSONResponse({
-                "answer": "Извините, произошла ошибка в сервисе языковой модели. Пожалуйста, попробуйте позже.",
-                "sources": ""
-            }, status_code=500)
+def build_full_prompt(q, chat_history, relevant_docs, budget=PROMPT_TOKEN_BUDGET):
+    """Собирает промпт для LLM в пределах бюджета токенов.
+
+    Приоритеты: системный промпт и вопрос всегда; затем лучший найденный документ;
+    затем последние реплики диалога (не больше PROMPT_HISTORY_SHARE доступного бюджета);
+    затем остальные документы по рангу; оставшееся место отдается более старым репликам.
+
+    Возвращает (промпт, включенные документы, статистика токенов).
+    """
+    available = budget - count_tokens(render_full_prompt(q, "История диалога:\n", ""))
+
+    doc_costs = [count_tokens(f"Документ {i + 1}: ") + doc_token_count(doc) + 1 for i, doc in enumerate(relevant_docs)]
+    turn_costs = [count_tokens(format_dialog_turn(prev_q, prev_a)) for prev_q, prev_a in chat_history]
+
+    included_docs = 0
+    context_tokens = 0
+    # Лучший документ включаем в первую очередь
+    if doc_costs and doc_costs[0] <= available:
+        included_docs = 1
+        context_tokens = doc_costs[0]
+
+    # Последние реплики диалога, от новых к старым
+    history_cap = int((available - context_tokens) * PROMPT_HISTORY_SHARE)
+    included_turns = 0
+    history_tokens = 0
+    for cost in reversed(turn_costs):
+        if history_tokens + cost > history_cap:
+            break
+        included_turns += 1
+        history_tokens += cost
+
+    # Остальные документы по рангу
+    while included_docs < len(doc_costs) and \
+            context_tokens + history_tokens + doc_costs[included_docs] <= available:
+        context_tokens += doc_costs[included_docs]
+        included_docs += 1
+
+    # Оставшееся место отдаем более старым репликам
+    while included_turns < len(turn_costs) and \
+            context_tokens + history_tokens + turn_costs[-included_turns - 1] <= available:
+        history_tokens += turn_costs[-included_turns - 1]
+        included_turns += 1
+
+    # Подготовка контекста из истории диалога
+    dialog_context = ""
+    if included_turns:
+        dialog_context = "История диалога:\n"
+        for prev_q, prev_a in chat_history[-included_turns:]:
+            dialog_context += format_dialog_turn(prev_q, prev_a)
+
+    # Готовим контекст для LLM
+    docs = relevant_docs[:included_docs]
+    if len(docs) == 0:
+        context = "Документов не найдено. Постарайся ответить, используя только историю диалога, если это возможно."
+    else:
+        context = ""
+        for i, doc in enumerate(docs):
+            context += f"Документ {i + 1}: {doc.page_content}\n\n"
+
+    full_prompt = render_full_prompt(q, dialog_context, context)
+    token_stats = {
+        "total": budget - available + history_tokens + context_tokens,
+        "budget": budget,
+        "history": history_tokens,
+        "context": context_tokens,
+        "history_turns": f"{included_turns}/{len(chat_history)}",
+        "documents": f"{included_docs}/{len(relevant_docs)}",
+    }
+    print(f"Промпт: {token_stats['total']} токенов из {budget} "
+          f"(история {token_stats['history_turns']}, документы {token_stats['documents']})")
+    return full_prompt, docs, token_stats
 
-        # Сохраняем в историю диалога
-        session_memories[session_id].append((q, answer))
-        if len(session_memories[session_id]) > 15:
-            session_memories[session_id] = session_memories[session_id][-15:]
-
-        # Формируем источники для отображения
-        source_links = ""
-        used_titles = set()
-        for doc in relevant_docs:
-            title = doc.metadata.get("source", "Источник неизвестен")
-            if title not in used_titles:
-                content = html.escape(doc.page_content[:3000])
-                source_links += f"<details><summary>📄 {title}</summary><pre style='white-space:pre-wrap;text-align:left'>{content}</pre></details>"
-                used_titles.add(title)
-
-        # Возвращаем ответ
-        clean_answer = answer.replace("<br>", "\n").replace("<p>", "").replace("</p>", "\n")
-        return JSONResponse({"answer": clean_answer, "sources": source_links})
 
+# Ссылки на стандарты и нормативные акты, которые пользователи пишут дословно
+REFERENCE_PATTERNS = [
+    re.compile(r"\b(?:IAS|IFRS|IFRIC|SIC|МСФО|МСБУ)\s*(?:\((?:IFRS|IAS)\)\s*)?\d+\b", re.IGNORECASE),
+    re.compile(r"\b(?:Правил[а-яё]*|Постановлени[а-яё]*|стать[а-яё]*|пункт[а-яё]*)\s*№?\s*\d+\b", re.IGNORECASE),
+    re.compile(r"\bЗакон[а-яё]*\s+(?:о|об)\s+[А-Яа-яЁё]+\b", re.IGNORECASE),
+]
+ABBREVIATION_PATTERN = re.compile(r"\b[А-ЯЁA-Z]{2,}\b")
+WORD_PATTERN = re.compile(r"[А-Яа-яЁёA-Za-z]{5,}")
+QUERY_STOPWORDS = {
+    "какие", "какой", "какая", "каким", "каких", "когда", "нужно", "можно", "который", "которые",
+    "которая", "также", "этого", "этому", "потому", "почему", "сколько", "должен", "должна",
+    "должны", "является", "являются", "вопрос", "ответ", "пожалуйста", "расскажи", "объясни",
+    "подробнее", "спасибо", "например", "чтобы", "разница", "между",
+}
+
+
+def extract_salient_terms(text, include_words=True):
+    """Извлекает из текста ссылки на стандарты и нормы, аббревиатуры и (для вопросов) значимые слова"""
+    terms = []
+    for pattern in REFERENCE_PATTERNS:
+        terms.extend(match.group(0) for match in pattern.finditer(text))
+    terms.extend(ABBREVIATION_PATTERN.findall(text))
+    if include_words:
+        terms.extend(word for word in WORD_PATTERN.findall(text) if word.lower() not in QUERY_STOPWORDS)
+    return terms
+
+
+def build_retrieval_query(q, chat_history, max_chars=RETRIEVAL_QUERY_MAX_CHARS):
+    """Строит ограниченный по длине поисковый запрос.
+
+    Вопрос идет первым и целиком (в пределах max_chars). Из последних реплик берутся только
+    ключевые термины: ссылки на стандарты и нормы и аббревиатуры из вопросов и ответов, значимые
+    слова - только из вопросов. Термины из истории занимают не больше, чем вдвое больше места,
+    чем сам вопрос, чтобы вектор запроса определялся текущим вопросом.
+    """
+    query = q.strip()[:max_chars]
+    if not chat_history:
+        return query
+
+    # Слова, уже присутствующие в запросе, повторно не добавляем
+    seen = {word.lower() for word in re.findall(r"\w+", query)}
+    history_terms = []
+    # От новых реплик к старым: свежий контекст важнее
+    for prev_q, prev_a in reversed(chat_history[-RETRIEVAL_HISTORY_TURNS:]):
+        for term in extract_salient_terms(prev_q) + extract_salient_terms(prev_a, include_words=False):
+            words = {word.lower() for word in re.findall(r"\w+", term)}
+            if not words <= seen:
+                seen.update(words)
+                history_terms.append(term)
+
+    history_limit = min(max_chars - len(query) - 1, max(2 * len(query), 120))
+    history_part = ""
+    for term in history_terms[:RETRIEVAL_HISTORY_TERMS]:
+        candidate = f"{history_part} {term}".strip()
+        if len(candidate) > history_limit:
+            break
+        history_part = candidate
+
+    return f"{query}\n{history_part}" if history_part else query
+
+
+async def embed_retrieval_query(query):
+    """Получает эмбеддинг поискового запроса; при ошибке возвращает None"""
+    try:
+        print(f"Выполняется поиск по запросу: '{query[:50]}...'")
+        with stage_timer("embedding"):
+            return await embedding_cache.aembed_query(query)
     except Exception as e:
-        error_message = f"Ошибка при обработке запроса: {str(e)}"
-        print(error_message)
-        print(f"Тип ошибки: {type(e).__name__}")
-        traceback.print_exc()  # Выводит полный стек ошибки
+        print(f"Ошибка при получении эмбеддинга запроса: {str(e)}")
+        traceback.print_exc()
+        return None
+
+
+def reference_candidates(index, question):
+    """Позиции чанков документов, на которые вопрос ссылается явно ("IAS 36", "Правила 188")"""
+    if index.reference_map is None or not question:
+        return None
+    keys = index.reference_map.match(question)
+    if not keys:
+        return None
+    candidates = index.reference_map.positions(keys)
+    print(f"Вопрос ссылается на {', '.join(keys)}: поиск среди {len(candidates)} чанков")
+    return candidates
+
+
+def dense_search_batch(index, query_embeddings, k, candidates_list=None):
+    """Плотный поиск по нескольким запросам: позиции чанков по возрастанию расстояния для каждого.
+
+    Запросы без ограничения по документам ищутся одним векторизованным вызовом FAISS.
+    Для индекса укороченных векторов с полными векторами на диске сначала ищется
+    RESCORE_CANDIDATES кандидатов, затем они переранжируются по полным векторам.
+    """
+    faiss_index = index.vectorstore.index
+    candidates_list = candidates_list or [None] * len(query_embeddings)
+    vectors = index.search_vector(np.asarray(query_embeddings, dtype=np.float32))
+    fetch_k = k if index.full_vectors is None else max(k, RESCORE_CANDIDATES)
+
+    results = [None] * len(vectors)
+    unfiltered = [i for i, candidates in enumerate(candidates_list) if candidates is None]
+    if unfiltered:
+        _, dense_ids = faiss_index.search(np.ascontiguousarray(vectors[unfiltered]), fetch_k)
+        for row, i in enumerate(unfiltered):
+            results[i] = [int(position) for position in dense_ids[row] if position != -1]
+    for i, candidates in enumerate(candidates_list):
+        if candidates is not None:
+            results[i] = filtered_search(faiss_index, vectors[i], candidates, fetch_k)
+
+    if index.full_vectors is not None:
+        results = [rescore(index.full_vectors, query_embeddings[i], positions, k)
+                   for i, positions in enumerate(results)]
+    return [positions[:k] for positions in results]
+
+
+def dense_search(index, query_embedding, k, candidates=None):
+    """Плотный поиск по одному запросу: позиции чанков по возрастанию расстояния"""
+    return dense_search_batch(index, [query_embedding], k, [candidates])[0]
+
+
+def dense_distances(index, query_embedding, positions):
+    """Расстояния L2 от запроса до чанков (по полным векторам, если они есть)"""
+    if not positions:
+        return []
+    ids = np.asarray(positions, dtype=np.int64)
+    if index.full_vectors is not None:
+        vectors = np.asarray(index.full_vectors[ids], dtype=np.float32)
+        query = np.asarray(query_embedding, dtype=np.float32)
+    else:
+        vectors = index.vectorstore.index.reconstruct_batch(ids)
+        query = index.search_vector(query_embedding)
+    return ((vectors - query) ** 2).sum(axis=1).tolist()
+
+
+def search_positions_batch(index, queries, query_embeddings, k=RETRIEVAL_K, questions=None):
+    """Гибридный поиск по нескольким запросам: плотный FAISS и лексический BM25 через reciprocal rank fusion.
+
+    Если вопрос явно ссылается на стандарт или норму из карты ссылок, оба вида поиска
+    ограничиваются чанками этих документов. Возвращает для каждого запроса
+    список пар (позиция чанка, оценка RRF).
+    """
+    questions = questions or [None] * len(queries)
+    candidates_list = [reference_candidates(index, question) for question in questions]
+    fetch_k = max(k, HYBRID_FETCH_K)
+    dense_rankings = dense_search_batch(index, query_embeddings, fetch_k, candidates_list)
+
+    results = []
+    for query, dense_ranking, candidates in zip(queries, dense_rankings, candidates_list):
+        rankings = [dense_ranking]
+        if index.lexical is not None:
+            rankings.append([position for position, _ in index.lexical.search(query, fetch_k, candidates)])
+        results.append(reciprocal_rank_fusion(rankings, k=RRF_K, with_scores=True)[:k])
+    return results
+
+
+def search_hits_batch(index, queries, query_embeddings, k):
+    """Поиск /search целиком в пуле потоков: позиции, чанки и расстояния L2 (чтение индекса и mmap).
+
+    Возвращает (результаты по запросам, {позиция: чанк}, расстояния по запросам).
+    """
+    results = search_positions_batch(index, queries, query_embeddings, k, queries)
+    positions = list(dict.fromkeys(position for fused in results for position, _ in fused))
+    documents = dict(zip(positions, index.documents(positions)))
+    distances = [dense_distances(index, embedding, [position for position, _ in fused])
+                 for embedding, fused in zip(query_embeddings, results)]
+    return results, documents, distances
+
+
+def search_index(index, query, query_embedding, k=RETRIEVAL_K, question=None, with_scores=False):
+    """Гибридный поиск по одному запросу; возвращает чанки (и пары (позиция, оценка), если with_scores)"""
+    fused = search_positions_batch(index, [query], [query_embedding], k, [question])[0]
+    documents = index.documents([position for position, _ in fused])
+    return (documents, fused) if with_scores else documents
+
+
+async def retrieve_documents(index, query, query_embedding, question=None):
+    """Ищет релевантные документы; при ошибке поиска продолжаем без документов"""
+    if query_embedding is None:
+        print("Эмбеддинг запроса недоступен. Продолжаем работу без документов...")
+        return []
+
+    try:
+        with stage_timer("search"):
+            relevant_docs, fused = await run_in_search_executor(
+                search_index, index, query, query_embedding, question=question, with_scores=True
+            )
+        print(f"Найдено {len(relevant_docs)} релевантных документов")
+
+        trace = current_trace.get()
+        if trace is not None:
+            trace.chunks = [
+                {"position": int(position), "score": round(float(score), 5), "source": doc.metadata.get("source")}
+                for (position, score), doc in zip(fused, relevant_docs)
+            ]
+
+        # Вывод метаданных первого документа для диагностики
+        if relevant_docs:
+            doc_metadata = relevant_docs[0].metadata
+            print(f"Пример метаданных документа: {doc_metadata}")
+        return relevant_docs
+    except Exception as e:
+        error_msg = f"Ошибка при поиске документов: {str(e)}"
+        print(error_msg)
+        traceback.print_exc()
+
+        # Пробуем продолжить без документов
+        print("Продолжаем работу без документов...")
+        return []
+
+
+async def open_session(session_id):
+    """Создает сессию при необходимости и читает историю диалога; возвращает (session_id, chat_history)"""
+    with stage_timer("session"):
+        # Очищаем старые сессии
+        clean_old_sessions()
+
+        # Управление сессией
+        if not session_id:
+            session_id = str(uuid.uuid4())
+            print(f"Создана новая сессия: {session_id}")
+        else:
+            print(f"Использована существующая сессия: {session_id}")
+
+        # История диалога
+        chat_history = await asyncio.to_thread(session_store.history, session_id)
+    return session_id, chat_history
+
+
+async def prepare_question(q, session_id, chat_history):
+    """Общие этапы /ask и /ask/stream: проверки, поиск документов и сборка промпта.
+
+    Возвращает (PreparedQuestion, None) или (None, {"error", "status_code"}); ответ с ошибкой
+    каждый вызывающий строит сам, потому что результат может быть общим для нескольких запросов
+    """
+    # Проверяем API ключ
+    openai_api_key = os.getenv("OPENAI_API_KEY")
+    if not openai_api_key:
+        print("ОШИБКА: Ключ API OpenAI не найден в переменных окружения")
+        return None, {"error": "Ошибка: Не найден ключ API OpenAI. Пожалуйста, проверьте настройки .env файла.", "status_code": 500}
+
+    # Быстрый отказ по результату фоновой проверки OpenAI
+    if openai_health.is_unavailable():
+        print(f"OpenAI недоступен по данным фоновой проверки: {openai_health.error}")
+        return None, {"error": "Извините, возникла проблема с сервисом OpenAI. Пожалуйста, попробуйте позже.", "status_code": 503}
+
+    # Берем загруженный в память индекс (загружается один раз на процесс)
+    try:
+        if vectorstore_holder.is_loaded:
+            index = vectorstore_holder.snapshot()
+        else:
+            index = await asyncio.to_thread(vectorstore_holder.snapshot)
+        index_version = index.version
+    except Exception as e:
+        error_msg = f"Ошибка загрузки индекса: {str(e)}"
+        print(error_msg)
+        traceback.print_exc()
+        return None, {"error": "Извините, произошла ошибка при доступе к базе знаний. Пожалуйста, попробуйте позже.", "status_code": 500}
+
+    # Поисковый запрос: вопрос плюс ключевые термины из истории диалога
+    enhanced_query = build_retrieval_query(q, chat_history)
+
+    query_embedding = await embed_retrieval_query(enhanced_query)
+
+    # Вопросы без истории диалога можно отвечать из семантического кэша
+    cacheable = not chat_history and query_embedding is not None
+    if cacheable:
+        cached = answer_cache.lookup(q, query_embedding, index_version)
+        if cached is not None:
+            print("Ответ найден в семантическом кэше")
+            return PreparedQuestion(session_id, [], None, query_embedding, index_version, cached=cached), None
+
+    relevant_docs = await retrieve_documents(index, enhanced_query, query_embedding, question=q)
+    with stage_timer("prompt"):
+        full_prompt, prompt_docs, prompt_tokens = build_full_prompt(q, chat_history, relevant_docs)
+    return PreparedQuestion(session_id, prompt_docs, full_prompt, query_embedding, index_version, cacheable,
+                            prompt_tokens=prompt_tokens), None
+
 
-        # Запись ошибки в лог
+def cache_answer(q, prepared, answer, source_links):
+    """Сохраняет ответ на вопрос без истории в семантический кэш"""
+    if prepared.cacheable:
+        answer_cache.put(q, prepared.query_embedding, answer, source_links, prepared.index_version)
+
+
+def count_llm_tokens(prepared, answer, trace=None):
+    """Учитывает в метриках и трассе запроса токены промпта и ответа LLM"""
+    completion_tokens = count_tokens(answer)
+    if prepared.prompt_tokens:
+        LLM_TOKENS.inc(prepared.prompt_tokens["total"], kind="prompt")
+    LLM_TOKENS.inc(completion_tokens, kind="completion")
+
+    if trace is None:
+        trace = current_trace.get()
+    if trace is not None:
+        trace.tokens = {"prompt": prepared.prompt_tokens, "completion": completion_tokens}
+
+
+def remember_turn(session_id, q, answer):
+    """Сохраняет вопрос и ответ в историю диалога"""
+    session_store.append(session_id, q, answer)
+
+
+def render_source_links(relevant_docs):
+    """Формирует HTML-блок источников для отображения"""
+    source_links = ""
+    used_titles = set()
+    for doc in relevant_docs:
+        title = doc.metadata.get("source", "Источник неизвестен")
+        if title not in used_titles:
+            content = html.escape(doc.page_content[:3000])
+            source_links += f"<details><summary>📄 {title}</summary><pre style='white-space:pre-wrap;text-align:left'>{content}</pre></details>"
+            used_titles.add(title)
+    return source_links
+
+
+def clean_answer_text(answer):
+    return answer.replace("<br>", "\n").replace("<p>", "").replace("</p>", "\n")
+
+
+def log_request_error(q, error_message):
+    """Записывает ошибку обработки вопроса в лог на persistent storage"""
+    try:
         log_dir = "/data"
         os.makedirs(log_dir, exist_ok=True)
         log_file = os.path.join(log_dir, "error.log")
@@ -595,11 +2261,361 @@ async def ask(q: str = Form(...), session_id: str = Cookie(None), response: Resp
             log.write(f"Вопрос: {q}\n")
             log.write(f"Ошибка: {error_message}\n")
             log.write(f"Трассировка:\n{traceback.format_exc()}\n\n")
+    except Exception as e:
+        print(f"Не удалось записать ошибку в лог: {e}")
 
-        return JSONResponse({
-            "answer": f"Извините, произошла ошибка при обработке вашего запроса. Пожалуйста, попробуйте позже или обратитесь к администратору.",
+
+def handle_request_exception(q, e):
+    error_message = f"Ошибка при обработке запроса: {str(e)}"
+    print(error_message)
+    print(f"Тип ошибки: {type(e).__name__}")
+    traceback.print_exc()  # Выводит полный стек ошибки
+
+    # Запись ошибки в лог
+    log_request_error(q, error_message)
+
+    return error_answer("Извините, произошла ошибка при обработке вашего запроса. Пожалуйста, попробуйте позже или обратитесь к администратору.")
+
+
+@app.post("/ask")
+async def ask(q: str = Form(...), session_id: str = Cookie(None), admin_token: str = Header(None)):
+    """Основной эндпоинт для вопросов к чат-боту.
+
+    Ответ содержит заголовки Server-Timing (длительность этапов) и X-Trace-Id; с верным
+    admin_token в тело добавляется полная трасса запроса.
+    """
+    print(f"Получен запрос: {q[:50]}...")
+
+    trace = RequestTrace("/ask", q, session_id)
+    # Проверяем, есть ли текст в запросе
+    if not q or len(q.strip()) == 0:
+        response = JSONResponse({
+            "answer": "Пожалуйста, введите ваш вопрос.",
             "sources": ""
-        }, status_code=500)
+        })
+    else:
+        context_token = current_trace.set(trace)
+        try:
+            response = await answer_question(q, session_id, trace, include_trace=is_admin_token(admin_token))
+        finally:
+            current_trace.reset(context_token)
+    return finish_trace(trace, response)
+
+
+async def answer_question(q, session_id, trace, include_trace=False):
+    """Обработка вопроса /ask: сессия, очередь, общий для повторов ответ и история диалога"""
+    try:
+        session_id, chat_history = await open_session(session_id)
+        trace.session_id = session_id
+        key = answer_flight_key(q, chat_history, vectorstore_holder.version)
+
+        # Повтор вопроса, который уже обрабатывается или ждет в очереди, получает общий ответ
+        # без своего места в очереди
+        coalesced = key in answer_flights
+        trace.details["coalesced"] = coalesced
+        started = time.perf_counter()
+        try:
+            outcome = await answer_flights.run(key, admitted_answer, q, session_id, chat_history)
+        except AdmissionRejected as e:
+            return set_session_cookie(admission_rejected_answer(e), session_id)
+        if coalesced:
+            trace.add_stage("coalesced", time.perf_counter() - started)
+        if "error" in outcome:
+            return set_session_cookie(error_answer(outcome["error"], outcome["status_code"]), session_id)
+
+        # Сохраняем в историю диалога каждого, кто задал вопрос
+        remember_turn(session_id, q, outcome["answer"])
+        content = {"answer": clean_answer_text(outcome["answer"]), "sources": outcome["sources"]}
+        if outcome["prompt_tokens"] is not None:
+            content["prompt_tokens"] = outcome["prompt_tokens"]
+        if include_trace:
+            trace.finish(200)
+            content["trace"] = trace.to_dict()
+        return set_session_cookie(JSONResponse(content), session_id)
+
+    except Exception as e:
+        return handle_request_exception(q, e)
+
+
+async def admitted_answer(q, session_id, chat_history):
+    """generate_answer с местом в очереди /ask.
+
+    Выполняется в общей задаче SingleFlight: задача регистрируется до ожидания в очереди, и место
+    занято, пока она идет, даже если запрос, который ее начал, уже отключился.
+    """
+    ticket = await ask_admission.acquire(session_id)
+    try:
+        return await generate_answer(q, session_id, chat_history)
+    finally:
+        ticket.release()
+
+
+async def generate_answer(q, session_id, chat_history):
+    """Поиск документов и ответ LLM для /ask; результат общий для одинаковых одновременных вопросов.
+
+    Возвращает {"answer", "sources", "prompt_tokens"} или {"error", "status_code"}.
+    """
+    prepared, error = await prepare_question(q, session_id, chat_history)
+    if error is not None:
+        return error
+
+    if prepared.cached is not None:
+        return {"answer": prepared.cached["answer"], "sources": prepared.cached["sources"], "prompt_tokens": None}
+
+    # Запрос к LLM с обработкой исключений
+    try:
+        print("Отправка запроса к LLM...")
+        with stage_timer("llm"):
+            result = await call_openai(get_llm().ainvoke, prepared.full_prompt)
+        print("Ответ от LLM получен")
+        answer = result.content
+    except CircuitOpenError as e:
+        print(f"Запрос к LLM отклонен: {e}")
+        return {"error": "Извините, сервис языковой модели временно недоступен. Пожалуйста, попробуйте позже.",
+                "status_code": 503}
+    except Exception as e:
+        error_msg = f"Ошибка при работе с LLM: {str(e)}"
+        print(error_msg)
+        traceback.print_exc()
+        return {"error": "Извините, произошла ошибка в сервисе языковой модели. Пожалуйста, попробуйте позже.",
+                "status_code": 500}
+
+    count_llm_tokens(prepared, answer)
+    with stage_timer("sources"):
+        source_links = render_source_links(prepared.relevant_docs)
+    cache_answer(q, prepared, answer, source_links)
+    return {"answer": answer, "sources": source_links, "prompt_tokens": prepared.prompt_tokens}
+
+
+def format_sse(event, data):
+    """Формирует одно событие Server-Sent Events с JSON-данными"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def stream_answer_events(q, prepared, trace):
+    """Генерирует SSE-события: токены ответа, затем блок источников и итоговый ответ.
+
+    Поток идет уже после возврата из обработчика, вне current_trace, поэтому этапы
+    записываются в переданную трассу: llm, llm_first_token (от вызова LLM до первого токена),
+    first_token_ms (от начала запроса) и токены.
+    """
+    if prepared.cached is not None:
+        answer = prepared.cached["answer"]
+        remember_turn(prepared.session_id, q, answer)
+        trace.details["first_token_ms"] = round(trace.elapsed() * 1000, 1)
+        yield format_sse("token", {"text": answer})
+        yield format_sse("sources", {"sources": prepared.cached["sources"]})
+        yield format_sse("done", {"answer": clean_answer_text(answer)})
+        return
+
+    parts = []
+    llm_started = time.perf_counter()
+    try:
+        # Повтор посреди потока невозможен, поэтому только проверка circuit breaker
+        openai_breaker.before_call()
+        print("Отправка потокового запроса к LLM...")
+        try:
+            async for chunk in get_llm().astream(prepared.full_prompt):
+                if chunk.content:
+                    if not parts:
+                        first_token = time.perf_counter() - llm_started
+                        STAGE_SECONDS.observe(first_token, stage="llm_first_token")
+                        trace.add_stage("llm_first_token", first_token)
+                        trace.details["first_token_ms"] = round(trace.elapsed() * 1000, 1)
+                    parts.append(chunk.content)
+                    yield format_sse("token", {"text": chunk.content})
+        except OPENAI_RETRYABLE_ERRORS:
+            openai_breaker.record_failure()
+            raise
+        else:
+            openai_breaker.record_success()
+        finally:
+            openai_breaker.release_probe()
+    except Exception as e:
+        llm_seconds = time.perf_counter() - llm_started
+        STAGE_ERRORS.inc(stage="llm")
+        STAGE_SECONDS.observe(llm_seconds, stage="llm")
+        trace.add_stage("llm", llm_seconds)
+        trace.details["stream_error"] = True
+        print(f"Ошибка при потоковой работе с LLM: {str(e)}")
+        traceback.print_exc()
+        yield format_sse("error", {
+            "message": "Извините, произошла ошибка в сервисе языковой модели. Пожалуйста, попробуйте позже."
+        })
+        return
+
+    answer = "".join(parts)
+    llm_seconds = time.perf_counter() - llm_started
+    STAGE_SECONDS.observe(llm_seconds, stage="llm")
+    trace.add_stage("llm", llm_seconds)
+    print("Потоковый ответ от LLM получен")
+
+    # Сохраняем завершенный ответ в историю диалога
+    remember_turn(prepared.session_id, q, answer)
+
+    count_llm_tokens(prepared, answer, trace)
+    with stage_timer("sources", trace):
+        source_links = render_source_links(prepared.relevant_docs)
+    cache_answer(q, prepared, answer, source_links)
+
+    yield format_sse("sources", {"sources": source_links})
+    yield format_sse("done", {"answer": clean_answer_text(answer), "prompt_tokens": prepared.prompt_tokens})
+
+
+async def release_after_stream(events, ticket, trace):
+    """Держит место контроля нагрузки, пока идет поток ответа, и записывает трассу по его окончании"""
+    completed = False
+    try:
+        async for event in events:
+            yield event
+        completed = True
+    finally:
+        trace.details["stream_completed"] = completed
+        finish_stream(ticket, trace)
+
+
+def finish_stream(ticket, trace):
+    """Освобождает место и записывает трассу потока; повторный вызов ничего не делает"""
+    ticket.release()
+    if trace.status is None:
+        trace.finish(200)
+        request_traces.add(trace)
+
+
+@app.post("/ask/stream")
+async def ask_stream(q: str = Form(...), session_id: str = Cookie(None)):
+    """Потоковый вариант /ask: отдает токены ответа как Server-Sent Events по мере генерации.
+
+    Server-Timing потокового ответа содержит только этапы до начала генерации; трасса с
+    длительностью генерации и первого токена попадает в /admin/traces, когда поток закончится.
+    """
+    print(f"Получен потоковый запрос: {q[:50]}...")
+
+    trace = RequestTrace("/ask/stream", q, session_id)
+    if not q or len(q.strip()) == 0:
+        return finish_trace(trace, JSONResponse({
+            "answer": "Пожалуйста, введите ваш вопрос.",
+            "sources": ""
+        }))
+
+    context_token = current_trace.set(trace)
+    try:
+        return await start_answer_stream(q, session_id, trace)
+    finally:
+        current_trace.reset(context_token)
+
+
+async def start_answer_stream(q, session_id, trace):
+    """Очередь, сессия и подготовка вопроса /ask/stream; возвращает потоковый ответ или ошибку"""
+    try:
+        ticket = await ask_admission.acquire(session_id)
+    except AdmissionRejected as e:
+        return finish_trace(trace, admission_rejected_answer(e))
+
+    try:
+        session_id, chat_history = await open_session(session_id)
+        trace.session_id = session_id
+        prepared, error = await prepare_question(q, session_id, chat_history)
+        if error is not None:
+            ticket.release()
+            response = error_answer(error["error"], error["status_code"])
+            return finish_trace(trace, set_session_cookie(response, session_id))
+
+        response = StreamingResponse(
+            release_after_stream(stream_answer_events(q, prepared, trace), ticket, trace),
+            media_type="text/event-stream",
+            headers={
+                "Cache-Control": "no-cache",
+                "X-Accel-Buffering": "no",  # отключаем буферизацию в прокси
+            },
+            # Если соединение оборвется до начала потока, место освободит фоновая задача
+            background=BackgroundTask(finish_stream, ticket, trace),
+        )
+        return set_trace_headers(set_session_cookie(response, prepared.session_id), trace)
+
+    except Exception as e:
+        ticket.release()
+        return finish_trace(trace, handle_request_exception(q, e))
+
+
+class SearchRequest(BaseModel):
+    """Тело запроса /search"""
+    queries: List[str]
+    k: int = RETRIEVAL_K
+    include_content: bool = True
+
+
+def search_error(message, status_code):
+    return JSONResponse({"status": "error", "message": message}, status_code=status_code)
+
+
+@app.post("/search")
+async def search(request: SearchRequest):
+    """Поиск по базе знаний без обращения к LLM.
+
+    Все запросы эмбеддятся одним вызовом API и ищутся одним векторизованным вызовом FAISS.
+    Для каждого запроса возвращает top-k чанков: номер чанка, оценку RRF, расстояние L2, источник и текст.
+    """
+    queries = [query.strip() for query in request.queries]
+    if not queries or any(not query for query in queries):
+        return search_error("Передайте непустой список непустых запросов в поле queries", 400)
+    if len(queries) > SEARCH_MAX_QUERIES:
+        return search_error(f"Не больше {SEARCH_MAX_QUERIES} запросов за один вызов", 400)
+    if not 1 <= request.k <= SEARCH_MAX_K:
+        return search_error(f"k должно быть от 1 до {SEARCH_MAX_K}", 400)
+
+    print(f"Получен поисковый запрос: {len(queries)} запросов, k={request.k}")
+    try:
+        if vectorstore_holder.is_loaded:
+            index = vectorstore_holder.snapshot()
+        else:
+            index = await asyncio.to_thread(vectorstore_holder.snapshot)
+    except Exception as e:
+        print(f"Ошибка загрузки индекса: {e}")
+        return search_error("База знаний недоступна", 503)
+
+    try:
+        start = time.perf_counter()
+        query_embeddings = await embedding_cache.aembed_many(queries)
+        embed_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        results, documents, distances = await run_in_search_executor(
+            search_hits_batch, index, queries, query_embeddings, request.k
+        )
+        search_ms = (time.perf_counter() - start) * 1000
+    except CircuitOpenError:
+        return search_error("Сервис эмбеддингов временно недоступен", 503)
+    except Exception as e:
+        print(f"Ошибка поиска: {e}")
+        traceback.print_exc()
+        return search_error(f"Ошибка поиска: {str(e)}", 500)
+
+    response = []
+    for query, fused, query_distances in zip(queries, results, distances):
+        hits = []
+        for (position, score), distance in zip(fused, query_distances):
+            document = documents[position]
+            hit = {
+                "chunk_id": position,
+                "score": round(score, 6),
+                "distance": round(float(distance), 6),
+                "source": document.metadata.get("source", ""),
+                "file": document.metadata.get("file", ""),
+            }
+            if request.include_content:
+                hit["content"] = document.page_content
+            hits.append(hit)
+        response.append({"query": query, "hits": hits})
+
+    return {
+        "status": "success",
+        "index_version": index.version,
+        "k": request.k,
+        "embedding_ms": round(embed_ms, 1),
+        "search_ms": round(search_ms, 1),
+        "results": response,
+    }
 
 
 @app.get("/last-updated")
@@ -0,0 +1,137 @@
+"""
+Карта ссылок на стандарты и нормативные акты.
+
+build_index_local.py сопоставляет каждому документу корпуса идентификаторы по имени файла
+("ias-36-impairment-of-assets-ru.pdf" -> "ias 36", "Правила риски 188.rus.docx" -> "reg 188",
+"Закон о банках.docx" -> "law банк") и сохраняет диапазоны позиций его чанков в FAISS.
+main.py находит такие идентификаторы в вопросе и ищет только среди чанков этих документов.
+
+Формат на диске (reference_map.json): {"ias 36": [[начало, конец), ...], ...}
+"""
+
+import os
+import re
+import json
+
+import numpy as np
+
+from lexical_index import stem_russian
+
+REFERENCE_MAP_FILE = "reference_map.json"
+
+# Идентификаторы в именах файлов
+_FILE_STANDARD = re.compile(r"^(ias|ifrs|ifric|sic)-(\d+)-", re.IGNORECASE)
+_FILE_STANDARD_RU = re.compile(r"\((ifrs|ias)\)\s*(\d+)", re.IGNORECASE)
+_FILE_NUMBER = re.compile(r"(?:^|[\s_])(\d+)(?:\.|$)")
+_FILE_LAW = re.compile(r"^(?:закон|зн)\s+(?:о|об)\s+([а-яё]+)", re.IGNORECASE)
+
+# Идентификаторы в вопросах пользователей
+_QUERY_STANDARD = re.compile(r"\b(ias|ifrs|ifric|sic)\s*(\d+)", re.IGNORECASE)
+_QUERY_MSFO_TYPED = re.compile(r"\bмсфо\s*\(\s*(ifrs|ias)\s*\)\s*(\d+)", re.IGNORECASE)
+_QUERY_MSFO = re.compile(r"\bмсфо\s*(\d+)", re.IGNORECASE)
+_QUERY_MSBU = re.compile(r"\bмсбу\s*(\d+)", re.IGNORECASE)
+_QUERY_KRMFO = re.compile(r"\bкрмфо\s*(?:\(\s*ifric\s*\)\s*)?(\d+)", re.IGNORECASE)
+_QUERY_REGULATION = re.compile(r"\b(?:правил[а-яё]*|постановлени[а-яё]*)\s*(?:№\s*)?(\d+)", re.IGNORECASE)
+_QUERY_LAW = re.compile(r"\b(?:закон[а-яё]*|зн)\s+(?:о|об)\s+([а-яё]+)", re.IGNORECASE)
+
+
+def references_from_filename(filename):
+    """Возвращает множество идентификаторов документа по имени его файла"""
+    name = os.path.basename(filename)
+    keys = set()
+
+    match = _FILE_STANDARD.match(name)
+    if match:
+        keys.add(f"{match.group(1).lower()} {int(match.group(2))}")
+        return keys
+
+    match = _FILE_STANDARD_RU.search(name)
+    if match:
+        keys.add(f"{match.group(1).lower()} {int(match.group(2))}")
+        return keys
+
+    match = _FILE_LAW.match(name)
+    if match:
+        keys.add(f"law {stem_russian(match.group(1).lower())}")
+
+    stem = name.split(".")[0]
+    match = _FILE_NUMBER.search(stem)
+    if match:
+        keys.add(f"reg {int(match.group(1))}")
+    return keys
+
+
+def references_from_query(text):
+    """Возвращает список вариантов ссылок из вопроса.
+
+    Каждый вариант - кортеж равноценных ключей: "МСФО 16" чаще всего означает IFRS 16,
+    но может означать и IAS 16, поэтому используется первый ключ, который есть в карте.
+    """
+    found = []
+    for match in _QUERY_STANDARD.finditer(text):
+        found.append((f"{match.group(1).lower()} {int(match.group(2))}",))
+    for match in _QUERY_MSFO_TYPED.finditer(text):
+        found.append((f"{match.group(1).lower()} {int(match.group(2))}",))
+    typed_spans = [match.span() for match in _QUERY_MSFO_TYPED.finditer(text)]
+    for match in _QUERY_MSFO.finditer(text):
+        if not any(start <= match.start() < end for start, end in typed_spans):
+            number = int(match.group(1))
+            found.append((f"ifrs {number}", f"ias {number}"))
+    for match in _QUERY_MSBU.finditer(text):
+        found.append((f"ias {int(match.group(1))}",))
+    for match in _QUERY_KRMFO.finditer(text):
+        found.append((f"ifric {int(match.group(1))}",))
+    for match in _QUERY_REGULATION.finditer(text):
+        found.append((f"reg {int(match.group(1))}",))
+    for match in _QUERY_LAW.finditer(text):
+        found.append((f"law {stem_russian(match.group(1).lower())}",))
+    return found
+
+
+def build_reference_map(chunk_files):
+    """Строит карту по списку имен файлов чанков в порядке их позиций в FAISS.
+
+    Чанки одного файла идут подряд, поэтому для каждого документа хранится диапазон.
+    """
+    ranges = {}
+    start = 0
+    for position in range(1, len(chunk_files) + 1):
+        if position == len(chunk_files) or chunk_files[position] != chunk_files[start]:
+            for key in references_from_filename(chunk_files[start]):
+                ranges.setdefault(key, []).append([start, position])
+            start = position
+    return ranges
+
+
+class ReferenceMap:
+    """Карта идентификаторов на диапазоны позиций чанков"""
+
+    def __init__(self, ranges):
+        self.ranges = ranges
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.ranges, f, ensure_ascii=False, indent=2, sort_keys=True)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def match(self, text):
+        """Возвращает ключи из вопроса, найденные в карте"""
+        keys = []
+        for variants in references_from_query(text):
+            for key in variants:
+                if key in self.ranges:
+                    if key not in keys:
+                        keys.append(key)
+                    break
+        return keys
+
+    def positions(self, keys):
+        """Возвращает отсортированный массив позиций чанков для указанных ключей"""
+        parts = [np.arange(start, end, dtype=np.int64) for key in keys for start, end in self.ranges[key]]
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(parts))
@@ -0,0 +1,549 @@
+"""
+Хранение истории диалогов по сессиям.
+
+Все хранилища реализуют один интерфейс: history(session_id), append(session_id, вопрос, ответ),
+clear(session_id), expire(), stats(), close(). Выбор - create_session_store(backend, ...):
+    memory - в памяти процесса; история теряется при перезапуске и не видна другим воркерам
+    sqlite - файл SQLite (например, на диске /data), общий для воркеров и переживает деплой
+    redis  - сервер с протоколом Redis (Redis, Valkey, KeyDB), истечение сессий через TTL ключей;
+             число сессий - по отсортированному множеству активности (ZCARD)
+
+MemorySessionStore держит сессии в OrderedDict в порядке последней активности: каждое обращение
+переносит сессию в конец, поэтому устаревшие сессии всегда в начале. expire() снимает их с начала
+по одной и останавливается на первой живой сессии - стоимость зависит от числа удаляемых сессий,
+а не от общего числа. Общий объем истории ограничен max_bytes: при превышении удаляются
+сессии, к которым дольше всего не обращались (LRU).
+
+SQLite и Redis пишут с задержкой (write-behind): append() и отметка активности только кладут
+изменение в очередь, фоновый поток записывает накопленное одной транзакцией (пакетом) раз
+в flush_interval секунд. history() читает хранилище и добавляет еще не записанные шаги своего
+процесса, поэтому ответ на следующий вопрос в том же воркере видит всю историю. Если запись
+не удалась, изменения возвращаются в очередь, но не больше max_pending сессий: самые давние
+изменения отбрасываются и учитываются в stats()["dropped"].
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from itertools import islice
+
+DEFAULT_MAX_AGE = 86400  # 24 часа
+DEFAULT_MAX_TURNS = 15
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_EXPIRE_BATCH = 1000  # не больше стольких сессий за один вызов expire()
+DEFAULT_FLUSH_INTERVAL = 0.2  # секунд между фоновыми записями
+DEFAULT_FLUSH_BATCH = 500  # сессий в очереди, при которых запись начинается сразу
+DEFAULT_EXPIRE_INTERVAL = 60  # секунд между очистками устаревших сессий в SQLite
+DEFAULT_MAX_PENDING = 10000  # сессий в очереди записи, пока хранилище недоступно
+DEFAULT_REDIS_PREFIX = "rag:session:"
+
+SESSION_BACKENDS = ["memory", "sqlite", "redis"]
+
+
+class Turn:
+    """Вопрос и ответ одного шага диалога; распаковывается как пара (вопрос, ответ)"""
+
+    __slots__ = ("question", "answer")
+
+    def __init__(self, question, answer):
+        self.question = question
+        self.answer = answer
+
+    def __iter__(self):
+        yield self.question
+        yield self.answer
+
+    def size(self):
+        """Примерный объем в памяти, байт"""
+        return sys.getsizeof(self) + sys.getsizeof(self.question) + sys.getsizeof(self.answer)
+
+    def to_json(self):
+        return json.dumps([self.question, self.answer], ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, data):
+        question, answer = json.loads(data)
+        return cls(question, answer)
+
+
+class Session:
+    __slots__ = ("turns", "last_activity", "size")
+
+    def __init__(self, last_activity):
+        self.turns = []
+        self.last_activity = last_activity
+        self.size = 0
+
+
+class MemorySessionStore:
+    """История диалогов в памяти процесса с истечением по времени и общим лимитом объема"""
+
+    def __init__(self, max_age=DEFAULT_MAX_AGE, max_turns=DEFAULT_MAX_TURNS, max_bytes=DEFAULT_MAX_BYTES,
+                 expire_batch=DEFAULT_EXPIRE_BATCH):
+        self.max_age = max_age
+        self.max_turns = max_turns
+        self.max_bytes = max_bytes
+        self.expire_batch = expire_batch
+        self._sessions = OrderedDict()  # session_id -> Session, от давних к недавним
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.expired = 0
+        self.evicted = 0
+
+    def __contains__(self, session_id):
+        return session_id in self._sessions
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _touch_locked(self, session_id, now):
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = Session(now)
+            self._sessions[session_id] = session
+        else:
+            session.last_activity = now
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def _remove_locked(self, session_id):
+        session = self._sessions.pop(session_id)
+        self._total_bytes -= session.size
+
+    def history(self, session_id):
+        """Возвращает копию истории сессии и отмечает активность; создает пустую сессию"""
+        with self._lock:
+            return list(self._touch_locked(session_id, time.time()).turns)
+
+    def append(self, session_id, question, answer):
+        """Добавляет шаг диалога; хранится не больше max_turns последних шагов"""
+        turn = Turn(question, answer)
+        with self._lock:
+            session = self._touch_locked(session_id, time.time())
+            session.turns.append(turn)
+            added = turn.size()
+            session.size += added
+            self._total_bytes += added
+            while len(session.turns) > self.max_turns:
+                removed = session.turns.pop(0).size()
+                session.size -= removed
+                self._total_bytes -= removed
+            self._evict_locked(keep=session_id)
+
+    def clear(self, session_id):
+        """Очищает историю сессии; возвращает False, если сессии нет"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return False
+            self._total_bytes -= session.size
+            session.turns = []
+            session.size = 0
+            return True
+
+    def expire(self, now=None):
+        """Удаляет устаревшие сессии с начала очереди; возвращает число удаленных"""
+        now = now if now is not None else time.time()
+        removed = 0
+        with self._lock:
+            while self._sessions and removed < self.expire_batch:
+                session_id, session = next(iter(self._sessions.items()))
+                if now - session.last_activity <= self.max_age:
+                    break
+                self._remove_locked(session_id)
+                removed += 1
+        self.expired += removed
+        return removed
+
+    def _evict_locked(self, keep=None):
+        """Удаляет самые давние сессии, пока общий объем больше max_bytes"""
+        while self._total_bytes > self.max_bytes and len(self._sessions) > 1:
+            session_id = next(iter(self._sessions))
+            if session_id == keep:
+                break
+            self._remove_locked(session_id)
+            self.evicted += 1
+
+    def close(self):
+        pass
+
+    def stats(self):
+        return {
+            "sessions": len(self._sessions),
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "backend": "memory",
+        }
+
+
+class PendingSession:
+    """Изменения сессии, еще не записанные в хранилище"""
+
+    __slots__ = ("cleared", "turns", "last_activity")
+
+    def __init__(self, last_activity):
+        self.cleared = False
+        self.turns = []
+        self.last_activity = last_activity
+
+
+class WriteBehindSessionStore:
+    """Общая часть постоянных хранилищ: очередь изменений и фоновый поток записи.
+
+    Наследники реализуют _load(session_id), _exists(session_id), _write(batch), _expire(now) и _count().
+    """
+
+    backend = None
+
+    def __init__(self, max_age=DEFAULT_MAX_AGE, max_turns=DEFAULT_MAX_TURNS,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, flush_batch=DEFAULT_FLUSH_BATCH,
+                 expire_interval=DEFAULT_EXPIRE_INTERVAL, max_pending=DEFAULT_MAX_PENDING):
+        self.max_age = max_age
+        self.max_turns = max_turns
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.expire_interval = expire_interval
+        self.max_pending = max_pending
+        self._pending = {}  # session_id -> PendingSession, ожидают записи
+        self._flushing = {}  # пакет, который сейчас записывается
+        self._generation = 0  # увеличивается после каждой записанной пачки
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._thread_pid = None
+        self._stopping = False
+        self._expire_at = None  # момент, на который поток записи должен удалить устаревшие сессии
+        self._last_expire = 0
+        self.flushes = 0
+        self.flushed_sessions = 0
+        self.flush_errors = 0
+        self.dropped = 0
+        self.expired = 0
+
+    def _ensure_thread_locked(self):
+        """Поток записи текущего процесса: после fork (gunicorn --preload) запускается заново"""
+        if self._thread is None or self._thread_pid != os.getpid():
+            self._thread = threading.Thread(target=self._run, name=f"session-{self.backend}-writer", daemon=True)
+            self._thread_pid = os.getpid()
+            self._thread.start()
+
+    def _pending_locked(self, session_id, now):
+        entry = self._pending.get(session_id)
+        if entry is None:
+            entry = PendingSession(now)
+            self._pending[session_id] = entry
+        else:
+            entry.last_activity = now
+        self._ensure_thread_locked()
+        if len(self._pending) >= self.flush_batch:
+            self._wakeup.set()
+        return entry
+
+    def _overlay_locked(self, session_id, turns):
+        """Накладывает незаписанные изменения сессии на прочитанную из хранилища историю"""
+        for batch in (self._flushing, self._pending):
+            entry = batch.get(session_id)
+            if entry is not None:
+                if entry.cleared:
+                    turns = []
+                turns = turns + entry.turns
+        return turns[-self.max_turns:]
+
+    def history(self, session_id):
+        """Возвращает историю сессии и отмечает активность"""
+        while True:
+            with self._lock:
+                generation = self._generation
+            turns = self._load(session_id)
+            with self._lock:
+                # Если пока шло чтение записалась пачка, чтение могло не увидеть ее изменений
+                if generation != self._generation:
+                    continue
+                turns = self._overlay_locked(session_id, turns)
+                self._pending_locked(session_id, time.time())
+                return turns
+
+    def append(self, session_id, question, answer):
+        """Ставит шаг диалога в очередь записи; не ждет хранилища"""
+        with self._lock:
+            entry = self._pending_locked(session_id, time.time())
+            entry.turns.append(Turn(question, answer))
+            del entry.turns[:-self.max_turns]
+
+    def clear(self, session_id):
+        """Очищает историю сессии; возвращает False, если сессии нет"""
+        with self._lock:
+            known = session_id in self._pending or session_id in self._flushing
+        if not known and not self._exists(session_id):
+            return False
+        with self._lock:
+            entry = self._pending_locked(session_id, time.time())
+            entry.cleared = True
+            entry.turns = []
+        return True
+
+    def expire(self, now=None):
+        """Просит фоновый поток удалить устаревшие сессии (не чаще expire_interval); возвращает 0"""
+        now = now if now is not None else time.time()
+        if now - self._last_expire >= self.expire_interval:
+            self._last_expire = now
+            with self._lock:
+                self._expire_at = now
+                self._ensure_thread_locked()
+            self._wakeup.set()
+        return 0
+
+    def flush(self):
+        """Записывает накопленные изменения; возвращает число записанных сессий"""
+        with self._lock:
+            if not self._pending or self._flushing:
+                return 0
+            self._flushing, self._pending = self._pending, {}
+            batch = self._flushing
+        try:
+            self._write(batch)
+            self.flushes += 1
+            self.flushed_sessions += len(batch)
+        except Exception as e:
+            self.flush_errors += 1
+            print(f"Ошибка записи истории сессий ({self.backend}): {e}")
+            # Возвращаем изменения в начало очереди; более новые изменения тех же сессий остаются поверх
+            with self._lock:
+                requeued = {}
+                for session_id, entry in batch.items():
+                    newer = self._pending.get(session_id)
+                    if newer is not None:
+                        if newer.cleared:
+                            continue
+                        entry.turns = (entry.turns + newer.turns)[-self.max_turns:]
+                        entry.last_activity = newer.last_activity
+                        del self._pending[session_id]
+                    requeued[session_id] = entry
+                requeued.update(self._pending)
+                self._pending = requeued
+                self._flushing = {}
+                self._drop_oldest_locked()
+            return 0
+        with self._lock:
+            self._flushing = {}
+            self._generation += 1
+        return len(batch)
+
+    def _drop_oldest_locked(self):
+        """Отбрасывает самые давние изменения, если в очереди больше max_pending сессий"""
+        excess = len(self._pending) - self.max_pending
+        if excess > 0:
+            for session_id in list(islice(self._pending, excess)):
+                del self._pending[session_id]
+            self.dropped += excess
+            print(f"Очередь записи истории сессий ({self.backend}) переполнена: отброшено {excess} сессий")
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            expire_at, self._expire_at = self._expire_at, None
+            if expire_at is not None:
+                try:
+                    self.expired += self._expire(expire_at)
+                except Exception as e:
+                    print(f"Ошибка очистки устаревших сессий ({self.backend}): {e}")
+
+    def close(self):
+        """Останавливает поток записи и записывает оставшиеся изменения"""
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None and self._thread_pid == os.getpid():
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending) + len(self._flushing)
+        try:
+            sessions = self._count()
+        except Exception:
+            sessions = None
+        return {
+            "backend": self.backend,
+            "sessions": sessions,
+            "pending": pending,
+            "flushes": self.flushes,
+            "flushed_sessions": self.flushed_sessions,
+            "flush_errors": self.flush_errors,
+            "dropped": self.dropped,
+            "expired": self.expired,
+        }
+
+
+class SQLiteSessionStore(WriteBehindSessionStore):
+    """История диалогов в файле SQLite; режим WAL позволяет воркерам читать во время записи"""
+
+    backend = "sqlite"
+
+    def __init__(self, path, **options):
+        super().__init__(**options)
+        self.path = path
+        self._db = None
+        self._db_pid = None
+        self._db_lock = threading.Lock()
+        with self._db_lock:
+            db = self._connection()
+            db.execute("CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, last_activity REAL NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS sessions_last_activity ON sessions (last_activity)")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS turns (id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, "
+                "question TEXT NOT NULL, answer TEXT NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS turns_session ON turns (session_id, id)")
+            db.commit()
+
+    def _connection(self):
+        """Соединение текущего процесса: после fork открывается заново"""
+        if self._db is None or self._db_pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db_pid = os.getpid()
+        return self._db
+
+    def _load(self, session_id):
+        with self._db_lock:
+            rows = self._connection().execute(
+                "SELECT question, answer FROM turns WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                (session_id, self.max_turns),
+            ).fetchall()
+        return [Turn(question, answer) for question, answer in reversed(rows)]
+
+    def _exists(self, session_id):
+        with self._db_lock:
+            return self._connection().execute(
+                "SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone() is not None
+
+    def _write(self, batch):
+        with self._db_lock:
+            db = self._connection()
+            with db:
+                db.executemany(
+                    "INSERT INTO sessions (session_id, last_activity) VALUES (?, ?) "
+                    "ON CONFLICT(session_id) DO UPDATE SET last_activity = excluded.last_activity",
+                    [(session_id, entry.last_activity) for session_id, entry in batch.items()],
+                )
+                db.executemany("DELETE FROM turns WHERE session_id = ?",
+                               [(session_id,) for session_id, entry in batch.items() if entry.cleared])
+                db.executemany(
+                    "INSERT INTO turns (session_id, question, answer) VALUES (?, ?, ?)",
+                    [(session_id, turn.question, turn.answer)
+                     for session_id, entry in batch.items() for turn in entry.turns],
+                )
+                db.executemany(
+                    "DELETE FROM turns WHERE session_id = ? AND id NOT IN "
+                    "(SELECT id FROM turns WHERE session_id = ? ORDER BY id DESC LIMIT ?)",
+                    [(session_id, session_id, self.max_turns) for session_id, entry in batch.items() if entry.turns],
+                )
+
+    def _expire(self, now):
+        """Удаляет устаревшие сессии по индексу last_activity пачками по DEFAULT_EXPIRE_BATCH"""
+        cutoff = now - self.max_age
+        removed = 0
+        while True:
+            with self._db_lock:
+                db = self._connection()
+                with db:
+                    session_ids = [row[0] for row in db.execute(
+                        "SELECT session_id FROM sessions WHERE last_activity < ? LIMIT ?",
+                        (cutoff, DEFAULT_EXPIRE_BATCH),
+                    )]
+                    db.executemany("DELETE FROM turns WHERE session_id = ?", [(sid,) for sid in session_ids])
+                    db.executemany("DELETE FROM sessions WHERE session_id = ?", [(sid,) for sid in session_ids])
+            removed += len(session_ids)
+            if len(session_ids) < DEFAULT_EXPIRE_BATCH:
+                return removed
+
+    def _count(self):
+        with self._db_lock:
+            return self._connection().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def close(self):
+        super().close()
+        with self._db_lock:
+            if self._db is not None and self._db_pid == os.getpid():
+                self._db.close()
+            self._db = None
+
+
+class RedisSessionStore(WriteBehindSessionStore):
+    """История диалогов в Redis: список JSON-пар на сессию, истечение через TTL ключа.
+
+    Время последней активности сессий хранится в отсортированном множестве activity_key: по нему
+    считается число сессий и снимаются сессии, ключи которых уже удалил TTL. Имя по умолчанию
+    не начинается с prefix, поэтому не совпадет с ключом сессии.
+    client - готовый клиент с API redis-py (например, fakeredis.FakeRedis); иначе создается по url.
+    """
+
+    backend = "redis"
+
+    def __init__(self, url=None, client=None, prefix=DEFAULT_REDIS_PREFIX, activity_key=None, **options):
+        super().__init__(**options)
+        if client is None:
+            try:
+                import redis
+            except ImportError as e:
+                raise RuntimeError("Для SESSION_BACKEND=redis нужен пакет redis (pip install redis)") from e
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.client = client
+        self.prefix = prefix
+        self.activity_key = activity_key or f"{prefix.rstrip(':')}-activity"
+
+    def _key(self, session_id):
+        return f"{self.prefix}{session_id}"
+
+    def _load(self, session_id):
+        return [Turn.from_json(item) for item in self.client.lrange(self._key(session_id), -self.max_turns, -1)]
+
+    def _exists(self, session_id):
+        return bool(self.client.exists(self._key(session_id)))
+
+    def _write(self, batch):
+        pipeline = self.client.pipeline(transaction=False)
+        for session_id, entry in batch.items():
+            key = self._key(session_id)
+            if entry.cleared:
+                pipeline.delete(key)
+            if entry.turns:
+                pipeline.rpush(key, *[turn.to_json() for turn in entry.turns])
+                pipeline.ltrim(key, -self.max_turns, -1)
+            ttl = int(self.max_age - (time.time() - entry.last_activity))
+            pipeline.expire(key, max(ttl, 1))
+        pipeline.zadd(self.activity_key, {session_id: entry.last_activity for session_id, entry in batch.items()})
+        pipeline.execute()
+
+    def _expire(self, now):
+        # Устаревшие ключи удаляет сам Redis по TTL, здесь они снимаются с учета активности
+        return self.client.zremrangebyscore(self.activity_key, "-inf", f"({now - self.max_age}")
+
+    def _count(self):
+        return self.client.zcard(self.activity_key)
+
+
+def create_session_store(backend="memory", path=None, url=None, **options):
+    """Создает хранилище истории: memory, sqlite (файл path) или redis (адрес url)"""
+    if backend == "memory":
+        for name in ("flush_interval", "flush_batch", "expire_interval", "max_pending"):
+            options.pop(name, None)
+        return MemorySessionStore(**options)
+    options.pop("max_bytes", None)  # постоянные хранилища держат в памяти только очередь записи
+    if backend == "sqlite":
+        return SQLiteSessionStore(path, **options)
+    if backend == "redis":
+        return RedisSessionStore(url, **options)
+    raise ValueError(f"Неизвестное хранилище сессий: {backend}. Допустимо: {', '.join(SESSION_BACKENDS)}")
@@ -1,4 +1,16 @@
 #!/bin/bash
 
+# Число воркеров: по умолчанию один процесс uvicorn
+WORKERS=${WEB_CONCURRENCY:-1}
+
 # Запускаем приложение
-exec uvicorn main:app --host 0.0.0.0 --port 8000 --proxy-headers
\ No newline at end of file
+if [ "$WORKERS" -gt 1 ]; then
+    # Несколько воркеров: индекс загружается один раз в мастер-процессе до fork (--preload),
+    # воркеры делят его страницы; index.faiss читается через mmap (FAISS_MMAP).
+    # После /update-index каждый воркер сам загружает новую версию (INDEX_CHECK_INTERVAL)
+    export PRELOAD_INDEX=1
+    exec gunicorn main:app --worker-class uvicorn.workers.UvicornWorker --workers "$WORKERS" \
+        --bind 0.0.0.0:8000 --preload --forwarded-allow-ips="*" --timeout 120
+else
+    exec uvicorn main:app --host 0.0.0.0 --port 8000 --proxy-headers
+fi
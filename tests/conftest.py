@@ -0,0 +1,146 @@
+"""
+Общие фикстуры тестов: небольшой индекс во временной директории и приложение main.py
+с детерминированными эмбеддингами и поддельной LLM вместо OpenAI.
+
+Запуск: pip install -r requirements-dev.txt && python -m pytest -q
+"""
+
+import os
+import sys
+import asyncio
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+os.environ.setdefault("SESSION_BACKEND", "memory")
+
+from langchain_core.documents import Document  # noqa: E402
+from langchain_core.embeddings import Embeddings  # noqa: E402
+from langchain_core.messages import AIMessage, AIMessageChunk  # noqa: E402
+
+import main  # noqa: E402
+from chunk_store import CHUNK_STORE_FILE, build_chunk_store  # noqa: E402
+from lexical_index import LEXICAL_INDEX_FILE, LexicalIndex  # noqa: E402
+from reference_map import REFERENCE_MAP_FILE, ReferenceMap, build_reference_map  # noqa: E402
+from session_store import create_session_store  # noqa: E402
+from tracing import TraceBuffer  # noqa: E402
+from vector_index import build_faiss_index  # noqa: E402
+
+import faiss  # noqa: E402
+
+DIMENSIONS = 16
+STANDARDS = [2, 7, 9, 12, 15, 16, 17, 36]
+
+
+def fake_vector(text):
+    """Детерминированный нормированный вектор текста"""
+    digest = hashlib.sha256(text.lower().encode()).digest()
+    vector = np.frombuffer(digest[:DIMENSIONS], dtype=np.uint8).astype(np.float32) - 127
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class FakeEmbeddings(Embeddings):
+    def __init__(self):
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        return [fake_vector(text) for text in texts]
+
+    def embed_query(self, text):
+        self.calls += 1
+        return fake_vector(text)
+
+    async def aembed_query(self, text):
+        return self.embed_query(text)
+
+
+class FakeLLM:
+    """LLM с задержкой ответа; считает вызовы"""
+
+    def __init__(self, delay=0.0, answer="Тестовый <p>ответ</p>"):
+        self.delay = delay
+        self.answer = answer
+        self.calls = 0
+
+    async def ainvoke(self, prompt):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return AIMessage(content=self.answer)
+
+    async def astream(self, prompt):
+        self.calls += 1
+        for part in self.answer.split(" "):
+            await asyncio.sleep(self.delay / 10)
+            yield AIMessageChunk(content=part + " ")
+
+
+def build_test_index(index_dir, edition="2024"):
+    """Индекс в формате build_index_local.py: FAISS, chunks.sqlite, BM25, карта ссылок и метаданные"""
+    documents = []
+    for number in STANDARDS:
+        for part in range(3):
+            documents.append(Document(
+                page_content=f"МСФО {number} (редакция {edition}), пункт {part + 1}: "
+                             f"признание и оценка по стандарту {number}.",
+                metadata={"source": f"МСФО (IFRS) {number}", "file": f"ifrs-{number}-test-ru.pdf"},
+            ))
+    vectors = np.array([fake_vector(document.page_content) for document in documents], dtype=np.float32)
+    index, params = build_faiss_index(vectors)
+    faiss.write_index(index, os.path.join(index_dir, "index.faiss"))
+    build_chunk_store(os.path.join(index_dir, CHUNK_STORE_FILE), documents)
+    LexicalIndex.build([f"{d.metadata['source']}\n{d.page_content}" for d in documents]).save(
+        os.path.join(index_dir, LEXICAL_INDEX_FILE))
+    ReferenceMap(build_reference_map([d.metadata["file"] for d in documents])).save(
+        os.path.join(index_dir, REFERENCE_MAP_FILE))
+    with open(os.path.join(index_dir, "index_metadata.json"), "w", encoding="utf-8") as f:
+        json.dump({"created_at": f"test-{edition}", "chunk_count": len(documents), "index_type": "flat",
+                   "index_params": params, "chunk_store": CHUNK_STORE_FILE}, f)
+    return documents
+
+
+@pytest.fixture
+def index_dir(tmp_path):
+    path = tmp_path / "index"
+    path.mkdir()
+    build_test_index(str(path))
+    return str(path)
+
+
+@pytest.fixture
+def new_index_dir(tmp_path):
+    """Локальный индекс следующей редакции для проверки обновления"""
+    path = tmp_path / "new_index"
+    path.mkdir()
+    build_test_index(str(path), edition="2025")
+    return str(path)
+
+
+@pytest.fixture
+def app_state(index_dir, monkeypatch):
+    """main.py на тестовом индексе с еще не загруженным хранилищем; возвращает FakeLLM"""
+    llm = FakeLLM()
+    embeddings = FakeEmbeddings()
+    monkeypatch.setattr(main, "INDEX_PATH", index_dir)
+    monkeypatch.setattr(main, "LOCAL_INDEX_PATH", index_dir)
+    monkeypatch.setattr(main, "get_llm", lambda: llm)
+    monkeypatch.setattr(main, "get_embeddings", lambda: embeddings)
+    monkeypatch.setattr(main.openai_health, "start", lambda: None)
+    monkeypatch.setattr(main.index_watcher, "start", lambda: None)
+    monkeypatch.setattr(main, "vectorstore_holder", main.VectorstoreHolder())
+    monkeypatch.setattr(main, "embedding_cache", main.EmbeddingCache(db_path=""))
+    monkeypatch.setattr(main, "answer_cache", main.AnswerCache())
+    monkeypatch.setattr(main, "answer_flights", main.SingleFlight())
+    monkeypatch.setattr(main, "ask_admission", main.AdmissionController())
+    monkeypatch.setattr(main, "request_traces", TraceBuffer())
+    monkeypatch.setattr(main, "session_store", create_session_store("memory"))
+    # Завершение TestClient останавливает пул поиска, поэтому у каждого теста свой
+    monkeypatch.setattr(main, "search_executor", ThreadPoolExecutor(2, thread_name_prefix="faiss-search"))
+    llm.embeddings = embeddings
+    return llm
@@ -0,0 +1,105 @@
+"""Контроль нагрузки /ask: лимит одновременных запросов, очередь по сессиям, 429 и 503 с Retry-After"""
+
+import asyncio
+
+import httpx
+import pytest
+
+import main
+from main import AdmissionController, AdmissionRejected
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_limits_in_flight_and_queues_the_rest():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=2, max_queue=4, max_wait=5, session_limit=5)
+        first = await controller.acquire("a")
+        second = await controller.acquire("b")
+        waiting = asyncio.create_task(controller.acquire("c"))
+        await asyncio.sleep(0.01)
+        assert not waiting.done() and controller.stats()["queued"] == 1
+
+        first.release()
+        third = await asyncio.wait_for(waiting, 1)
+        assert controller.in_flight == 2
+        second.release()
+        third.release()
+        third.release()  # повторный release не освобождает чужое место
+        assert controller.in_flight == 0
+
+    run(scenario())
+
+
+def test_session_limit_rejects_with_429():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=4, max_queue=4, max_wait=5, session_limit=2)
+        await controller.acquire("a")
+        await controller.acquire("a")
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.acquire("a")
+        assert rejected.value.status_code == 429 and rejected.value.retry_after >= 1
+        await controller.acquire("b")  # другие сессии не затронуты
+
+    run(scenario())
+
+
+def test_full_queue_and_timeout_reject_with_503():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, max_queue=1, max_wait=0.05, session_limit=5)
+        ticket = await controller.acquire("a")
+        waiting = asyncio.create_task(controller.acquire("b"))
+        await asyncio.sleep(0.01)
+        with pytest.raises(AdmissionRejected) as full:
+            await controller.acquire("c")
+        assert full.value.status_code == 503 and full.value.reason == "queue_full"
+
+        with pytest.raises(AdmissionRejected) as timeout:
+            await waiting
+        assert timeout.value.reason == "timeout"
+        assert controller.stats()["queued"] == 0
+        ticket.release()
+        assert controller.in_flight == 0
+
+    run(scenario())
+
+
+def test_queue_is_served_round_robin_by_session():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, max_queue=10, max_wait=5, session_limit=5)
+        ticket = await controller.acquire("busy")
+        order = []
+
+        async def waiter(session_id):
+            admitted = await controller.acquire(session_id)
+            order.append(session_id)
+            await asyncio.sleep(0)
+            admitted.release()
+
+        # Три вопроса сессии "a" встали в очередь раньше вопроса сессии "b"
+        tasks = [asyncio.create_task(waiter(session_id)) for session_id in ("a", "a", "a", "b")]
+        await asyncio.sleep(0.01)
+        ticket.release()
+        await asyncio.gather(*tasks)
+        assert order.index("b") < 2
+
+    run(scenario())
+
+
+def test_ask_returns_429_with_retry_after(app_state):
+    async def scenario():
+        app_state.delay = 0.3
+        async with httpx.AsyncClient(app=main.app, base_url="http://test", timeout=10) as client:
+            return await asyncio.gather(*[
+                client.post("/ask", data={"q": f"Вопрос про МСФО {number}"}, cookies={"session_id": "same"})
+                for number in (7, 9, 12)
+            ])
+
+    main.ask_admission.session_limit = 2
+    responses = run(scenario())
+    statuses = sorted(response.status_code for response in responses)
+    assert statuses == [200, 200, 429]
+    rejected = next(response for response in responses if response.status_code == 429)
+    assert int(rejected.headers["Retry-After"]) >= 1
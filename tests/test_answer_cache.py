@@ -0,0 +1,65 @@
+"""Семантический кэш ответов: близкие вопросы попадают в кэш, вопросы о другом стандарте - нет"""
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+VERSION = "v1"
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(main, "vectorstore_holder", SimpleNamespace(version=VERSION))
+    return main.AnswerCache(max_size=10, threshold=0.95)
+
+
+def vector(*values):
+    return np.array(values, dtype=np.float32)
+
+
+def test_near_duplicate_question_hits(cache):
+    cache.put("Что такое МСФО 16?", vector(1, 0, 0), "Аренда", "", VERSION)
+    entry = cache.lookup("Расскажи, что такое МСФО 16", vector(0.99, 0.05, 0), VERSION)
+    assert entry is not None and entry["answer"] == "Аренда"
+
+
+def test_different_standard_number_misses(cache):
+    cache.put("Что такое МСФО 16?", vector(1, 0, 0), "Аренда", "", VERSION)
+    # Эмбеддинги совпадают, но стандарт другой
+    assert cache.lookup("Что такое МСФО 17?", vector(1, 0, 0), VERSION) is None
+    assert cache.lookup("Что такое МСФО 16?", vector(1, 0, 0), VERSION)["answer"] == "Аренда"
+
+
+def test_different_article_number_misses(cache):
+    cache.put("Что говорит статья 5 Закона о банках?", vector(0, 1, 0), "Статья 5", "", VERSION)
+    assert cache.lookup("Что говорит статья 15 Закона о банках?", vector(0, 1, 0), VERSION) is None
+
+
+def test_matching_references_preferred_over_closer_entry(cache):
+    cache.put("Что такое МСФО 17?", vector(1, 0, 0), "Страхование", "", VERSION)
+    cache.put("Что такое МСФО 16?", vector(0.98, 0.2, 0), "Аренда", "", VERSION)
+    entry = cache.lookup("Объясни МСФО 16", vector(1, 0, 0), VERSION)
+    assert entry is not None and entry["answer"] == "Аренда"
+
+
+def test_index_version_change_clears_cache(cache):
+    cache.put("Что такое МСФО 16?", vector(1, 0, 0), "Аренда", "", VERSION)
+    assert cache.lookup("Что такое МСФО 16?", vector(1, 0, 0), "v2") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_repeated_first_question_skips_llm(app_state):
+    first = TestClient(main.app).post("/ask", data={"q": "Что такое МСФО 16?"})
+    second = TestClient(main.app).post("/ask", data={"q": "что такое  МСФО 16?"})
+    assert second.json()["answer"] == first.json()["answer"]
+    assert second.json()["sources"] == first.json()["sources"]
+    assert app_state.calls == 1
+
+    # Вопрос с историей диалога кэш не использует
+    TestClient(main.app).post("/ask", data={"q": "Что такое МСФО 16?"},
+                              cookies={"session_id": second.cookies["session_id"]})
+    assert app_state.calls == 2
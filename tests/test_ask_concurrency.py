@@ -0,0 +1,36 @@
+"""Неблокирующий /ask: одновременные вопросы ждут LLM параллельно, а не по очереди"""
+
+import time
+import asyncio
+
+import httpx
+
+import main
+
+LLM_DELAY = 0.5
+CONCURRENT_QUESTIONS = 5
+
+
+async def ask_concurrently(questions):
+    async with httpx.AsyncClient(app=main.app, base_url="http://test", timeout=30) as client:
+        return await asyncio.gather(*[
+            client.post("/ask", data={"q": question}, cookies={"session_id": f"session-{i}"})
+            for i, question in enumerate(questions)
+        ])
+
+
+def test_concurrent_asks_overlap_llm_calls(app_state):
+    # Прогрев: токенизатор и первый вызов не входят в замер
+    asyncio.run(ask_concurrently(["Что такое МСФО 2?"]))
+    app_state.delay = LLM_DELAY
+    app_state.calls = 0
+
+    questions = [f"Как применяется МСФО {number}?" for number in (7, 9, 12, 15, 16)]
+    start = time.perf_counter()
+    responses = asyncio.run(ask_concurrently(questions))
+    elapsed = time.perf_counter() - start
+
+    assert [response.status_code for response in responses] == [200] * CONCURRENT_QUESTIONS
+    assert app_state.calls == CONCURRENT_QUESTIONS
+    # Последовательная обработка заняла бы CONCURRENT_QUESTIONS * LLM_DELAY = 2.5 с
+    assert elapsed < 2 * LLM_DELAY
@@ -0,0 +1,44 @@
+"""Потоковый /ask/stream: токены ответа, затем источники и итоговый ответ как Server-Sent Events"""
+
+import json
+
+from fastapi.testclient import TestClient
+
+import main
+
+
+def read_events(response):
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        event, data = block.split("\n", 1)
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def test_stream_sends_tokens_sources_and_done(app_state):
+    app_state.answer = "Аренда <p>по МСФО 16</p>"
+    response = TestClient(main.app).post("/ask/stream", data={"q": "Что такое МСФО 16?"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    events = read_events(response)
+    names = [name for name, _ in events]
+    assert names[-2:] == ["sources", "done"] and set(names[:-2]) == {"token"}
+    streamed = "".join(data["text"] for name, data in events if name == "token")
+    assert streamed.strip() == app_state.answer
+    assert "МСФО (IFRS)" in events[-2][1]["sources"]
+    assert events[-1][1]["answer"].strip() == main.clean_answer_text(streamed).strip()
+
+    # Завершенный ответ попадает в историю сессии из cookie
+    session_id = response.cookies["session_id"]
+    assert main.session_store.history(session_id)[-1].question == "Что такое МСФО 16?"
+
+
+def test_stream_reports_llm_failure_as_error_event(app_state, monkeypatch):
+    async def failing_stream(prompt):
+        raise RuntimeError("LLM недоступна")
+        yield
+
+    monkeypatch.setattr(app_state, "astream", failing_stream)
+    response = TestClient(main.app).post("/ask/stream", data={"q": "Что такое МСФО 9?"})
+    assert [name for name, _ in read_events(response)] == ["error"]
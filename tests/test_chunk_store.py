@@ -0,0 +1,59 @@
+"""Хранилище чанков в SQLite: чтение по позиции FAISS, заголовки источников и LRU"""
+
+import os
+
+import numpy as np
+import pytest
+
+import main
+from chunk_store import CHUNK_STORE_FILE, ChunkStore, PositionIds
+
+
+def test_get_many_keeps_order_and_metadata(index_dir):
+    store = ChunkStore(os.path.join(index_dir, CHUNK_STORE_FILE))
+    assert store.count == 24
+    assert store.stats()["sources"] == 8
+
+    documents = store.get_many([5, 0, 5, 999])
+    assert [d.page_content.split(",")[0] for d in documents] == [
+        "МСФО 7 (редакция 2024)", "МСФО 2 (редакция 2024)", "МСФО 7 (редакция 2024)"]
+    assert documents[0].metadata == {"source": "МСФО (IFRS) 7", "file": "ifrs-7-test-ru.pdf"}
+    # Заголовок источника хранится один раз
+    assert documents[0].metadata["source"] is store.get(4).metadata["source"]
+    assert store.search(999) == "ID 999 not found."
+    store.close()
+
+
+def test_hot_chunks_served_from_cache(index_dir):
+    store = ChunkStore(os.path.join(index_dir, CHUNK_STORE_FILE), cache_size=2)
+    store.get_many([0, 1])
+    store.get_many([1, 2])
+    assert (store.hits, store.misses) == (1, 3)
+    assert store.stats()["cached"] == 2
+    store.get(0)  # вытеснен как самый давний
+    assert store.misses == 4
+    store.close()
+
+
+def test_vectorstore_reads_chunks_from_store(app_state):
+    vectorstore = main.vectorstore_holder.get()
+    assert isinstance(vectorstore.docstore, ChunkStore)
+    assert main.vectorstore_holder.info()["chunk_store"]["chunks"] == 24
+    index = main.vectorstore_holder.snapshot()
+    documents = main.search_index(index, "36", app_state.embeddings.embed_query("36"), k=3)
+    assert {document.metadata["source"] for document in documents} == {"МСФО (IFRS) 36"}
+
+
+def test_position_ids_are_identity_without_dict():
+    ids = PositionIds(3)
+    assert ids[np.int64(2)] == 2 and list(ids) == [0, 1, 2] and len(ids) == 3
+    assert 1 in ids and 3 not in ids and -1 not in ids and "1" not in ids
+    with pytest.raises(KeyError):
+        ids[3]
+
+
+def test_index_without_chunk_store_asks_for_rebuild(app_state, index_dir):
+    # Индекс старого формата: docstore в index.pkl, chunks.sqlite нет
+    os.remove(os.path.join(index_dir, CHUNK_STORE_FILE))
+    with pytest.raises(RuntimeError, match="build_index_local.py"):
+        main.load_vectorstore()
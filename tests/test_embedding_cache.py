@@ -0,0 +1,54 @@
+"""Кэш эмбеддингов запросов: LRU в памяти, уровень SQLite на диске и сохранение при обновлении индекса"""
+
+import asyncio
+import os
+
+import main
+
+
+def embed(cache, text):
+    return asyncio.run(cache.aembed_query(text))
+
+
+def test_normalized_query_hits_memory(app_state):
+    cache = main.EmbeddingCache(max_size=10, db_path="")
+    first = embed(cache, "Что такое МСФО 16?")
+    assert embed(cache, "  что такое   мсфо 16? ") == first
+    assert app_state.embeddings.calls == 1
+    assert cache.stats()["memory_hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_lru_evicts_least_recent(app_state):
+    cache = main.EmbeddingCache(max_size=2, db_path="")
+    for text in ("МСФО 9", "МСФО 15", "МСФО 9", "МСФО 16"):
+        embed(cache, text)
+    assert cache.stats()["size"] == 2
+    calls = app_state.embeddings.calls
+    embed(cache, "МСФО 9")
+    assert app_state.embeddings.calls == calls  # недавно использованный остался
+    embed(cache, "МСФО 15")
+    assert app_state.embeddings.calls == calls + 1
+
+
+def test_disk_tier_survives_restart(app_state, tmp_path):
+    db_path = str(tmp_path / "embedding_cache.sqlite")
+    cache = main.EmbeddingCache(db_path=db_path)
+    vector = embed(cache, "Что такое МСФО 16?")
+    cache.close()
+
+    restarted = main.EmbeddingCache(db_path=db_path)
+    assert embed(restarted, "Что такое МСФО 16?") == vector
+    assert restarted.stats()["disk_hits"] == 1 and app_state.embeddings.calls == 1
+    restarted.close()
+
+
+def test_index_update_keeps_disk_cache(app_state, new_index_dir, monkeypatch):
+    db_path = os.path.join(main.INDEX_PATH, "embedding_cache.sqlite")
+    monkeypatch.setattr(main, "EMBEDDING_CACHE_DB", db_path)
+    cache = main.EmbeddingCache(db_path=db_path)
+    embed(cache, "Что такое МСФО 16?")
+    cache.close()
+
+    monkeypatch.setattr(main, "LOCAL_INDEX_PATH", new_index_dir)
+    assert main.copy_index_to_render_storage(clear_first=True)
+    assert os.path.exists(db_path)
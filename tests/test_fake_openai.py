@@ -0,0 +1,57 @@
+"""Поддельный OpenAI-совместимый сервер benchmarks/fake_openai.py: эмбеддинги, чат, поток и ошибки"""
+
+import base64
+import json
+
+import numpy as np
+import openai
+from fastapi.testclient import TestClient
+
+import main
+from benchmarks.fake_openai import FakeOpenAIConfig, create_app
+
+
+def test_fake_openai_embeddings():
+    client = TestClient(create_app())
+    response = client.post("/v1/embeddings", json={"input": ["МСФО 16", "аренда"], "model": "text-embedding-3-small",
+                                                    "dimensions": 32})
+    data = response.json()["data"]
+    assert [len(item["embedding"]) for item in data] == [32, 32]
+    assert np.isclose(np.linalg.norm(data[0]["embedding"]), 1.0)
+
+    encoded = client.post("/v1/embeddings", json={"input": "МСФО 16", "dimensions": 32,
+                                                  "encoding_format": "base64"}).json()["data"][0]["embedding"]
+    decoded = np.frombuffer(base64.b64decode(encoded), dtype="<f4")
+    assert np.allclose(decoded, data[0]["embedding"])
+
+
+def test_fake_openai_chat_is_deterministic_and_streams():
+    client = TestClient(create_app(FakeOpenAIConfig(answer_words=5)))
+    body = {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": "Что такое МСФО 16?"}]}
+    first = client.post("/v1/chat/completions", json=body).json()["choices"][0]["message"]["content"]
+    assert first == client.post("/v1/chat/completions", json=body).json()["choices"][0]["message"]["content"]
+
+    response = client.post("/v1/chat/completions", json={**body, "stream": True})
+    lines = [line[len("data: "):] for line in response.text.split("\n\n") if line.startswith("data: ")]
+    assert lines[-1] == "[DONE]"
+    streamed = "".join(json.loads(line)["choices"][0]["delta"].get("content", "") for line in lines[:-1])
+    assert streamed == first
+    assert client.get("/_stats").json()["chat_stream"] == 1
+
+
+def test_fake_openai_control_injects_errors():
+    client = TestClient(create_app())
+    assert client.post("/_control", json={"error_rate": 1, "error_status": 429}).json()["error_rate"] == 1.0
+    response = client.post("/v1/embeddings", json={"input": "МСФО 16"})
+    assert response.status_code == 429 and response.json()["error"]["type"] == "rate_limit_exceeded"
+    assert client.post("/_control", json={"unknown": 1}).status_code == 400
+    assert client.get("/_stats").json()["errors"] == 1
+
+
+def test_query_embeddings_through_openai_client():
+    http_client = TestClient(create_app(), base_url="http://fake-openai")  # httpx.Client поверх приложения
+    client = openai.OpenAI(api_key="sk-test", base_url="http://fake-openai/v1", http_client=http_client, max_retries=0)
+    embeddings = main.QueryEmbeddings(client.embeddings, None)
+    vectors = embeddings.embed_documents(["МСФО 16", "аренда"])
+    assert len(vectors) == 2 and len(vectors[0]) == len(embeddings.embed_query("МСФО 16"))
+    assert vectors[0] == embeddings.embed_query("МСФО 16")
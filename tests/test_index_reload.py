@@ -0,0 +1,142 @@
+"""Индекс в памяти процесса: одна загрузка, подмена при обновлении во всех воркерах и привязка чанков к версии"""
+
+import os
+import shutil
+
+import faiss
+import pytest
+
+import main
+import vector_index
+from chunk_store import CHUNK_STORE_FILE, ChunkStore, ChunkStoreReplaced
+
+
+def replace_index_files(source_dir, index_dir):
+    """Копирование как в copy_index_to_render_storage: временный файл и os.replace"""
+    for name in os.listdir(source_dir):
+        temporary = os.path.join(index_dir, name + ".tmp")
+        shutil.copy2(os.path.join(source_dir, name), temporary)
+        os.replace(temporary, os.path.join(index_dir, name))
+
+
+def editions(vectorstore):
+    documents = vectorstore.docstore.get_many(range(vectorstore.index.ntotal))
+    return {document.page_content.split("редакция ")[1][:4] for document in documents}
+
+
+def test_index_loaded_once(app_state, monkeypatch):
+    loads = []
+    original = main.load_vectorstore
+
+    def counting_load():
+        loads.append(1)
+        return original()
+
+    monkeypatch.setattr(main, "load_vectorstore", counting_load)
+    vectorstore = main.vectorstore_holder.get()
+    assert main.vectorstore_holder.get() is vectorstore
+    assert len(loads) == 1
+    assert main.vectorstore_holder.info()["loaded"] is True
+
+
+def test_index_update_swaps_loaded_index(app_state, new_index_dir, monkeypatch):
+    old = main.vectorstore_holder.get()
+    old_version = main.vectorstore_holder.version
+
+    monkeypatch.setattr(main, "LOCAL_INDEX_PATH", new_index_dir)
+    assert main.update_index_from_local()
+
+    new = main.vectorstore_holder.get()
+    assert new is not old and main.vectorstore_holder.version != old_version
+    assert editions(new) == {"2025"}
+    # Запросы, взявшие прежний экземпляр, дорабатывают на нем
+    assert editions(old) == {"2024"}
+
+
+def test_index_update_reloads_once(app_state, new_index_dir, monkeypatch):
+    main.vectorstore_holder.get()
+    loads = []
+    original = main.load_vectorstore
+
+    def counting_load():
+        loads.append(1)
+        return original()
+
+    monkeypatch.setattr(main, "load_vectorstore", counting_load)
+    monkeypatch.setattr(main, "LOCAL_INDEX_PATH", new_index_dir)
+    # Само копирование только заменяет файлы и не трогает загруженный индекс
+    assert main.copy_index_to_render_storage(clear_first=True)
+    assert loads == []
+    assert main.update_index_from_local()
+    assert len(loads) == 1
+    assert editions(main.vectorstore_holder.get()) == {"2025"}
+
+
+def test_mapped_index_survives_update(app_state, index_dir, new_index_dir, monkeypatch):
+    # Индекс в формате build_index_local.py --mmap: flat как IVF1, векторы читаются через mmap
+    path = os.path.join(index_dir, "index.faiss")
+    flat = faiss.read_index(path)
+    vectors = flat.reconstruct_n(0, flat.ntotal)
+    mapped_layout, _ = vector_index.build_faiss_index(vectors, mmap=True)
+    faiss.write_index(mapped_layout, path)
+    monkeypatch.setattr(main, "FAISS_MMAP", True)
+
+    old = main.vectorstore_holder.get()
+    assert vector_index.is_mmap_compatible(old.index)
+    expected = old.index.search(vectors[:3], 3)[1]
+
+    monkeypatch.setattr(main, "LOCAL_INDEX_PATH", new_index_dir)
+    assert main.update_index_from_local()
+    # Файл заменен через rename, отображенные страницы прежнего индекса не обрезаны
+    assert (old.index.search(vectors[:3], 3)[1] == expected).all()
+    assert editions(main.vectorstore_holder.get()) == {"2025"}
+
+
+def test_chunk_store_reconnect_refuses_replaced_file(index_dir, new_index_dir):
+    store = ChunkStore(os.path.join(index_dir, CHUNK_STORE_FILE))
+    assert "редакция 2024" in store.get(0).page_content
+
+    replace_index_files(new_index_dir, index_dir)
+    # Открытое соединение продолжает читать свою версию файла
+    assert "редакция 2024" in store.get(1).page_content
+
+    # Новый процесс (fork) открывает файл заново: новая таблица со старым FAISS недопустима
+    store._db_pid = -1
+    with pytest.raises(ChunkStoreReplaced):
+        store.get(2)
+
+
+def test_chunk_store_reconnect_after_fork_without_update(index_dir):
+    store = ChunkStore(os.path.join(index_dir, CHUNK_STORE_FILE))
+    store._db_pid = -1
+    assert "редакция 2024" in store.get(0).page_content
+
+
+def test_watcher_reloads_index_updated_by_another_worker(app_state, index_dir, new_index_dir):
+    main.vectorstore_holder.get()
+    watcher = main.IndexVersionWatcher(interval=0)
+    old_version = main.vectorstore_holder.version
+    assert watcher.check() is False
+
+    replace_index_files(new_index_dir, index_dir)
+    assert watcher.check() is True
+    assert main.vectorstore_holder.version != old_version
+    assert watcher.reloads == 1
+
+    index = main.vectorstore_holder.snapshot()
+    assert all("редакция 2025" in document.page_content for document in index.documents([0, 5, 10]))
+
+
+def test_watcher_waits_for_copy_to_finish(app_state, index_dir, new_index_dir):
+    main.vectorstore_holder.get()
+    watcher = main.IndexVersionWatcher(interval=0)
+    old_version = main.vectorstore_holder.version
+    lock_file = os.path.join(index_dir, "index_building.lock")
+    with open(lock_file, "w") as f:
+        f.write("copy in progress")
+    replace_index_files(new_index_dir, index_dir)
+    assert watcher.check() is False
+    assert main.vectorstore_holder.version == old_version
+
+    os.remove(lock_file)
+    assert watcher.check() is True
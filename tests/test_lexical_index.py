@@ -0,0 +1,44 @@
+"""Лексический индекс BM25: токенизация с основами слов и ссылками, поиск и слияние с FAISS"""
+
+import lexical_index
+from lexical_index import LexicalIndex, reciprocal_rank_fusion, tokenize
+
+import main
+
+TEXTS = [
+    "МСФО (IFRS) 16 Аренда: арендатор признает обязательство по аренде",
+    "МСФО (IAS) 36 Обесценение активов: возмещаемая сумма",
+    "Правила 188 о системе управления рисками банка",
+    "МСФО (IFRS) 9 Финансовые инструменты: ожидаемые кредитные убытки",
+]
+
+
+def test_tokenize_stems_words_and_keeps_references():
+    assert tokenize("аренды")[0] == tokenize("аренде")[0]
+    tokens = tokenize("Обесценение по IAS 36 и Правила 188")
+    assert "ias_36" in tokens and "36" in tokens
+    assert any(token.endswith("_188") for token in tokens)
+
+
+def test_search_ranks_exact_reference_first(tmp_path):
+    index = LexicalIndex.build(TEXTS)
+    assert index.search("IAS 36", k=2)[0][0] == 1
+    assert index.search("обязательства по аренде", k=1)[0][0] == 0
+    assert index.search("несуществующеслово") == []
+
+    path = str(tmp_path / lexical_index.LEXICAL_INDEX_FILE)
+    index.save(path)
+    loaded = LexicalIndex.load(path)
+    assert loaded.search("Правилам 188", k=1) == index.search("Правилам 188", k=1)
+
+
+def test_reciprocal_rank_fusion():
+    assert reciprocal_rank_fusion([[1, 2, 3], [3, 1]], k=60) == [1, 3, 2]
+
+
+def test_hybrid_search_uses_lexical_index(app_state):
+    index = main.vectorstore_holder.snapshot()
+    assert main.vectorstore_holder.info()["lexical_index"] is True
+    # Число 36 есть только в чанках МСФО 36, поэтому BM25 поднимает их над случайными соседями FAISS
+    docs = main.search_index(index, "36", app_state.embeddings.embed_query("36"), k=3)
+    assert [doc.metadata["source"] for doc in docs] == ["МСФО (IFRS) 36"] * 3
@@ -0,0 +1,59 @@
+"""Нагрузочный тест benchmarks/load_test.py: разбор Server-Timing, сводка прогона и прогон по приложению"""
+
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+
+import main
+from benchmarks import load_test
+
+
+def test_parse_server_timing():
+    header = 'embedding;dur=12.5, search;desc="FAISS";dur=3.0, llm;dur=900, total;dur=920.4'
+    assert load_test.parse_server_timing(header) == {"embedding": 12.5, "search": 3.0, "llm": 900.0, "total": 920.4}
+    assert load_test.parse_server_timing(None) == {}
+
+
+def test_percentiles():
+    assert load_test.percentiles([]) is None
+    stats = load_test.percentiles(list(range(1, 101)))
+    assert stats["p50"] == 50.5 and stats["p99"] == 99.0
+    assert stats["max"] == 100 and stats["count"] == 100
+
+
+def test_summarize_counts_only_successful_latencies():
+    results = [
+        {"latency_ms": 100, "status": 200, "stages": {"llm": 80, "total": 95}},
+        {"latency_ms": 300, "status": 200, "stages": {"llm": 250}},
+        {"latency_ms": 5, "status": 429, "stages": {"total": 1}},
+        {"latency_ms": 10000, "status": "ReadTimeout", "stages": {}},
+    ]
+    summary = load_test.summarize(results, elapsed=2.0)
+    assert summary["requests"] == 4 and summary["ok"] == 2
+    assert summary["throughput_rps"] == 1.0 and summary["error_rate"] == 0.5
+    assert summary["statuses"] == {"200": 2, "429": 1, "ReadTimeout": 1}
+    assert summary["latency_ms"]["max"] == 300
+    assert list(summary["stages_ms"]) == ["llm", "total"]
+    assert summary["stages_ms"]["total"]["count"] == 1
+
+
+def test_load_conversations_from_corpus():
+    conversations = load_test.load_conversations(load_test.DEFAULT_QUESTIONS)
+    assert conversations and all(conversation and conversation[0] for conversation in conversations)
+    assert any(len(conversation) > 1 for conversation in conversations)
+
+
+def test_closed_loop_against_app(app_state):
+    args = SimpleNamespace(seed=1, requests=6, duration=0, concurrency=2, rate=0, warmup=1)
+
+    async def scenario():
+        async with httpx.AsyncClient(app=main.app, base_url="http://test", timeout=10) as client:
+            run = load_test.LoadRun(client, "http://test", [["Что такое МСФО 16?", "А МСФО 9?"]], args)
+            elapsed = await run.run()
+            return load_test.summarize(run.results, elapsed)
+
+    summary = asyncio.run(scenario())
+    assert summary["requests"] == 6 and summary["ok"] == 6
+    assert "total" in summary["stages_ms"]
+
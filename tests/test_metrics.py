@@ -0,0 +1,57 @@
+"""Метрики Prometheus: текстовый формат реестра и /metrics после вопроса /ask"""
+
+import re
+
+import main
+from fastapi.testclient import TestClient
+from metrics import Registry
+
+
+def sample(text, name, labels=""):
+    match = re.search(rf"^{re.escape(name + labels)} (\S+)$", text, re.MULTILINE)
+    return float(match.group(1)) if match else None
+
+
+def test_registry_renders_prometheus_text():
+    registry = Registry()
+    requests = registry.counter("test_requests_total", "Запросы", ["path"])
+    seconds = registry.histogram("test_seconds", "Время", buckets=(0.1, 1))
+    registry.collector(lambda: [("test_sessions", "gauge", "Сессии", [({"backend": "memory"}, 3), ({}, None)])])
+    requests.inc(path="/ask")
+    requests.inc(2, path="/ask")
+    seconds.observe(0.05)
+    seconds.observe(0.5)
+    seconds.observe(5)
+
+    text = registry.render()
+    assert "# TYPE test_requests_total counter" in text
+    assert sample(text, "test_requests_total", '{path="/ask"}') == 3
+    # Корзины гистограммы накопительные
+    assert sample(text, "test_seconds_bucket", '{le="0.1"}') == 1
+    assert sample(text, "test_seconds_bucket", '{le="1"}') == 2
+    assert sample(text, "test_seconds_bucket", '{le="+Inf"}') == 3
+    assert sample(text, "test_seconds_count") == 3
+    assert sample(text, "test_sessions", '{backend="memory"}') == 3
+    assert "test_sessions NaN" not in text  # значения None не выводятся
+
+
+def test_metrics_after_ask(app_state):
+    with TestClient(main.app) as client:
+        before = client.get("/metrics").text
+        assert client.post("/ask", data={"q": "Что такое МСФО 16?"}).status_code == 200
+        response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+
+    def delta(name, labels=""):
+        return (sample(text, name, labels) or 0) - (sample(before, name, labels) or 0)
+
+    assert delta("rag_http_requests_total", '{path="/ask",status="200"}') == 1
+    for stage in ("embedding", "search", "prompt", "llm"):
+        assert delta("rag_stage_duration_seconds_count", f'{{stage="{stage}"}}') == 1
+    assert sample(text, "rag_index_loaded") == 1
+    assert sample(text, "rag_index_vectors") == 24
+    assert sample(text, "rag_index_load_seconds") == main.vectorstore_holder.load_seconds >= 0
+    assert sample(text, "rag_active_sessions", '{backend="memory"}') == 1
+    assert sample(text, "rag_session_dropped_total", '{backend="memory"}') is None  # без очереди записи
@@ -0,0 +1,84 @@
+"""Общие клиенты OpenAI: повторы при 429/5xx и circuit breaker"""
+
+import asyncio
+
+import httpx
+import openai
+import pytest
+from fastapi.testclient import TestClient
+from tenacity import wait_none
+
+import main
+
+REQUEST = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+
+
+def connection_error():
+    return openai.APIConnectionError(request=REQUEST)
+
+
+class FlakyCall:
+    """Асинхронный вызов, который первые failures раз падает с заданной ошибкой"""
+
+    def __init__(self, failures, error=connection_error):
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error()
+        return "ok"
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    breaker = main.CircuitBreaker("test", failure_threshold=2, reset_timeout=30)
+    monkeypatch.setattr(main, "openai_breaker", breaker)
+    monkeypatch.setattr(main, "wait_random_exponential", lambda **kwargs: wait_none())
+    return breaker
+
+
+def test_clients_are_shared():
+    assert main.get_llm() is main.get_llm()
+    assert main.get_embeddings() is main.get_openai_clients()["embeddings"]
+    asyncio.run(main.close_openai_clients())
+
+
+def test_retryable_error_is_retried(breaker):
+    call = FlakyCall(failures=2)
+    assert asyncio.run(main.call_openai(call)) == "ok"
+    assert call.calls == 3
+    assert breaker.status() == {"state": "closed", "failures": 0}
+
+
+def test_client_error_is_not_retried(breaker):
+    call = FlakyCall(failures=1, error=lambda: ValueError("400"))
+    with pytest.raises(ValueError):
+        asyncio.run(main.call_openai(call))
+    assert call.calls == 1 and breaker.failures == 0
+
+
+def test_breaker_opens_and_half_open_probe_closes_it(breaker):
+    for _ in range(2):
+        with pytest.raises(openai.APIConnectionError):
+            asyncio.run(main.call_openai(FlakyCall(failures=10)))
+    assert breaker.state == "open"
+
+    idle = FlakyCall(failures=0)
+    with pytest.raises(main.CircuitOpenError):
+        asyncio.run(main.call_openai(idle))
+    assert idle.calls == 0
+
+    breaker.opened_at -= breaker.reset_timeout
+    assert asyncio.run(main.call_openai(idle)) == "ok"
+    assert breaker.state == "closed"
+
+
+def test_open_breaker_answers_503(app_state, breaker):
+    breaker.state = "open"
+    breaker.opened_at = main.time.time()
+    response = TestClient(main.app).post("/ask", data={"q": "Что такое МСФО 16?"})
+    assert response.status_code == 503
+    assert app_state.calls == 0
@@ -0,0 +1,58 @@
+"""Фоновая проверка OpenAI: кэширование результата и быстрый отказ /ask при недоступности"""
+
+import time
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+
+import main
+
+
+class FakeOpenAI:
+    def __init__(self, error=None):
+        self.error = error
+        self.models = SimpleNamespace(retrieve=self.retrieve)
+
+    def with_options(self, **options):
+        return self
+
+    def retrieve(self, model):
+        if self.error:
+            raise self.error
+        return {"id": model}
+
+
+def test_check_caches_result(monkeypatch):
+    monitor = main.OpenAIHealthMonitor(interval=60)
+    assert monitor.healthy is None and not monitor.is_unavailable()
+
+    monkeypatch.setattr(main, "get_openai_clients", lambda: {"sync": FakeOpenAI()})
+    assert monitor.check() is True
+    assert monitor.status()["healthy"] is True and monitor.status()["error"] is None
+
+    monkeypatch.setattr(main, "get_openai_clients", lambda: {"sync": FakeOpenAI(RuntimeError("401 invalid key"))})
+    assert monitor.check() is False
+    assert monitor.is_unavailable()
+    assert "401" in monitor.status()["error"]
+
+
+def test_missing_key_is_unhealthy(monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY")
+    monitor = main.OpenAIHealthMonitor()
+    assert monitor.check() is False
+    assert "Ключ API" in monitor.error
+
+
+def test_stale_failure_does_not_block_requests():
+    monitor = main.OpenAIHealthMonitor(interval=10)
+    monitor.healthy = False
+    monitor.checked_at = time.time() - 31
+    assert monitor.is_stale() and not monitor.is_unavailable()
+
+
+def test_ask_fails_fast_when_openai_unavailable(app_state, monkeypatch):
+    monkeypatch.setattr(main.openai_health, "healthy", False)
+    monkeypatch.setattr(main.openai_health, "checked_at", time.time())
+    response = TestClient(main.app).post("/ask", data={"q": "Что такое МСФО 16?"})
+    assert response.status_code == 503
+    assert not main.vectorstore_holder.is_loaded  # до индекса и LLM дело не дошло
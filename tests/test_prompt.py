@@ -0,0 +1,48 @@
+"""Сборка промпта в пределах бюджета токенов: приоритет лучшего документа и последних реплик"""
+
+from fastapi.testclient import TestClient
+from langchain_core.documents import Document
+
+import main
+
+
+def documents(count, words=60):
+    return [Document(page_content=f"Документ {i}: " + "признание выручки " * words, metadata={"source": f"D{i}"})
+            for i in range(count)]
+
+
+def history(count, words=40):
+    return [(f"Вопрос {i}", f"Ответ {i}: " + "оценка аренды " * words) for i in range(count)]
+
+
+def test_everything_fits_large_budget():
+    prompt, docs, stats = main.build_full_prompt("Что такое МСФО 15?", history(2), documents(3), budget=10000)
+    assert len(docs) == 3
+    assert stats["history_turns"] == "2/2" and stats["documents"] == "3/3"
+    assert "Ответ 1" in prompt and "Что такое МСФО 15?" in prompt
+
+
+def test_tight_budget_keeps_best_document_and_newest_turns():
+    relevant = documents(6)
+    turns = history(6)
+    budget = 2000
+    prompt, docs, stats = main.build_full_prompt("Как признается выручка?", turns, relevant, budget=budget)
+    assert docs == relevant[:len(docs)] and 1 <= len(docs) < 6
+    assert stats["total"] <= budget
+    assert main.count_tokens(prompt) <= budget * 1.05
+    # Из истории в промпт попадают последние реплики
+    included = int(stats["history_turns"].split("/")[0])
+    assert 0 < included < 6
+    assert f"Вопрос {5}" in prompt and "Вопрос 0" not in prompt
+
+
+def test_chunk_token_count_from_metadata():
+    doc = Document(page_content="текст " * 100, metadata={"token_count": 7})
+    assert main.doc_token_count(doc) == 7
+    assert main.doc_token_count(Document(page_content="текст")) == main.count_tokens("текст")
+
+
+def test_ask_reports_prompt_tokens(app_state):
+    response = TestClient(main.app).post("/ask", data={"q": "Что такое МСФО 16?"})
+    tokens = response.json()["prompt_tokens"]
+    assert 0 < tokens["total"] <= tokens["budget"]
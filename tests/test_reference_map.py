@@ -0,0 +1,39 @@
+"""Карта ссылок: идентификаторы стандартов и норм в именах файлов и вопросах, поиск только по ним"""
+
+import numpy as np
+
+import main
+from reference_map import ReferenceMap, build_reference_map, references_from_filename, references_from_query
+
+
+def test_references_from_filename():
+    assert references_from_filename("ias-36-impairment-of-assets-ru.pdf") == {"ias 36"}
+    assert references_from_filename("Международный стандарт (IFRS) 16 Аренда.pdf") == {"ifrs 16"}
+    assert references_from_filename("Правила риски 188.rus.docx") == {"reg 188"}
+    assert references_from_filename("Закон о банках.docx") == references_from_filename("Закон о банке.docx")
+
+
+def test_references_from_query():
+    assert references_from_query("Что такое МСФО 16?") == [("ifrs 16", "ias 16")]
+    assert references_from_query("МСФО (IAS) 36 и МСБУ 2") == [("ias 36",), ("ias 2",)]
+    assert references_from_query("требования Правил №188") == [("reg 188",)]
+    assert references_from_query("Что говорит Закон о банках?")[0][0].startswith("law банк")
+
+
+def test_map_ranges_and_match():
+    files = ["ifrs-16-ru.pdf"] * 3 + ["ias-36-ru.pdf"] * 2 + ["ifrs-16-ru.pdf"]
+    reference_map = ReferenceMap(build_reference_map(files))
+    assert reference_map.ranges["ifrs 16"] == [[0, 3], [5, 6]]
+    # МСФО 16 - это IFRS 16, если он есть в карте
+    assert sorted(reference_map.match("Аренда по МСФО 16 и IAS 36")) == ["ias 36", "ifrs 16"]
+    assert reference_map.positions(["ifrs 16"]).tolist() == [0, 1, 2, 5]
+    assert reference_map.match("МСФО 99") == []
+
+
+def test_search_restricted_to_referenced_standard(app_state):
+    index = main.vectorstore_holder.snapshot()
+    assert main.vectorstore_holder.info()["reference_map"] is True
+    question = "Как применяется МСФО 12?"
+    embedding = np.asarray(app_state.embeddings.embed_query("признание и оценка"), dtype=np.float32)
+    docs = main.search_index(index, question, embedding, k=6, question=question)
+    assert docs and {doc.metadata["source"] for doc in docs} == {"МСФО (IFRS) 12"}
@@ -0,0 +1,27 @@
+"""Поисковый запрос с учетом истории: вопрос первым, из истории только ключевые термины, длина ограничена"""
+
+import main
+
+
+def test_question_without_history_is_unchanged():
+    assert main.build_retrieval_query("  Что такое МСФО 16?  ", []) == "Что такое МСФО 16?"
+
+
+def test_follow_up_gets_references_from_history():
+    history = [("Как учитывать аренду по МСФО 16?", "Арендатор признает актив в форме права пользования. " * 30)]
+    query = main.build_retrieval_query("Как рассчитать обязательство?", history)
+    question, history_part = query.split("\n")
+    assert question == "Как рассчитать обязательство?"
+    assert "МСФО 16" in history_part and "аренду" in history_part
+    # Слова ответа в запрос не попадают, только ссылки и аббревиатуры
+    assert "пользования" not in history_part
+
+
+def test_query_is_bounded():
+    history = [(f"Вопрос про IAS {n} и Правила {n}", "ответ " * 500) for n in range(1, 40)]
+    query = main.build_retrieval_query("А если договор расторгнут?", history)
+    assert len(query) <= main.RETRIEVAL_QUERY_MAX_CHARS
+    assert len(query.split("\n")[1]) <= max(2 * len("А если договор расторгнут?"), 120)
+    # Смотрим только последние реплики, от новых к старым
+    assert "IAS 39" in query and "IAS 1 " not in query + " "
+    assert len(main.build_retrieval_query("вопрос " * 200, history)) <= main.RETRIEVAL_QUERY_MAX_CHARS
@@ -0,0 +1,47 @@
+"""Эндпоинт /search: поиск без LLM по нескольким запросам за один вызов, работа с индексом в пуле поиска"""
+
+import threading
+
+import main
+from fastapi.testclient import TestClient
+
+
+def test_search_returns_hits_with_distances(app_state):
+    with TestClient(main.app) as client:
+        response = client.post("/search", json={"queries": ["МСФО 16 аренда", "МСФО 9"], "k": 3})
+    assert response.status_code == 200
+    body = response.json()
+    assert [len(result["hits"]) for result in body["results"]] == [3, 3]
+    assert all(hit["distance"] >= 0 for result in body["results"] for hit in result["hits"])
+    assert app_state.calls == 0  # LLM не вызывается
+
+
+def test_search_embeds_all_queries_in_one_call(app_state):
+    with TestClient(main.app) as client:
+        response = client.post("/search", json={"queries": ["МСФО 2", "МСФО 7", "МСФО 2"], "k": 2})
+    assert response.status_code == 200
+    assert app_state.embeddings.calls == 1
+    assert main.embedding_cache.misses == 2  # повтор запроса в том же вызове не эмбеддится заново
+
+
+def test_search_validates_request(app_state):
+    with TestClient(main.app) as client:
+        assert client.post("/search", json={"queries": []}).status_code == 400
+        assert client.post("/search", json={"queries": ["МСФО 2", " "]}).status_code == 400
+        assert client.post("/search", json={"queries": ["МСФО 2"], "k": main.SEARCH_MAX_K + 1}).status_code == 400
+    assert app_state.embeddings.calls == 0
+
+
+def test_search_reads_index_off_event_loop(app_state, monkeypatch):
+    threads = []
+    original = main.dense_distances
+
+    def recording_dense_distances(*args):
+        threads.append(threading.current_thread().name)
+        return original(*args)
+
+    monkeypatch.setattr(main, "dense_distances", recording_dense_distances)
+    with TestClient(main.app) as client:
+        response = client.post("/search", json={"queries": ["МСФО 15"], "k": 2})
+    assert response.status_code == 200
+    assert threads and all(name.startswith("faiss-search") for name in threads)
@@ -0,0 +1,192 @@
+"""Хранилища истории сессий memory, sqlite и redis (fakeredis): чтение, запись с задержкой и истечение"""
+
+import os
+import time
+
+import fakeredis
+import pytest
+
+import main
+from session_store import MemorySessionStore, create_session_store
+
+from .conftest import build_test_index
+
+MAX_AGE = 100
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def backend(request, tmp_path):
+    """Фабрика хранилищ одного бэкенда над общими данными; запись только явным flush()"""
+    server = fakeredis.FakeServer()
+    stores = []
+
+    def open_store(**options):
+        options = {"max_age": MAX_AGE, "max_turns": 3, "flush_interval": 3600, "flush_batch": 10**6, **options}
+        if request.param == "redis":
+            options["client"] = fakeredis.FakeRedis(server=server, decode_responses=True)
+        store = create_session_store(request.param, path=str(tmp_path / "sessions.sqlite"), **options)
+        stores.append(store)
+        return store
+
+    open_store.name = request.param
+    yield open_store
+    for store in stores:
+        store.close()
+
+
+def test_round_trip_keeps_last_turns(backend):
+    store = backend()
+    assert store.history("s1") == []
+    for i in range(5):
+        store.append("s1", f"вопрос {i}", f"ответ {i}")
+    assert [tuple(turn) for turn in store.history("s1")] == [(f"вопрос {i}", f"ответ {i}") for i in (2, 3, 4)]
+    assert store.history("s2") == []
+
+
+def test_clear(backend):
+    store = backend()
+    store.append("s1", "вопрос", "ответ")
+    assert store.clear("s1") is True
+    assert store.history("s1") == []
+    assert store.clear("missing") is False
+
+
+def test_write_behind_visible_to_other_workers_after_flush(backend):
+    if backend.name == "memory":
+        pytest.skip("история в памяти не общая для процессов")
+    writer = backend()
+    reader = backend()
+    writer.append("s1", "вопрос", "ответ")
+    # Свой процесс видит незаписанный шаг, другой - только после записи
+    assert [tuple(turn) for turn in writer.history("s1")] == [("вопрос", "ответ")]
+    assert reader.history("s1") == []
+    assert writer.flush() == 1
+    assert [tuple(turn) for turn in reader.history("s1")] == [("вопрос", "ответ")]
+
+
+def test_close_flushes_and_history_survives_restart(backend):
+    if backend.name == "memory":
+        pytest.skip("история в памяти не переживает перезапуск")
+    store = backend()
+    store.append("s1", "вопрос", "ответ")
+    store.close()
+    assert [tuple(turn) for turn in backend().history("s1")] == [("вопрос", "ответ")]
+
+
+def test_background_thread_flushes(backend):
+    if backend.name == "memory":
+        pytest.skip("запись с задержкой только у постоянных хранилищ")
+    store = backend(flush_interval=0.01)
+    store.append("s1", "вопрос", "ответ")
+    assert wait_for(lambda: store.stats()["flushed_sessions"] >= 1)
+    assert [tuple(turn) for turn in backend().history("s1")] == [("вопрос", "ответ")]
+
+
+def test_expiry(backend):
+    store = backend(expire_interval=0)
+    store.append("old", "вопрос", "ответ")
+    if backend.name == "memory":
+        assert store.expire(time.time() + MAX_AGE + 1) == 1
+        assert "old" not in store
+    else:
+        store.flush()
+        if backend.name == "redis":
+            assert 0 < store.client.ttl(store._key("old")) <= MAX_AGE
+        # Поток записи удаляет сессии на переданный момент времени
+        store.expire(time.time() + MAX_AGE + 1)
+        assert wait_for(lambda: store.stats()["expired"] == 1)
+        assert store.stats()["sessions"] == 0
+
+
+def test_stats_count_sessions(backend):
+    store = backend()
+    store.append("s1", "вопрос", "ответ")
+    store.history("s2")
+    if backend.name != "memory":
+        store.flush()
+    assert store.stats()["sessions"] == 2
+    store.append("s1", "еще вопрос", "ответ")
+    if backend.name != "memory":
+        store.flush()
+    assert store.stats()["sessions"] == 2
+
+
+def test_failed_flush_keeps_at_most_max_pending_sessions(backend, monkeypatch):
+    if backend.name == "memory":
+        pytest.skip("очередь записи только у постоянных хранилищ")
+    store = backend(max_pending=3)
+    for i in range(3):
+        store.append(f"s{i}", "вопрос", "ответ")
+
+    def unavailable(batch):
+        raise ConnectionError("хранилище недоступно")
+
+    monkeypatch.setattr(store, "_write", unavailable)
+    assert store.flush() == 0
+    store.append("s3", "вопрос", "ответ")
+    store.append("s4", "вопрос", "ответ")
+    assert store.flush() == 0
+    # Отброшены самые давние изменения, новые сессии остались в очереди
+    assert store.stats()["pending"] == 3 and store.stats()["dropped"] == 2
+    assert store.history("s0") == []
+    assert [tuple(turn) for turn in store.history("s4")] == [("вопрос", "ответ")]
+
+    monkeypatch.undo()
+    assert store.flush() == 4  # s2, s3, s4 и s0, отмеченная чтением
+    assert store.stats()["flush_errors"] == 2
+
+
+def test_memory_expire_stops_at_first_live_session():
+    store = MemorySessionStore(max_age=MAX_AGE, expire_batch=2)
+    for i in range(3):
+        store.append(f"old{i}", "вопрос", "ответ")
+    now = time.time() + MAX_AGE + 1
+    store._sessions["old1"].last_activity = now  # обращение после остальных
+    store._sessions.move_to_end("old1")
+
+    assert store.expire(now) == 2  # old0 и old2; old1 еще жива
+    assert "old1" in store and len(store) == 1
+    assert store.expire(now) == 0
+    assert store.stats()["expired"] == 2
+
+
+def test_memory_store_evicts_least_recent_over_limit():
+    store = create_session_store("memory", max_bytes=3000)
+    for i in range(10):
+        store.append(f"s{i}", "вопрос " * 20, "ответ " * 20)
+    assert store.stats()["bytes"] <= 3000
+    assert store.stats()["evicted"] > 0
+    assert "s9" in store and "s0" not in store
+
+
+def test_index_update_keeps_session_database(index_dir, tmp_path, monkeypatch):
+    """/update-index очищает директорию индекса, но не базу сессий рядом с ним"""
+    local_dir = tmp_path / "local_index"
+    local_dir.mkdir()
+    build_test_index(str(local_dir), edition="2025")
+    session_db = os.path.join(index_dir, "sessions.sqlite")
+    monkeypatch.setattr(main, "INDEX_PATH", index_dir)
+    monkeypatch.setattr(main, "LOCAL_INDEX_PATH", str(local_dir))
+    monkeypatch.setattr(main, "SESSION_DB_PATH", session_db)
+
+    store = create_session_store("sqlite", path=session_db, flush_interval=3600)
+    store.append("s1", "вопрос", "ответ")
+    store.flush()
+    files_before = {name for name in os.listdir(index_dir) if name.startswith("sessions.sqlite")}
+    assert {"sessions.sqlite", "sessions.sqlite-wal", "sessions.sqlite-shm"} <= files_before
+
+    assert main.copy_index_to_render_storage(clear_first=True)
+    assert files_before <= set(os.listdir(index_dir))
+    store.close()
+    reopened = create_session_store("sqlite", path=session_db)
+    assert [tuple(turn) for turn in reopened.history("s1")] == [("вопрос", "ответ")]
+    reopened.close()
@@ -0,0 +1,95 @@
+"""Общий ответ для одинаковых одновременных вопросов /ask: один вызов LLM, свой ответ каждому запросу"""
+
+import asyncio
+
+import httpx
+
+import main
+
+
+def ask_concurrently(count, question="Что такое МСФО 16?"):
+    async def scenario():
+        async with httpx.AsyncClient(app=main.app, base_url="http://test", timeout=10) as client:
+            return await asyncio.gather(*[client.post("/ask", data={"q": question}) for _ in range(count)])
+
+    return asyncio.run(scenario())
+
+
+def test_identical_questions_share_one_llm_call(app_state):
+    app_state.delay = 0.3
+    responses = ask_concurrently(4)
+    assert [response.status_code for response in responses] == [200] * 4
+    assert app_state.calls == 1
+    assert len({response.json()["answer"] for response in responses}) == 1
+
+
+
+def test_different_questions_are_not_coalesced(app_state):
+    app_state.delay = 0.3
+
+    async def scenario():
+        async with httpx.AsyncClient(app=main.app, base_url="http://test", timeout=10) as client:
+            return await asyncio.gather(client.post("/ask", data={"q": "Что такое МСФО 16?"}),
+                                        client.post("/ask", data={"q": "Что такое МСФО 9?"}))
+
+    responses = asyncio.run(scenario())
+    assert [response.status_code for response in responses] == [200, 200]
+    assert app_state.calls == 2
+    assert main.answer_flights.stats()["followers"] == 0
+
+
+def test_shared_preparation_error_builds_response_per_request(app_state, monkeypatch):
+    original = main.prepare_question
+
+    async def slow_prepare(q, session_id, chat_history):
+        await asyncio.sleep(0.2)
+        return await original(q, session_id, chat_history)
+
+    monkeypatch.setattr(main, "prepare_question", slow_prepare)
+    monkeypatch.setattr(main.openai_health, "is_unavailable", lambda: True)
+    responses = ask_concurrently(3)
+
+    assert [response.status_code for response in responses] == [503] * 3
+    assert app_state.calls == 0
+    # У каждого запроса свой ответ: своя трассировка и cookie своей новой сессии
+    assert len({response.headers["X-Trace-Id"] for response in responses}) == 3
+    assert len({response.cookies["session_id"] for response in responses}) == 3
+
+
+def test_duplicate_of_queued_question_waits_on_leader_place(app_state, monkeypatch):
+    monkeypatch.setattr(main, "ask_admission", main.AdmissionController(max_in_flight=1, max_queue=4, max_wait=5))
+
+    async def scenario():
+        blocker = await main.ask_admission.acquire("other")
+        async with httpx.AsyncClient(app=main.app, base_url="http://test", timeout=10) as client:
+            requests = [asyncio.ensure_future(client.post("/ask", data={"q": "Что такое МСФО 16?"}))
+                        for _ in range(2)]
+            await asyncio.sleep(0.2)
+            # Первый вопрос ждет в очереди, повтор уже присоединился к нему и места не занимает
+            assert main.ask_admission.stats()["queued"] == 1
+            assert main.answer_flights.stats()["followers"] == 1
+            blocker.release()
+            return await asyncio.gather(*requests)
+
+    responses = asyncio.run(scenario())
+    assert [response.status_code for response in responses] == [200, 200]
+    assert app_state.calls == 1
+
+
+def test_cancelled_leader_keeps_place_until_shared_answer_is_ready(app_state):
+    app_state.delay = 0.3
+
+    async def scenario():
+        async with httpx.AsyncClient(app=main.app, base_url="http://test", timeout=10) as client:
+            leader = asyncio.ensure_future(client.post("/ask", data={"q": "Что такое МСФО 16?"}))
+            await asyncio.sleep(0.1)
+            leader.cancel()  # клиент закрыл соединение, пока LLM отвечает
+            await asyncio.sleep(0.05)
+            in_flight_after_cancel = main.ask_admission.in_flight
+            await asyncio.sleep(0.4)
+            return in_flight_after_cancel
+
+    assert asyncio.run(scenario()) == 1
+    assert app_state.calls == 1
+    assert main.ask_admission.in_flight == 0
+    assert main.answer_flights.stats()["in_flight"] == 0
@@ -0,0 +1,92 @@
+"""Заголовки трассировки /ask и /ask/stream: Server-Timing и X-Trace-Id у каждого ответа, трасса в буфере"""
+
+import hashlib
+
+from fastapi.testclient import TestClient
+
+import main
+from tracing import RequestTrace, TraceBuffer
+
+
+def ask(question):
+    with TestClient(main.app) as client:
+        return client.post("/ask", data={"q": question})
+
+
+def test_answer_has_trace_headers(app_state):
+    response = ask("Что такое МСФО 16?")
+    assert response.status_code == 200
+    assert "total;dur=" in response.headers["Server-Timing"]
+    trace = main.request_traces.get(response.headers["X-Trace-Id"])
+    assert trace is not None and trace["status"] == 200
+    assert {"embedding", "search", "llm"} <= set(trace["stages_ms"])
+    assert trace["chunks"]
+
+
+def test_empty_question_has_trace_headers(app_state):
+    response = ask("   ")
+    assert response.status_code == 200
+    assert response.json()["answer"] == "Пожалуйста, введите ваш вопрос."
+    assert "total;dur=" in response.headers["Server-Timing"]
+    assert main.request_traces.get(response.headers["X-Trace-Id"]) is not None
+    assert app_state.calls == 0
+
+
+def test_stream_has_trace_headers_and_records_generation(app_state):
+    with TestClient(main.app) as client:
+        response = client.post("/ask/stream", data={"q": "Что такое МСФО 16?"})
+    assert response.status_code == 200
+    assert "search;dur=" in response.headers["Server-Timing"]
+    assert "llm;dur=" not in response.headers["Server-Timing"]  # заголовки ушли до генерации
+
+    trace = main.request_traces.get(response.headers["X-Trace-Id"])
+    assert trace["path"] == "/ask/stream" and trace["status"] == 200
+    assert trace["session_id"] == response.cookies["session_id"]
+    assert {"embedding", "search", "llm", "llm_first_token", "sources"} <= set(trace["stages_ms"])
+    assert 0 < trace["first_token_ms"] <= trace["duration_ms"]
+    assert trace["stream_completed"] is True
+    assert trace["tokens"]["completion"] > 0 and trace["chunks"]
+
+
+def test_stream_llm_failure_is_traced(app_state, monkeypatch):
+    async def failing_stream(prompt):
+        raise RuntimeError("LLM недоступна")
+        yield
+
+    monkeypatch.setattr(app_state, "astream", failing_stream)
+    with TestClient(main.app) as client:
+        response = client.post("/ask/stream", data={"q": "Что такое МСФО 9?"})
+    trace = main.request_traces.get(response.headers["X-Trace-Id"])
+    assert trace["stream_error"] is True and "llm" in trace["stages_ms"]
+    assert "first_token_ms" not in trace
+
+
+def test_empty_stream_question_has_trace_headers(app_state):
+    with TestClient(main.app) as client:
+        response = client.post("/ask/stream", data={"q": "   "})
+    assert main.request_traces.get(response.headers["X-Trace-Id"])["path"] == "/ask/stream"
+
+
+def test_admin_traces_filters_by_session(app_state, monkeypatch):
+    monkeypatch.setenv("ADMIN_PASSWORD", "secret")
+    token = hashlib.sha256(b"secret").hexdigest()
+    with TestClient(main.app) as client:
+        first = client.post("/ask", data={"q": "Что такое МСФО 16?"})
+        client.cookies.clear()  # второй вопрос из другой сессии
+        client.post("/ask", data={"q": "Что такое МСФО 9?"})
+        assert client.get("/admin/traces").status_code == 403
+        body = client.get("/admin/traces", params={"session_id": first.cookies["session_id"]},
+                          headers={"admin-token": token}).json()
+    assert body["buffer"]["recorded"] == 2
+    assert [trace["trace_id"] for trace in body["traces"]] == [first.headers["X-Trace-Id"]]
+
+
+def test_trace_buffer_keeps_newest():
+    buffer = TraceBuffer(max_size=2)
+    traces = [RequestTrace("/ask", f"вопрос {i}") for i in range(3)]
+    for trace in traces:
+        trace.finish(200)
+        buffer.add(trace)
+    assert [trace["question"] for trace in buffer.recent()] == ["вопрос 2", "вопрос 1"]
+    assert buffer.get(traces[0].trace_id) is None
+    assert buffer.stats() == {"size": 2, "max_size": 2, "recorded": 3}
@@ -0,0 +1,149 @@
+"""Построение FAISS индексов: типы flat, IVF и HNSW, параметры поиска и поиск среди кандидатов"""
+
+import faiss
+import numpy as np
+import pytest
+
+import vector_index
+
+
+def random_vectors(count, dimension, seed=0):
+    return np.random.default_rng(seed).standard_normal((count, dimension)).astype(np.float32)
+
+
+def recall(index, exact, queries, k=10):
+    _, found = index.search(queries, k)
+    _, expected = exact.search(queries, k)
+    return np.mean([len(set(a) & set(b)) / k for a, b in zip(found, expected)])
+
+
+@pytest.mark.parametrize("index_type", vector_index.INDEX_TYPES)
+def test_index_types_find_nearest_neighbours(index_type):
+    vectors = random_vectors(2000, 16)
+    queries = random_vectors(20, 16, seed=1)
+    exact, _ = vector_index.build_faiss_index(vectors)
+    index, params = vector_index.build_faiss_index(vectors, index_type)
+    assert index.ntotal == 2000
+    assert vector_index.describe(index)["type"] == index_type
+    assert recall(index, exact, queries) >= 0.8
+    if index_type == "ivf":
+        assert params["nprobe"] <= params["nlist"]
+
+
+def test_configure_search_prefers_explicit_values():
+    index, params = vector_index.build_faiss_index(random_vectors(2000, 16), "ivf", nlist=32, nprobe=4)
+    vector_index.configure_search(index, params)
+    assert vector_index.describe(index)["nprobe"] == 4
+    vector_index.configure_search(index, params, nprobe=8)
+    assert vector_index.describe(index)["nprobe"] == 8
+
+    hnsw, params = vector_index.build_faiss_index(random_vectors(500, 16), "hnsw", ef_search=16)
+    vector_index.configure_search(hnsw, params, ef_search=128)
+    assert vector_index.describe(hnsw)["ef_search"] == 128
+
+
+@pytest.mark.parametrize("index_type", vector_index.INDEX_TYPES)
+def test_filtered_search_is_exact_among_candidates(index_type):
+    vectors = random_vectors(2000, 16)
+    index, _ = vector_index.build_faiss_index(vectors, index_type)
+    candidates = np.arange(100, 140)
+    query = vectors[120] + 0.01
+    found = vector_index.filtered_search(index, query, candidates, 5)
+    distances = ((vectors[candidates] - query) ** 2).sum(axis=1)
+    assert found == [int(candidates[i]) for i in np.argsort(distances)[:5]]
+    assert vector_index.filtered_search(index, query, [], 5) == []
+
+
+@pytest.mark.parametrize("codec, code_size, min_recall", [("none", 64, 1.0), ("fp16", 32, 0.95), ("int8", 16, 0.8)])
+def test_scalar_codecs_shrink_vectors(codec, code_size, min_recall):
+    vectors = random_vectors(2000, 16)
+    exact, _ = vector_index.build_faiss_index(vectors)
+    index, params = vector_index.build_faiss_index(vectors, "flat", codec)
+    assert params["codec"] == codec
+    assert vector_index.describe(index)["bytes_per_vector"] == code_size
+    assert recall(index, exact, random_vectors(20, 16, seed=1)) >= min_recall
+
+
+def test_pq_codec_bits_follow_corpus_size():
+    index, params = vector_index.build_faiss_index(random_vectors(1000, 16), "flat", "pq", pq_m=4)
+    # 1000 векторов мало для 256 центроидов: 4 подвектора по 4 бита - 2 байта
+    assert params["pq_bits"] == 4
+    assert vector_index.bytes_per_vector(index) == 2
+    assert vector_index.factory_string("hnsw", "pq", pq_m=4, vector_count=1000) == "HNSW32_PQ4"
+
+
+@pytest.mark.parametrize("dimension, expected", [(1536, 96), (3072, 96), (500, 50), (100, 50), (256, 64), (7, 7)])
+def test_default_pq_m_divides_dimension(dimension, expected):
+    assert vector_index.default_pq_m(dimension) == expected
+
+
+def test_pq_index_for_reduced_dimensions_uses_divisor():
+    # Размерность 10 не делится на DEFAULT_PQ_M = 96
+    vectors = vector_index.reduce_dimensions(random_vectors(1000, 16), 10)
+    index, params = vector_index.build_faiss_index(vectors, "flat", "pq")
+    assert params["pq_m"] == 10
+    assert index.ntotal == 1000
+
+
+def test_pq_m_not_dividing_dimension_raises():
+    with pytest.raises(ValueError, match="pq_m=96"):
+        vector_index.build_faiss_index(random_vectors(100, 100), "flat", "pq", pq_m=96)
+
+
+def test_reduce_dimensions_renormalizes():
+    vectors = random_vectors(10, 16)
+    reduced = vector_index.reduce_dimensions(vectors, 8)
+    assert reduced.shape == (10, 8)
+    assert np.allclose(np.linalg.norm(reduced, axis=1), 1.0, atol=1e-5)
+    assert vector_index.reduce_dimensions(vectors, 16).shape == (10, 16)
+    assert vector_index.reduce_dimensions(vectors, None).shape == (10, 16)
+
+
+def test_rescore_orders_candidates_by_full_vectors():
+    vectors = random_vectors(500, 16)
+    query = vectors[42] + 0.01
+    candidates = [7, 300, 42, 99, 41]
+    found = vector_index.rescore(vectors, query, candidates, 3)
+    distances = ((vectors[candidates] - query) ** 2).sum(axis=1)
+    assert found == [candidates[i] for i in np.argsort(distances)[:3]]
+    assert found[0] == 42
+    assert vector_index.rescore(vectors, query, [], 3) == []
+
+
+def test_rescoring_recovers_recall_of_reduced_index():
+    # как у text-embedding-3, основная часть нормы - в первых координатах
+    weights = np.linspace(2.0, 0.2, 16, dtype=np.float32)
+    vectors = random_vectors(2000, 16) * weights
+    queries = random_vectors(20, 16, seed=1) * weights
+    exact, _ = vector_index.build_faiss_index(vectors)
+    reduced, _ = vector_index.build_faiss_index(vector_index.reduce_dimensions(vectors, 8))
+    _, expected = exact.search(queries, 10)
+    _, candidates = reduced.search(vector_index.reduce_dimensions(queries, 8), 100)
+    rescored = [vector_index.rescore(vectors, query, found, 10) for query, found in zip(queries, candidates)]
+    rescored_recall = np.mean([len(set(a) & set(b)) / 10 for a, b in zip(rescored, expected)])
+    reduced_recall = np.mean([len(set(a[:10]) & set(b)) / 10 for a, b in zip(candidates, expected)])
+    assert rescored_recall > reduced_recall
+    assert rescored_recall >= 0.8
+
+
+def test_mmap_flat_layout_matches_exact_search(tmp_path):
+    vectors = random_vectors(2000, 16)
+    queries = random_vectors(20, 16, seed=1)
+    exact, _ = vector_index.build_faiss_index(vectors)
+    index, params = vector_index.build_faiss_index(vectors, mmap=True)
+    assert params["mmap"] and params["nlist"] == 1
+    path = str(tmp_path / "index.faiss")
+    faiss.write_index(index, path)
+
+    mapped = vector_index.read_index(path, mmap=True)
+    assert vector_index.is_mmap_compatible(mapped)
+    assert vector_index.describe(mapped)["layout"] == "ivf1"
+    _, found = mapped.search(queries, 10)
+    _, expected = exact.search(queries, 10)
+    assert (found == expected).all()
+    assert not vector_index.is_mmap_compatible(exact)
+
+
+def test_hnsw_cannot_be_mapped():
+    with pytest.raises(ValueError):
+        vector_index.build_faiss_index(random_vectors(100, 16), "hnsw", mmap=True)
@@ -0,0 +1,119 @@
+"""
+Трассировка отдельных запросов: длительность этапов, найденные чанки и токены.
+
+RequestTrace создается на запрос и становится текущим через contextvars, поэтому этапы,
+выполняемые в том же контексте (включая задачи asyncio, созданные из него), записываются
+в него без передачи параметром. По трассе формируется заголовок Server-Timing; завершенные
+трассы хранятся в TraceBuffer - кольцевом буфере фиксированного размера.
+"""
+
+import time
+import uuid
+import threading
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime
+
+DEFAULT_BUFFER_SIZE = 200
+QUESTION_PREVIEW_CHARS = 200
+
+current_trace = ContextVar("current_trace", default=None)
+
+
+class RequestTrace:
+    __slots__ = ("trace_id", "path", "session_id", "question", "started_at", "_start", "stages",
+                 "chunks", "tokens", "status", "duration", "details")
+
+    def __init__(self, path, question=None, session_id=None):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.path = path
+        self.session_id = session_id
+        self.question = question[:QUESTION_PREVIEW_CHARS] if question else question
+        self.started_at = datetime.now().isoformat()
+        self._start = time.perf_counter()
+        self.stages = []  # (этап, секунды) в порядке завершения
+        self.chunks = []
+        self.tokens = {}
+        self.status = None
+        self.duration = None
+        self.details = {}
+
+    def add_stage(self, name, seconds):
+        self.stages.append((name, seconds))
+
+    def stage_totals(self):
+        """Суммарное время по этапам; этап может повторяться (например, несколько вызовов)"""
+        totals = {}
+        for name, seconds in self.stages:
+            totals[name] = totals.get(name, 0.0) + seconds
+        return totals
+
+    def elapsed(self):
+        """Секунды с начала запроса"""
+        return time.perf_counter() - self._start
+
+    def finish(self, status):
+        self.status = status
+        self.duration = self.elapsed()
+
+    def server_timing(self):
+        """Значение заголовка Server-Timing, длительности в миллисекундах"""
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stage_totals().items()]
+        total = self.duration if self.duration is not None else self.elapsed()
+        parts.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(parts)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "path": self.path,
+            "session_id": self.session_id,
+            "question": self.question,
+            "started_at": self.started_at,
+            "status": self.status,
+            "duration_ms": round(self.duration * 1000, 1) if self.duration is not None else None,
+            "stages_ms": {name: round(seconds * 1000, 1) for name, seconds in self.stage_totals().items()},
+            "chunks": self.chunks,
+            "tokens": self.tokens,
+            **self.details,
+        }
+
+
+class TraceBuffer:
+    """Последние max_size трасс в памяти процесса"""
+
+    def __init__(self, max_size=DEFAULT_BUFFER_SIZE):
+        self.max_size = max_size
+        self._traces = deque(maxlen=max_size)
+        self._lock = threading.Lock()
+        self.recorded = 0
+
+    def add(self, trace):
+        with self._lock:
+            self._traces.append(trace)
+            self.recorded += 1
+
+    def recent(self, limit=None, session_id=None, min_duration_ms=None):
+        """Трассы от новых к старым с необязательными фильтрами"""
+        with self._lock:
+            traces = list(self._traces)
+        result = []
+        for trace in reversed(traces):
+            if session_id and trace.session_id != session_id:
+                continue
+            if min_duration_ms is not None and (trace.duration or 0) * 1000 < min_duration_ms:
+                continue
+            result.append(trace.to_dict())
+            if limit and len(result) >= limit:
+                break
+        return result
+
+    def get(self, trace_id):
+        with self._lock:
+            for trace in self._traces:
+                if trace.trace_id == trace_id:
+                    return trace.to_dict()
+        return None
+
+    def stats(self):
+        return {"size": len(self._traces), "max_size": self.max_size, "recorded": self.recorded}
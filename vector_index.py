@@ -0,0 +1,236 @@
+"""
+Типы FAISS индекса: точный (flat), IVF и HNSW, и способы хранения векторов (кодеки).
+
+build_index_local.py строит индекс выбранного типа и записывает тип, кодек и параметры в
+index_metadata.json ("index_type", "codec", "index_params"). main.py при загрузке индекса применяет
+параметры поиска (nprobe для IVF, efSearch для HNSW) из метаданных.
+
+Кодеки (для 1536-мерных векторов text-embedding-3-small):
+    none - float32, 6144 байта на вектор
+    fp16 - скалярное квантование в float16, 3072 байта, потери точности почти нет
+    int8 - скалярное квантование в 8 бит, 1536 байт
+    pq   - product quantization, pq_m байт на вектор (по умолчанию наибольший делитель размерности до 96), заметная потеря recall
+Квантованный индекс сохраняется и читается тем же faiss.write_index / read_index,
+поэтому FAISS.load_local загружает его без изменений.
+
+Уменьшенная размерность: text-embedding-3 обучена так, что первые N координат эмбеддинга
+после нормировки сами являются эмбеддингом (так работает параметр dimensions в API).
+Индекс строится по укороченным векторам, а запрос укорачивается тем же reduce_dimensions().
+При двухэтапном поиске полные векторы хранятся на диске (full_vectors.npy, читается через mmap),
+и найденные по укороченным векторам кандидаты переранжируются точным расстоянием по полным.
+
+Отображение в память: faiss 1.7.4 умеет читать через mmap только списки IVF индексов, поэтому
+для mmap точный индекс сохраняется как IVF с одним кластером (nprobe=1 просматривает все векторы,
+результат совпадает с flat). Несколько воркеров тогда делят одну копию векторов в page cache.
+HNSW через mmap не читается.
+"""
+
+import math
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "ivf", "hnsw")
+CODECS = ("none", "fp16", "int8", "pq")
+
+DEFAULT_NPROBE = 16
+DEFAULT_HNSW_M = 32
+DEFAULT_EF_CONSTRUCTION = 200
+DEFAULT_EF_SEARCH = 64
+DEFAULT_PQ_M = 96  # число подвекторов PQ, должно делить размерность
+DEFAULT_RESCORE_CANDIDATES = 100  # кандидатов первого этапа для переранжирования по полным векторам
+
+FULL_VECTORS_FILE = "full_vectors.npy"
+
+_SCALAR_CODECS = {"none": "Flat", "fp16": "SQfp16", "int8": "SQ8"}
+
+
+def default_nlist(vector_count):
+    """Число кластеров IVF по умолчанию: около 4 * sqrt(N), но не больше N / 39 для обучения"""
+    return max(1, min(int(4 * math.sqrt(vector_count)), vector_count // 39 or 1))
+
+
+def default_pq_m(dimension, preferred=DEFAULT_PQ_M):
+    """Число подвекторов PQ по умолчанию: наибольший делитель размерности, не больше preferred"""
+    return next(m for m in range(min(preferred, dimension), 0, -1) if dimension % m == 0)
+
+
+def reduce_dimensions(vectors, dimensions):
+    """Укорачивает эмбеддинги до dimensions координат и нормирует их заново"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if not dimensions or dimensions >= vectors.shape[-1]:
+        return vectors
+    reduced = vectors[..., :dimensions]
+    norms = np.linalg.norm(reduced, axis=-1, keepdims=True)
+    return np.ascontiguousarray(reduced / np.maximum(norms, 1e-12), dtype=np.float32)
+
+
+def rescore(full_vectors, vector, positions, k):
+    """Второй этап: переранжирует позиции по точному расстоянию L2 между полными векторами"""
+    if len(positions) == 0:
+        return []
+    order = np.argsort(positions)  # чтение из mmap по возрастанию позиций
+    sorted_positions = np.asarray(positions, dtype=np.int64)[order]
+    candidate_vectors = np.asarray(full_vectors[sorted_positions], dtype=np.float32)
+    distances = ((candidate_vectors - np.asarray(vector, dtype=np.float32)) ** 2).sum(axis=1)
+    best = np.argsort(distances)[:k]
+    return [int(sorted_positions[i]) for i in best]
+
+
+def pq_bits(index_type, vector_count):
+    """Бит на код PQ: 8, если векторов хватает для обучения 256 центроидов, иначе меньше.
+
+    HNSW поддерживает только 8-битный PQ.
+    """
+    if index_type == "hnsw":
+        return 8
+    return max(4, min(8, int(math.log2(max(vector_count // 39, 1)))))
+
+
+def factory_string(index_type, codec, nlist=0, hnsw_m=DEFAULT_HNSW_M, pq_m=DEFAULT_PQ_M, vector_count=0,
+                   mmap=False):
+    """Строка faiss.index_factory для сочетания типа индекса и кодека"""
+    if codec not in CODECS:
+        raise ValueError(f"Неизвестный кодек: {codec}")
+    if codec == "pq":
+        bits = pq_bits(index_type, vector_count)
+        storage = f"PQ{pq_m}" if bits == 8 else f"PQ{pq_m}x{bits}"
+    else:
+        storage = _SCALAR_CODECS[codec]
+
+    if index_type == "flat":
+        return f"IVF1,{storage}" if mmap else storage
+    if index_type == "ivf":
+        return f"IVF{nlist},{storage}"
+    if index_type == "hnsw":
+        return f"HNSW{hnsw_m}" if codec == "none" else f"HNSW{hnsw_m}_{storage}"
+    raise ValueError(f"Неизвестный тип индекса: {index_type}")
+
+
+def build_faiss_index(vectors, index_type="flat", codec="none", nlist=0, nprobe=DEFAULT_NPROBE,
+                      hnsw_m=DEFAULT_HNSW_M, ef_construction=DEFAULT_EF_CONSTRUCTION,
+                      ef_search=DEFAULT_EF_SEARCH, pq_m=None, mmap=False):
+    """Строит FAISS индекс заданного типа и кодека по матрице векторов (L2, как FAISS.from_documents).
+
+    mmap=True - формат, который read_index() может отобразить в память (flat хранится как IVF1).
+    pq_m=None - default_pq_m() для размерности векторов.
+    Возвращает (индекс, параметры для index_metadata.json).
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    count, dimension = vectors.shape
+    pq_m = pq_m or default_pq_m(dimension)
+    if codec == "pq" and dimension % pq_m:
+        raise ValueError(f"pq_m={pq_m} должно делить размерность {dimension}")
+    if mmap and index_type == "hnsw":
+        raise ValueError("HNSW индекс не поддерживает чтение через mmap")
+
+    params = {"codec": codec}
+    if mmap:
+        params["mmap"] = True
+    if index_type == "flat" and mmap:
+        nlist = 1
+        params.update({"nlist": 1, "nprobe": 1})
+    elif index_type == "ivf":
+        nlist = nlist or default_nlist(count)
+        params.update({"nlist": nlist, "nprobe": min(nprobe, nlist)})
+    elif index_type == "hnsw":
+        params.update({"M": hnsw_m, "ef_construction": ef_construction, "ef_search": ef_search})
+    if codec == "pq":
+        params.update({"pq_m": pq_m, "pq_bits": pq_bits(index_type, count)})
+
+    index = faiss.index_factory(dimension, factory_string(index_type, codec, nlist, hnsw_m, pq_m, count, mmap),
+                                faiss.METRIC_L2)
+    hnsw = _as_hnsw(index)
+    if hnsw is not None:
+        hnsw.hnsw.efConstruction = ef_construction
+    if not index.is_trained:
+        index.train(vectors)
+
+    index.add(vectors)
+    configure_search(index, params)
+    return index, params
+
+
+def read_index(path, mmap=False):
+    """Читает индекс с диска; при mmap=True списки IVF отображаются в память только для чтения"""
+    if mmap:
+        return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    return faiss.read_index(path)
+
+
+def is_mmap_compatible(index):
+    """Векторы индекса хранятся в списках IVF и при чтении с mmap не копируются в память процесса"""
+    return _as_ivf(index) is not None
+
+
+def bytes_per_vector(index):
+    """Размер хранимого кода одного вектора в байтах (без структур IVF / графа HNSW)"""
+    index = faiss.downcast_index(index)
+    ivf = _as_ivf(index)
+    if ivf is not None:
+        return ivf.code_size
+    hnsw = _as_hnsw(index)
+    if hnsw is not None:
+        index = faiss.downcast_index(hnsw.storage)
+    return getattr(index, "code_size", index.d * 4)
+
+
+def configure_search(index, params, nprobe=None, ef_search=None):
+    """Применяет параметры поиска к загруженному индексу; явные значения важнее метаданных"""
+    ivf = _as_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = nprobe or params.get("nprobe", DEFAULT_NPROBE)
+        # Прямое отображение позиций нужно для восстановления векторов в filtered_search
+        ivf.make_direct_map()
+    hnsw = _as_hnsw(index)
+    if hnsw is not None:
+        hnsw.hnsw.efSearch = ef_search or params.get("ef_search", DEFAULT_EF_SEARCH)
+
+
+def describe(index):
+    """Краткое описание индекса для логов и /index-info"""
+    info = {"type": "flat"}
+    ivf = _as_ivf(index)
+    hnsw = _as_hnsw(index)
+    if ivf is not None and ivf.nlist == 1:
+        info = {"type": "flat", "layout": "ivf1"}
+    elif ivf is not None:
+        info = {"type": "ivf", "nlist": ivf.nlist, "nprobe": ivf.nprobe}
+    elif hnsw is not None:
+        info = {"type": "hnsw", "ef_search": hnsw.hnsw.efSearch}
+    info.update({
+        "class": type(faiss.downcast_index(index)).__name__,
+        "dimension": index.d,
+        "bytes_per_vector": bytes_per_vector(index),
+    })
+    return info
+
+
+def filtered_search(index, vector, candidates, k):
+    """Точный поиск только среди указанных позиций, без просмотра всего корпуса.
+
+    Векторы кандидатов восстанавливаются из индекса и сравниваются с запросом напрямую,
+    поэтому результат одинаков для flat, IVF и HNSW (фильтр внутри обхода графа HNSW
+    на малом наборе кандидатов теряет результаты).
+    Возвращает позиции по возрастанию расстояния L2.
+    """
+    if len(candidates) == 0:
+        return []
+    candidate_vectors = index.reconstruct_batch(np.asarray(candidates, dtype=np.int64))
+    distances = ((candidate_vectors - np.asarray(vector, dtype=np.float32)) ** 2).sum(axis=1)
+    k = min(k, len(candidates))
+    top = np.argpartition(distances, k - 1)[:k]
+    top = top[np.argsort(distances[top])]
+    return [int(candidates[i]) for i in top]
+
+
+def _as_ivf(index):
+    try:
+        return faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return None
+
+
+def _as_hnsw(index):
+    index = faiss.downcast_index(index)
+    return index if isinstance(index, faiss.IndexHNSW) else None